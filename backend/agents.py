@@ -2,16 +2,24 @@
 Multi-Agent System for KANZ
 Specialized agents for different types of analysis
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, Optional
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
 from loguru import logger
 from enum import Enum
+from uuid import UUID
+import asyncio
 import time
 
 from config import settings
+from context_packing import context_packer
 from document_processor import doc_processor
+from history import session_history
+from prompt_budget import count_tokens, prompt_budget
+from router import embedding_router
+from semantic_cache import semantic_cache
+from tracing import RequestTrace
 
 
 class AgentType(str, Enum):
@@ -37,11 +45,53 @@ class BaseAgent:
         )
         logger.info(f"Initialized {agent_type} agent")
     
+    def _build_messages(
+        self,
+        query: str,
+        context: List[Dict] = None,
+        chat_history: List[Dict] = None,
+        history_summary: Optional[str] = None
+    ) -> List:
+        """Build the LLM message list from history, context and query"""
+        messages = [SystemMessage(content=self.system_prompt)]
+        
+        # Running summary of turns that no longer fit the prompt budget
+        if history_summary:
+            messages.append(SystemMessage(
+                content=f"Summary of the earlier conversation:\n{history_summary}"
+            ))
+        
+        # Add chat history if provided (already trimmed to the token budget)
+        if chat_history:
+            for msg in chat_history:
+                if msg["role"] == "user":
+                    messages.append(HumanMessage(content=msg["content"]))
+                elif msg["role"] == "assistant":
+                    messages.append(AIMessage(content=msg["content"]))
+        
+        # Add context if provided
+        if context:
+            context_text = self._format_context(context)
+            enhanced_query = f"""Based on the following context from Saudi Investment documents:
+
+{context_text}
+
+User Question: {query}
+
+Please provide a comprehensive answer based on the context provided."""
+        else:
+            enhanced_query = query
+        
+        messages.append(HumanMessage(content=enhanced_query))
+        return messages
+    
     async def invoke(
         self,
         query: str,
         context: List[Dict] = None,
-        chat_history: List[Dict] = None
+        chat_history: List[Dict] = None,
+        history_summary: Optional[str] = None,
+        trace: Optional[RequestTrace] = None
     ) -> Dict[str, Any]:
         """
         Invoke the agent with a query
@@ -50,6 +100,8 @@ class BaseAgent:
             query: User query
             context: Retrieved document chunks
             chat_history: Previous chat messages
+            history_summary: Summary of earlier turns
+            trace: Request trace receiving the token usage
             
         Returns:
             Agent response with metadata
@@ -58,47 +110,62 @@ class BaseAgent:
             start_time = time.time()
             
             # Build messages
-            messages = [SystemMessage(content=self.system_prompt)]
-            
-            # Add chat history if provided
-            if chat_history:
-                for msg in chat_history[-5:]:  # Last 5 messages
-                    if msg["role"] == "user":
-                        messages.append(HumanMessage(content=msg["content"]))
-                    elif msg["role"] == "assistant":
-                        messages.append(AIMessage(content=msg["content"]))
-            
-            # Add context if provided
-            if context:
-                context_text = self._format_context(context)
-                enhanced_query = f"""Based on the following context from Saudi Investment documents:
-
-{context_text}
-
-User Question: {query}
-
-Please provide a comprehensive answer based on the context provided."""
-            else:
-                enhanced_query = query
-            
-            messages.append(HumanMessage(content=enhanced_query))
+            messages = self._build_messages(query, context, chat_history, history_summary)
             
             # Get response from LLM
             response = await self.llm.ainvoke(messages)
             
             elapsed_time = int((time.time() - start_time) * 1000)
+            token_usage = response.response_metadata.get("token_usage", {})
+            if trace is not None:
+                trace.record_usage(token_usage)
             
             return {
                 "agent_type": self.agent_type,
                 "content": response.content,
                 "sources": context or [],
-                "response_time_ms": elapsed_time
+                "response_time_ms": elapsed_time,
+                "tokens_used": token_usage.get("total_tokens", 0)
             }
             
         except Exception as e:
             logger.error(f"Error in {self.agent_type} agent: {e}")
             raise
     
+    async def stream(
+        self,
+        query: str,
+        context: List[Dict] = None,
+        chat_history: List[Dict] = None,
+        history_summary: Optional[str] = None,
+        trace: Optional[RequestTrace] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream the agent's answer token by token
+        
+        Args:
+            query: User query
+            context: Retrieved document chunks
+            chat_history: Previous chat messages
+            history_summary: Summary of earlier turns
+            trace: Request trace receiving the token usage
+            
+        Yields:
+            Content fragments as they are generated
+        """
+        try:
+            messages = self._build_messages(query, context, chat_history, history_summary)
+            
+            async for chunk in self.llm.astream(messages):
+                if trace is not None:
+                    trace.record_usage_metadata(getattr(chunk, "usage_metadata", None))
+                if chunk.content:
+                    yield chunk.content
+                    
+        except Exception as e:
+            logger.error(f"Error streaming from {self.agent_type} agent: {e}")
+            raise
+    
     def _format_context(self, context: List[Dict]) -> str:
         """Format context chunks for prompt"""
         formatted = []
@@ -214,16 +281,62 @@ class CoordinatorAgent:
         
         self.routing_llm = ChatGroq(
             api_key=settings.groq_api_key,
-            model_name="llama3-8b-8192",  # Faster model for routing
+            model_name=settings.routing_model,  # Faster model for routing
             temperature=0.0
         )
         
         logger.info("Coordinator agent initialized with all specialized agents")
     
-    async def route_query(self, query: str) -> AgentType:
+    async def route_query(
+        self,
+        query: str,
+        query_embedding: List[float] = None
+    ) -> AgentType:
         """
         Determine which agent should handle the query
         
+        Uses the local embedding router when a query embedding is available
+        and falls back to the routing LLM when its confidence margin is low.
+        
+        Args:
+            query: User query
+            query_embedding: Embedding of the query, if already computed
+            
+        Returns:
+            AgentType for routing
+        """
+        if settings.local_router_enabled and query_embedding is not None:
+            try:
+                label, margin = await embedding_router.classify(query_embedding)
+                if embedding_router.is_confident(margin):
+                    embedding_router.local_decisions += 1
+                    logger.debug(f"Local router chose {label} (margin {margin:.3f})")
+                    return self._parse_agent_choice(label)
+                
+                embedding_router.fallbacks += 1
+                logger.debug(f"Local router margin {margin:.3f} too low, using LLM")
+                
+            except Exception as e:
+                logger.error(f"Error in local router: {e}")
+        
+        return await self.route_query_llm(query)
+    
+    @staticmethod
+    def _parse_agent_choice(agent_choice: str) -> AgentType:
+        """Map a STRATEGIC / FINANCIAL / RISK / GENERAL label to an AgentType"""
+        if "STRATEGIC" in agent_choice:
+            return AgentType.STRATEGIC
+        elif "FINANCIAL" in agent_choice:
+            return AgentType.FINANCIAL
+        elif "RISK" in agent_choice:
+            return AgentType.RISK
+        else:
+            return AgentType.GENERAL
+    
+    async def route_query_llm(self, query: str) -> AgentType:
+        """
+        Determine which agent should handle the query using the routing LLM
+        
         Args:
             query: User query
             
@@ -245,25 +358,203 @@ Respond with ONLY ONE WORD: STRATEGIC, FINANCIAL, RISK, or GENERAL"""
         try:
             response = await self.routing_llm.ainvoke([HumanMessage(content=routing_prompt)])
             agent_choice = response.content.strip().upper()
+            return self._parse_agent_choice(agent_choice)
             
-            if "STRATEGIC" in agent_choice:
-                return AgentType.STRATEGIC
-            elif "FINANCIAL" in agent_choice:
-                return AgentType.FINANCIAL
-            elif "RISK" in agent_choice:
-                return AgentType.RISK
-            else:
-                return AgentType.GENERAL
-                
         except Exception as e:
             logger.error(f"Error routing query: {e}")
             return AgentType.GENERAL
     
+    async def _timed(self, timings: Dict[str, float], stage: str, coro):
+        """Await a pipeline stage and record its duration in milliseconds"""
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+    
+    async def _retrieve(
+        self,
+        query: str,
+        embed_task: asyncio.Task,
+        timings: Dict[str, float],
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Dict]:
+        """Retrieve context once the query embedding is ready"""
+        query_embedding = await embed_task
+        return await self._timed(timings, "retrieve", doc_processor.search_documents(
+            query=query,
+            top_k=settings.top_k_results,
+            query_embedding=query_embedding,
+            timings=timings,
+            filters=filters,
+            with_embeddings=settings.context_packing_enabled
+        ))
+    
+    async def _route(
+        self,
+        query: str,
+        embed_task: asyncio.Task,
+        timings: Dict[str, float]
+    ) -> AgentType:
+        """Route the query, waiting for its embedding only if the local router needs it"""
+        query_embedding = await embed_task if settings.local_router_enabled else None
+        return await self._timed(timings, "route", self.route_query(query, query_embedding))
+    
+    async def _prepare(
+        self,
+        query: str,
+        agent_type: Optional[AgentType],
+        session_id: Optional[UUID],
+        chat_history: Optional[List[Dict]],
+        timings: Dict[str, float],
+        filters: Optional[Dict[str, Any]] = None,
+        session: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Run embedding/retrieval, routing and history loading concurrently
+        
+        Routing and history loading are cancelled on a semantic cache hit;
+        if any stage fails, the remaining stages are cancelled.
+        
+        Returns:
+            Pipeline state: context, agent_type, chat_history, history_summary,
+            history_metadata, history_backlog_before, query_embedding,
+            cache_key, chunk_ids and the cached response (if any)
+        """
+        cache_key = agent_type.value if agent_type else "auto"
+        history_summary = None
+        history_metadata = None
+        history_backlog_before = None
+        
+        async with asyncio.TaskGroup() as tg:
+            embed_task = tg.create_task(
+                self._timed(timings, "embed", doc_processor.embed_query(query))
+            )
+            retrieval_task = tg.create_task(self._retrieve(query, embed_task, timings, filters))
+            route_task = tg.create_task(
+                self._route(query, embed_task, timings)
+            ) if agent_type is None else None
+            history_task = tg.create_task(
+                self._timed(timings, "history", session_history.load(session_id, session))
+            ) if chat_history is None and session_id is not None else None
+            
+            context = await retrieval_task
+            query_embedding = embed_task.result()
+            chunk_ids = [chunk["id"] for chunk in context]
+            
+            # Reuse the answer of a paraphrased query with the same sources;
+            # routed queries share one key so a hit skips routing as well
+            cached = None
+            if settings.semantic_cache_enabled:
+                cached = await self._timed(
+                    timings,
+                    "cache_lookup",
+                    semantic_cache.lookup(query_embedding, cache_key, chunk_ids)
+                )
+            
+            if cached is not None:
+                for task in (route_task, history_task):
+                    if task is not None:
+                        task.cancel()
+            else:
+                if route_task is not None:
+                    agent_type = await route_task
+                    logger.info(f"Query routed to: {agent_type}")
+                if history_task is not None:
+                    history = await history_task
+                    chat_history = history["messages"]
+                    history_summary = history["summary"]
+                    history_metadata = history["metadata"]
+                    history_backlog_before = history["backlog_before"]
+        
+        return {
+            "context": context,
+            "agent_type": agent_type,
+            "chat_history": chat_history,
+            "history_summary": history_summary,
+            "history_metadata": history_metadata,
+            "history_backlog_before": history_backlog_before,
+            "query_embedding": query_embedding,
+            "cache_key": cache_key,
+            "chunk_ids": chunk_ids,
+            "cached": cached
+        }
+    
+    async def _fit_prompt(
+        self,
+        agent: BaseAgent,
+        query: str,
+        state: Dict[str, Any],
+        session_id: Optional[UUID],
+        timings: Dict[str, float]
+    ) -> Dict[str, Any]:
+        """
+        Pack retrieved context and trim history to the prompt token budget
+        
+        Turns that no longer fit, and older ones outside the fetched tail,
+        are summarized in the background so the next request still sees
+        them, condensed.
+        """
+        context = state["context"]
+        tokens_saved = 0
+        if settings.context_packing_enabled and context:
+            try:
+                context_packed = await self._timed(
+                    timings,
+                    "context_packing",
+                    context_packer.pack(state["query_embedding"], context)
+                )
+                context = context_packed["context"]
+                tokens_saved = context_packed["tokens_saved"]
+            except Exception as e:
+                logger.warning(f"Context packing failed, sending chunks as retrieved: {e}")
+                # Retrieval vectors are only for packing; they are not sources
+                context = [
+                    {key: value for key, value in chunk.items() if key != "embedding"}
+                    for chunk in context
+                ]
+        
+        start = time.perf_counter()
+        packed = prompt_budget.pack(
+            agent.system_prompt,
+            query,
+            context,
+            state["chat_history"],
+            state["history_summary"]
+        )
+        timings["prompt_budget"] = round((time.perf_counter() - start) * 1000, 2)
+        packed["tokens_saved"] = tokens_saved
+        
+        if state["history_metadata"] is not None:
+            session_history.schedule_summary(
+                session_id,
+                state["history_summary"],
+                state["history_metadata"],
+                packed["dropped"],
+                state["history_backlog_before"]
+            )
+        return packed
+    
+    def get_agent(self, agent_type: Optional[AgentType]) -> BaseAgent:
+        """Select the specialist agent for an agent type"""
+        agent_map = {
+            AgentType.STRATEGIC: self.strategic_agent,
+            AgentType.FINANCIAL: self.financial_agent,
+            AgentType.RISK: self.risk_agent,
+            AgentType.GENERAL: self.general_agent
+        }
+        
+        return agent_map.get(agent_type, self.general_agent)
+    
     async def process_query(
         self,
         query: str,
         agent_type: Optional[AgentType] = None,
-        chat_history: List[Dict] = None
+        chat_history: List[Dict] = None,
+        session_id: Optional[UUID] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        trace: Optional[RequestTrace] = None,
+        session: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         Process a query through the appropriate agent
@@ -271,45 +562,172 @@ Respond with ONLY ONE WORD: STRATEGIC, FINANCIAL, RISK, or GENERAL"""
         Args:
             query: User query
             agent_type: Specific agent to use (or None for auto-routing)
-            chat_history: Previous chat messages
+            chat_history: Previous chat messages (loaded from session_id if None)
+            session_id: Chat session to load history from
+            filters: Retrieval filters (source, document_id, type, date_from, date_to)
+            trace: Request trace to record into (a new one if None)
+            session: The session row, if the caller already fetched it
             
         Returns:
-            Agent response with metadata
+            Agent response with metadata, token usage and per-stage timings
         """
         try:
-            # Auto-route if no agent specified
-            if agent_type is None:
-                agent_type = await self.route_query(query)
-                logger.info(f"Query routed to: {agent_type}")
+            trace = trace or RequestTrace()
+            timings = trace.timings
             
-            # Retrieve relevant context
-            context = await doc_processor.search_documents(
-                query=query,
-                top_k=settings.top_k_results
-            )
-            
-            # Select appropriate agent
-            agent_map = {
-                AgentType.STRATEGIC: self.strategic_agent,
-                AgentType.FINANCIAL: self.financial_agent,
-                AgentType.RISK: self.risk_agent,
-                AgentType.GENERAL: self.general_agent
-            }
+            try:
+                state = await self._prepare(
+                    query, agent_type, session_id, chat_history, timings, filters, session
+                )
+            except ExceptionGroup as eg:
+                # Surface the first stage failure rather than the group
+                raise eg.exceptions[0]
             
-            agent = agent_map.get(agent_type, self.general_agent)
-            
-            # Get response
-            response = await agent.invoke(
-                query=query,
-                context=context,
-                chat_history=chat_history
-            )
+            if state["cached"] is not None:
+                logger.info(f"Semantic cache hit for {state['cache_key']} query")
+                response = dict(state["cached"])
+                response["cache_hit"] = True
+                response["tokens_used"] = 0
+            else:
+                agent = self.get_agent(state["agent_type"])
+                packed = await self._fit_prompt(agent, query, state, session_id, timings)
+                
+                # Get response
+                response = await self._timed(timings, "llm", agent.invoke(
+                    query=query,
+                    context=packed["context"],
+                    chat_history=packed["chat_history"],
+                    history_summary=packed["history_summary"],
+                    trace=trace
+                ))
+                if not trace.total_tokens:
+                    trace.estimate_usage(packed["prompt_tokens"], count_tokens(response["content"]))
+                response["tokens_used"] = trace.total_tokens
+                response["tokens_saved"] = packed["tokens_saved"]
+                
+                if settings.semantic_cache_enabled:
+                    semantic_cache.store(
+                        state["query_embedding"],
+                        state["cache_key"],
+                        state["chunk_ids"],
+                        response
+                    )
             
+            response["response_time_ms"] = trace.finish()
+            response.update(trace.to_dict())
             return response
             
         except Exception as e:
             logger.error(f"Error processing query: {e}")
             raise
+    
+    async def stream_query(
+        self,
+        query: str,
+        agent_type: Optional[AgentType] = None,
+        chat_history: List[Dict] = None,
+        session_id: Optional[UUID] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        trace: Optional[RequestTrace] = None,
+        session: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a query and stream the answer as events
+        
+        Emits a "meta" event with the routing decision and sources, then
+        "token" events as the specialist generates, then a "done" event
+        carrying the assembled response.
+        
+        Args:
+            query: User query
+            agent_type: Specific agent to use (or None for auto-routing)
+            chat_history: Previous chat messages (loaded from session_id if None)
+            session_id: Chat session to load history from
+            filters: Retrieval filters (source, document_id, type, date_from, date_to)
+            trace: Request trace to record into (a new one if None)
+            session: The session row, if the caller already fetched it
+            
+        Yields:
+            Event dicts with "event" and "data" keys
+        """
+        trace = trace or RequestTrace()
+        timings = trace.timings
+        
+        try:
+            state = await self._prepare(
+                query, agent_type, session_id, chat_history, timings, filters, session
+            )
+        except ExceptionGroup as eg:
+            logger.error(f"Error processing query: {eg.exceptions[0]}")
+            raise eg.exceptions[0]
+        
+        cached = state["cached"]
+        agent = self.get_agent(state["agent_type"])
+        packed = None
+        if cached is not None:
+            resolved_type = cached["agent_type"]
+            sources = cached["sources"]
+        else:
+            packed = await self._fit_prompt(agent, query, state, session_id, timings)
+            resolved_type = agent.agent_type
+            sources = packed["context"]
+        
+        yield {
+            "event": "meta",
+            "data": {
+                "agent_type": resolved_type,
+                "sources": sources,
+                "cache_hit": cached is not None
+            }
+        }
+        
+        if cached is not None:
+            logger.info(f"Semantic cache hit for {state['cache_key']} query")
+            content = cached["content"]
+            yield {"event": "token", "data": {"content": content}}
+        else:
+            llm_start = time.perf_counter()
+            parts = []
+            
+            async for token in agent.stream(
+                query=query,
+                context=sources,
+                chat_history=packed["chat_history"],
+                history_summary=packed["history_summary"],
+                trace=trace
+            ):
+                if not parts:
+                    timings["llm_first_token"] = round((time.perf_counter() - llm_start) * 1000, 2)
+                parts.append(token)
+                yield {"event": "token", "data": {"content": token}}
+            
+            timings["llm"] = round((time.perf_counter() - llm_start) * 1000, 2)
+            content = "".join(parts)
+            
+            # Streamed responses may not carry usage; count locally instead
+            if not trace.total_tokens:
+                trace.estimate_usage(packed["prompt_tokens"], count_tokens(content))
+        
+        response = {
+            "agent_type": resolved_type,
+            "content": content,
+            "sources": sources,
+            "response_time_ms": trace.finish(),
+            "tokens_used": trace.total_tokens,
+            "tokens_saved": packed["tokens_saved"] if packed else 0,
+            "cache_hit": cached is not None,
+            **trace.to_dict()
+        }
+        
+        if cached is None and settings.semantic_cache_enabled:
+            semantic_cache.store(
+                state["query_embedding"],
+                state["cache_key"],
+                state["chunk_ids"],
+                {key: response[key] for key in ("agent_type", "content", "sources", "tokens_used")}
+            )
+        
+        yield {"event": "done", "data": response}
 
 
 # Global coordinator instance
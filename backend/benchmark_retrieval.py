@@ -0,0 +1,146 @@
+"""
+Retrieval Benchmark Script
+Compares recall@k, latency and memory of the pgvector RPC and the local
+in-process index, including its int8 / binary quantized variants and the
+pgvector ANN search settings (ivfflat.probes, hnsw.ef_search)
+"""
+import argparse
+import asyncio
+import random
+import time
+from pathlib import Path
+from typing import Dict, List
+from loguru import logger
+import numpy as np
+import sys
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent))
+
+from embeddings import embeddings
+from retrieval import LocalIndexBackend, PgvectorBackend, RetrievalBackend
+
+
+SAMPLE_QUERIES = [
+    "What are NEOM incentives?",
+    "Compare NEOM vs KAEC for a data center",
+    "What is the corporate tax rate in special economic zones?",
+    "What are the regional headquarters (RHQ) requirements?",
+    "What data localization rules apply to cloud providers?",
+    "What is the expected IRR of the investment?",
+    "How does the strategy align with Vision 2030?",
+    "What are the main geopolitical risks?",
+]
+
+
+async def time_backend(
+    backend: RetrievalBackend,
+    query_embeddings: List[List[float]],
+    top_k: int,
+    repeat: int
+) -> Dict:
+    """Run every query through a backend and record latencies"""
+    results, latencies = [], []
+    for query_embedding in query_embeddings:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = await backend.search(query_embedding, top_k=top_k, threshold=-1.0)
+            latencies.append((time.perf_counter() - start) * 1000)
+        results.append([row["id"] for row in found])
+    return {"results": results, "latencies": latencies}
+
+
+def recall_at_k(truth: List[List[str]], found: List[List[str]], k: int) -> float:
+    """Mean fraction of the exact top-k found by another backend"""
+    scores = [
+        len(set(t[:k]) & set(f[:k])) / min(k, len(t))
+        for t, f in zip(truth, found)
+        if t
+    ]
+    return float(np.mean(scores)) if scores else 0.0
+
+
+def log_latency(name: str, latencies: List[float]):
+    """Log latency percentiles"""
+    logger.info(
+        f"{name:<10} p50={np.percentile(latencies, 50):.3f}ms  "
+        f"p95={np.percentile(latencies, 95):.3f}ms  "
+        f"p99={np.percentile(latencies, 99):.3f}ms"
+    )
+
+
+async def benchmark(args: argparse.Namespace):
+    """Benchmark both backends against exact local search"""
+    local = LocalIndexBackend()
+    await local.start()
+    if not local.rows:
+        logger.warning("No chunks indexed; run ingest_documents.py first")
+        return
+    
+    # Mix hand-written queries with chunk excerpts sampled from the corpus
+    rng = random.Random(args.seed)
+    excerpts = [
+        row["content"][:200]
+        for row in rng.sample(local.rows, min(args.sample_chunks, len(local.rows)))
+    ]
+    queries = SAMPLE_QUERIES + excerpts
+    query_embeddings = (await embeddings.aembed_queries(queries)).tolist()
+    
+    logger.info(f"Benchmarking {len(queries)} queries over {len(local.rows)} chunks (k={args.top_k})")
+    logger.info(f"Local index memory: {local.get_stats()['memory_bytes'] / 1024 / 1024:.2f} MiB")
+    
+    exact = await time_backend(local, query_embeddings, args.top_k, args.repeat)
+    remote = await time_backend(PgvectorBackend(), query_embeddings, args.top_k, 1)
+    
+    log_latency("local", exact["latencies"])
+    log_latency("pgvector", remote["latencies"])
+    logger.info(
+        f"pgvector recall@{args.top_k} vs exact: "
+        f"{recall_at_k(exact['results'], remote['results'], args.top_k):.3f}"
+    )
+    
+    # Recall vs latency for the ANN search knobs (only the built index type applies)
+    sweeps = [("probes", PgvectorBackend(probes=p), p) for p in args.probes]
+    sweeps += [("ef", PgvectorBackend(ef_search=ef), ef) for ef in args.ef_search]
+    for knob, backend, value in sweeps:
+        swept = await time_backend(backend, query_embeddings, args.top_k, 1)
+        name = f"{knob}={value}"
+        log_latency(name, swept["latencies"])
+        logger.info(
+            f"{name:<10} recall@{args.top_k}="
+            f"{recall_at_k(exact['results'], swept['results'], args.top_k):.3f}"
+        )
+    
+    # Recall vs memory for quantized first-pass codes with re-ranking
+    vectors = [np.array(vector) for vector in local.vectors]
+    for quantization in ("int8", "binary"):
+        for rerank_factor in args.rerank_factors:
+            index = LocalIndexBackend(quantization=quantization, rerank_factor=rerank_factor)
+            index.build(local.rows, vectors)
+            quantized = await time_backend(index, query_embeddings, args.top_k, args.repeat)
+            
+            stats = index.get_stats()
+            name = f"{quantization}x{rerank_factor}"
+            log_latency(name, quantized["latencies"])
+            logger.info(
+                f"{name:<10} recall@{args.top_k}="
+                f"{recall_at_k(exact['results'], quantized['results'], args.top_k):.3f}  "
+                f"memory={stats['memory_bytes'] / 1024:.1f} KiB "
+                f"(float32 {stats['full_precision_bytes'] / 1024:.1f} KiB)"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare pgvector and local retrieval backends")
+    parser.add_argument("--top-k", type=int, default=5, help="Results per query")
+    parser.add_argument("--sample-chunks", type=int, default=50, help="Chunk excerpts used as extra queries")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed repetitions per query for the local index")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for sampling")
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 4, 10],
+                        help="Candidate multipliers to sweep for quantized indexes")
+    parser.add_argument("--probes", type=int, nargs="*", default=[1, 5, 10, 20],
+                        help="ivfflat.probes values to sweep on pgvector")
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[20, 40, 100, 200],
+                        help="hnsw.ef_search values to sweep on pgvector")
+    
+    asyncio.run(benchmark(parser.parse_args()))
@@ -0,0 +1,170 @@
+"""
+Query Plan Check Script
+Calls match_document_chunks with auto_explain logging its nested statements
+and fails if the planner stops using an index (e.g. after a schema or query change)
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+import psycopg2
+import sys
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent))
+
+from config import settings
+
+
+VECTOR_INDEX = "idx_document_chunks_embedding"
+
+SEARCH_CALL = """
+SELECT * FROM match_document_chunks(
+    %(embedding)s::vector, %(threshold)s, %(match_count)s, NULL, NULL,
+    %(document_id)s::uuid, %(source)s, %(metadata)s::jsonb, %(date_from)s, %(date_to)s
+)
+"""
+
+# Marks the chunk search statement among the function's nested statements
+SEARCH_MARKER = "FROM document_chunks dc"
+
+
+def plan_indexes(plan: Dict[str, Any]) -> List[str]:
+    """Collect every index name used anywhere in a JSON plan"""
+    found = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        found.extend(plan_indexes(child))
+    return found
+
+
+def enable_auto_explain(cur):
+    """
+    Have auto_explain send the plan of every statement, including those
+    run inside functions, back to this session as JSON notices
+    """
+    cur.execute("LOAD 'auto_explain'")
+    cur.execute("SET auto_explain.log_min_duration = 0")
+    cur.execute("SET auto_explain.log_nested_statements = on")
+    cur.execute("SET auto_explain.log_format = 'json'")
+    cur.execute("SET client_min_messages = log")
+
+
+def disable_seqscan(cur):
+    """
+    Make sequential scans a last resort, so small tables (where a seq scan
+    is genuinely cheapest) still show whether an index can serve each search
+    """
+    cur.execute("SET enable_seqscan = off")
+
+
+def explain(conn, cur, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Call match_document_chunks and return the plan of its chunk search"""
+    del conn.notices[:]
+    cur.execute(SEARCH_CALL, params)
+    cur.fetchall()
+    
+    for notice in conn.notices:
+        if "{" not in notice:
+            continue
+        logged = json.loads(notice[notice.index("{"):])
+        if SEARCH_MARKER in logged.get("Query Text", ""):
+            return logged["Plan"]
+    raise RuntimeError("auto_explain logged no plan for the chunk search")
+
+
+def check_case(conn, cur, name: str, params: Dict[str, Any], allowed: List[str]) -> bool:
+    """Check that a search case is served by one of the allowed indexes"""
+    used = plan_indexes(explain(conn, cur, params))
+    ok = any(index in used for index in allowed)
+    if ok:
+        logger.info(f"✓ {name}: {', '.join(used)}")
+    else:
+        logger.error(f"✗ {name}: expected {' or '.join(allowed)}, plan used {used or 'no index'}")
+    return ok
+
+
+def sample_row(cur) -> Optional[tuple]:
+    """Take a stored chunk embedding, document and source to query with"""
+    cur.execute(
+        """
+        SELECT embedding::text, document_id, metadata->>'source'
+        FROM document_chunks
+        WHERE embedding IS NOT NULL
+        LIMIT 1
+        """
+    )
+    return cur.fetchone()
+
+
+def build_cases(
+    embedding: str,
+    document_id: Any,
+    source: Optional[str],
+    top_k: int = 5,
+    threshold: float = 0.7
+) -> List[Tuple[str, Dict[str, Any], List[str]]]:
+    """Search cases to check, as (name, call params, allowed indexes)"""
+    base = {
+        "embedding": embedding,
+        "document_id": None,
+        "source": None,
+        "metadata": None,
+        "date_from": None,
+        "date_to": None,
+        "match_count": top_k,
+        "threshold": threshold
+    }
+    return [
+        ("unfiltered", base, [VECTOR_INDEX]),
+        # Selective filters may be served by their own index instead
+        ("source filter", {**base, "source": source}, [VECTOR_INDEX, "idx_document_chunks_source"]),
+        (
+            "metadata filter",
+            {**base, "metadata": json.dumps({"source": source})},
+            [VECTOR_INDEX, "idx_document_chunks_metadata"]
+        ),
+        ("date filter", {**base, "date_from": "2000-01"}, [VECTOR_INDEX, "idx_document_chunks_date"]),
+        # A single document's chunks are few; its btree is as good as the ANN index
+        (
+            "document filter",
+            {**base, "document_id": document_id},
+            [VECTOR_INDEX, "idx_document_chunks_document_id", "idx_document_chunks_content_hash"]
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify chunk searches are index-backed")
+    parser.add_argument("--top-k", type=int, default=5, help="match_count to plan with")
+    parser.add_argument("--threshold", type=float, default=0.7, help="match_threshold to plan with")
+    parser.add_argument(
+        "--no-seqscan",
+        action="store_true",
+        help="Plan with enable_seqscan off, for tables too small for the planner to pick an index"
+    )
+    args = parser.parse_args()
+    
+    conn = psycopg2.connect(settings.database_url)
+    try:
+        with conn.cursor() as cur:
+            row = sample_row(cur)
+            if row is None:
+                logger.warning("No embedded chunks; ingest documents and build the index first")
+                return
+            embedding, document_id, source = row
+            enable_auto_explain(cur)
+            if args.no_seqscan:
+                disable_seqscan(cur)
+            
+            cases = build_cases(embedding, document_id, source, args.top_k, args.threshold)
+            results = [check_case(conn, cur, name, params, allowed) for name, params, allowed in cases]
+    finally:
+        conn.close()
+    
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,11 +30,77 @@ class Settings(BaseSettings):
     chunk_size: int = 1000
     chunk_overlap: int = 200
     top_k_results: int = 5
+    retrieval_backend: str = "pgvector"  # pgvector | local
+    index_quantization: str = "none"  # none | int8 | binary (local backend)
+    rerank_factor: int = 10
+    ivfflat_probes: int = 10
+    hnsw_ef_search: int = 40
+    hybrid_search_enabled: bool = True
+    hybrid_candidate_factor: int = 4
+    hybrid_lexical_min_ratio: float = 0.5
+    embedding_batch_window_ms: float = 5.0
+    embedding_batch_max_size: int = 64
+    embedding_cache_enabled: bool = True
+    embedding_cache_dir: str = ".embedding_cache"
+    
+    # Query Cache Settings
+    query_cache_size: int = 1024
+    query_cache_ttl_seconds: int = 300
+    
+    # Semantic Response Cache Settings
+    semantic_cache_enabled: bool = True
+    semantic_cache_size: int = 512
+    semantic_cache_ttl_seconds: int = 3600
+    semantic_cache_max_distance: float = 0.08
+    semantic_cache_persist: bool = False
     
     # LLM Settings
     llm_model: str = "mixtral-8x7b-32768"
     llm_temperature: float = 0.1
     max_tokens: int = 4096
+    routing_model: str = "llama3-8b-8192"
+    local_router_enabled: bool = True
+    router_min_margin: float = 0.05
+    
+    # Prompt budget and chat history (history beyond the budget is summarized)
+    prompt_token_budget: int = 6000
+    history_token_budget: int = 1500
+    history_fetch_limit: int = 10
+    history_summary_enabled: bool = True
+    history_summary_max_tokens: int = 300
+    
+    # Context packing (merge overlapping chunks, drop near-duplicates, MMR to a token budget)
+    context_packing_enabled: bool = True
+    context_token_budget: int = 3000
+    context_min_overlap_chars: int = 50
+    context_duplicate_threshold: float = 0.95
+    context_mmr_lambda: float = 0.7
+    
+    # Prometheus metrics (/metrics)
+    metrics_enabled: bool = True
+    event_loop_lag_interval_ms: float = 500.0
+    
+    # Analytics (/analytics reads the query_analytics rollups; max buckets per request)
+    analytics_max_buckets: int = 1440
+    
+    # Direct Postgres (pooled, binary vector transport over DATABASE_URL)
+    direct_pg_enabled: bool = False
+    pg_pool_min_size: int = 1
+    pg_pool_max_size: int = 10
+    pg_pool_timeout_seconds: float = 10.0
+    pg_prepared_statements: bool = True
+    
+    # Write-Behind Settings (chat messages and query analytics)
+    write_behind_enabled: bool = True
+    write_behind_queue_size: int = 10000
+    write_behind_flush_interval_ms: float = 200.0
+    write_behind_batch_size: int = 100
+    write_behind_max_retries: int = 3
+    write_behind_retry_backoff_ms: float = 100.0
+    
+    # Concurrency Settings
+    db_executor_workers: int = 16
+    inference_executor_workers: int = 1
     
     class Config:
         env_file = ".env"
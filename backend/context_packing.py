@@ -0,0 +1,246 @@
+"""
+Context Packing for KANZ System
+Merges overlapping chunks, drops near-duplicates and packs context to a token budget
+"""
+from typing import Any, Dict, List, Optional
+from loguru import logger
+import numpy as np
+
+from config import settings
+from embeddings import embeddings
+from prompt_budget import count_tokens, truncate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+
+def _overlap(left: str, right: str, min_chars: int, max_chars: int) -> int:
+    """
+    Length of the longest suffix of left that is a prefix of right
+    
+    Adjacent chunks from the text splitter repeat up to chunk_overlap
+    characters, so only the tail of left needs to be searched.
+    Returns 0 if the overlap is shorter than min_chars.
+    """
+    tail = left[-max_chars:]
+    probe = right[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    
+    pos = tail.find(probe)
+    while pos != -1:
+        if right.startswith(tail[pos:]):
+            return len(tail) - pos
+        pos = tail.find(probe, pos + 1)
+    return 0
+
+
+class ContextPacker:
+    """
+    Assemble retrieved chunks into the context sent to the LLM
+    
+    Chunks of the same document whose text overlaps (the splitter repeats
+    chunk_overlap characters between neighbours) are merged into one
+    passage. The passages are then picked by maximal marginal relevance:
+    each pick trades relevance to the query against similarity to what is
+    already selected, near-duplicates are skipped outright, and picking
+    stops adding passages once the token budget is used. A first pick that
+    alone exceeds the budget is truncated to it rather than dropped.
+    """
+    
+    def __init__(
+        self,
+        token_budget: int = 3000,
+        min_overlap_chars: int = 50,
+        max_overlap_chars: int = 400,
+        duplicate_threshold: float = 0.95,
+        mmr_lambda: float = 0.7
+    ):
+        self.token_budget = token_budget
+        self.min_overlap_chars = min_overlap_chars
+        self.max_overlap_chars = max_overlap_chars
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr_lambda = mmr_lambda
+        
+        # Counters for merged/deduplicated chunks and tokens saved
+        self.requests = 0
+        self.chunks_in = 0
+        self.chunks_out = 0
+        self.merged = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.tokens_in = 0
+        self.tokens_saved = 0
+    
+    def merge_overlapping(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Merge chunks of the same document whose texts overlap
+        
+        A merged passage keeps the position, ID and best similarity of its
+        highest-ranked member and lists all member IDs in merged_ids.
+        """
+        passages: List[Dict[str, Any]] = []
+        for rank, chunk in enumerate(chunks):
+            passage = {**chunk, "_members": [rank]}
+            merged = True
+            while merged:
+                merged = False
+                for other in passages:
+                    if other.get("document_id") != passage.get("document_id"):
+                        continue
+                    
+                    content = self._join(other["content"], passage["content"])
+                    if content is None:
+                        continue
+                    
+                    passages.remove(other)
+                    first, second = sorted((other, passage), key=lambda p: p["_members"][0])
+                    passage = {
+                        **first,
+                        "content": content,
+                        "similarity": max(first.get("similarity", 0), second.get("similarity", 0)),
+                        "_members": first["_members"] + second["_members"]
+                    }
+                    self.merged += 1
+                    merged = True
+                    break
+            passages.append(passage)
+        
+        passages.sort(key=lambda p: p["_members"][0])
+        for passage in passages:
+            if len(passage["_members"]) > 1:
+                passage["merged_ids"] = [chunks[rank]["id"] for rank in passage["_members"]]
+        return passages
+    
+    def _join(self, first: str, second: str) -> Optional[str]:
+        """Join two chunk texts on their overlap (either order), or None"""
+        if second in first:
+            return first
+        if first in second:
+            return second
+        
+        overlap = _overlap(first, second, self.min_overlap_chars, self.max_overlap_chars)
+        if overlap:
+            return first + second[overlap:]
+        
+        overlap = _overlap(second, first, self.min_overlap_chars, self.max_overlap_chars)
+        if overlap:
+            return second + first[overlap:]
+        return None
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """Scale rows to unit length for cosine similarity"""
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    async def pack(
+        self,
+        query_embedding: List[float],
+        chunks: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Build the LLM context from retrieved chunks
+        
+        Args:
+            query_embedding: Embedding of the user query
+            chunks: Retrieved chunks, best first, with their embedding when
+                retrieval returned it
+        
+        Returns:
+            Dict with the packed context (best first), tokens (context tokens
+            sent) and tokens_saved (against sending every chunk verbatim)
+        """
+        if not chunks:
+            return {"context": [], "tokens": 0, "tokens_saved": 0}
+        
+        tokens_in = sum(count_tokens(c["content"]) + MESSAGE_OVERHEAD_TOKENS for c in chunks)
+        passages = self.merge_overlapping(chunks)
+        
+        # Member embeddings come from retrieval; chunks returned without
+        # one fall back to the store. A passage is the mean of its members.
+        vectors = [chunk.get("embedding") for chunk in chunks]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            stored = await embeddings.aembed_stored([chunks[i]["content"] for i in missing])
+            for i, vector in zip(missing, stored):
+                vectors[i] = vector
+        vectors = self._normalize(np.stack(vectors).astype(np.float32))
+        passage_vectors = self._normalize(np.stack([
+            vectors[p["_members"]].mean(axis=0) for p in passages
+        ]))
+        relevance = passage_vectors @ self._normalize(np.asarray(query_embedding, dtype=np.float32))
+        tokens = [count_tokens(p["content"]) + MESSAGE_OVERHEAD_TOKENS for p in passages]
+        
+        selected: List[int] = []
+        remaining = list(range(len(passages)))
+        used = 0
+        while remaining:
+            if selected:
+                redundancy = (passage_vectors[remaining] @ passage_vectors[selected].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            # Rounded so ties (e.g. identical texts) go to the better-ranked passage
+            scores = np.round(scores, 6)
+            
+            best = int(np.argmax(scores))
+            idx = remaining.pop(best)
+            if redundancy[best] >= self.duplicate_threshold:
+                self.duplicates += 1
+                continue
+            if used + tokens[idx] > self.token_budget:
+                if selected:
+                    self.over_budget += 1
+                    continue
+                # The best passage alone is over budget: keep its beginning
+                passages[idx]["content"] = truncate_tokens(
+                    passages[idx]["content"], self.token_budget - MESSAGE_OVERHEAD_TOKENS
+                )
+                tokens[idx] = count_tokens(passages[idx]["content"]) + MESSAGE_OVERHEAD_TOKENS
+            
+            selected.append(idx)
+            used += tokens[idx]
+        
+        # Present the selection in retrieval order
+        context = []
+        for idx in sorted(selected):
+            passage = dict(passages[idx])
+            del passage["_members"]
+            passage.pop("embedding", None)
+            context.append(passage)
+        
+        tokens_saved = tokens_in - used
+        self.requests += 1
+        self.chunks_in += len(chunks)
+        self.chunks_out += len(context)
+        self.tokens_in += tokens_in
+        self.tokens_saved += tokens_saved
+        
+        logger.debug(
+            f"Packed {len(chunks)} chunks into {len(context)} passages "
+            f"({used} tokens, {tokens_saved} saved)"
+        )
+        return {"context": context, "tokens": used, "tokens_saved": tokens_saved}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get packing statistics"""
+        return {
+            "token_budget": self.token_budget,
+            "requests": self.requests,
+            "chunks_in": self.chunks_in,
+            "chunks_out": self.chunks_out,
+            "merged": self.merged,
+            "duplicates": self.duplicates,
+            "over_budget": self.over_budget,
+            "tokens_in": self.tokens_in,
+            "tokens_saved": self.tokens_saved,
+            "avg_tokens_saved": self.tokens_saved / self.requests if self.requests else 0.0
+        }
+
+
+# Global context packer instance
+context_packer = ContextPacker(
+    token_budget=settings.context_token_budget,
+    min_overlap_chars=settings.context_min_overlap_chars,
+    max_overlap_chars=settings.chunk_overlap * 2,
+    duplicate_threshold=settings.context_duplicate_threshold,
+    mmr_lambda=settings.context_mmr_lambda
+)
@@ -4,12 +4,16 @@ Handles all database operations with Supabase
 """
 from typing import List, Dict, Any, Optional
 from uuid import UUID, uuid4
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from supabase import create_client, Client
 from loguru import logger
 import numpy as np
 
 from config import settings
+from executors import db_executor, run_in_executor
+from postgres import pg
+from tracing import TRACE_COLUMNS
+from write_behind import WriteBehindQueue
 
 
 class DatabaseManager:
@@ -20,8 +24,37 @@ class DatabaseManager:
             settings.supabase_url,
             settings.supabase_service_key
         )
+        
+        # Chat messages and query analytics written off the request path
+        self.write_behind = WriteBehindQueue(
+            self.insert_rows,
+            max_queue_size=settings.write_behind_queue_size,
+            flush_interval_ms=settings.write_behind_flush_interval_ms,
+            max_batch_size=settings.write_behind_batch_size,
+            max_retries=settings.write_behind_max_retries,
+            retry_backoff_ms=settings.write_behind_retry_backoff_ms
+        )
         logger.info("Database manager initialized")
     
+    async def execute(self, query):
+        """
+        Execute a supabase query builder without blocking the event loop
+        
+        Args:
+            query: Supabase query or RPC builder
+            
+        Returns:
+            Query response
+        """
+        return await run_in_executor(db_executor, query.execute)
+    
+    async def insert_rows(self, table: str, rows: List[Dict[str, Any]]):
+        """Insert rows into a table with a single multi-row insert"""
+        if settings.direct_pg_enabled:
+            await pg.insert_rows(table, rows)
+        else:
+            await self.execute(self.client.table(table).insert(rows))
+    
     # ==================== Document Operations ====================
     
     async def create_document(
@@ -29,7 +62,8 @@ class DatabaseManager:
         title: str, 
         content: str, 
         source: str,
-        metadata: Dict[str, Any] = None
+        metadata: Dict[str, Any] = None,
+        content_hash: Optional[str] = None
     ) -> UUID:
         """Create a new document"""
         try:
@@ -37,10 +71,11 @@ class DatabaseManager:
                 "title": title,
                 "content": content,
                 "source": source,
-                "metadata": metadata or {}
+                "metadata": metadata or {},
+                "content_hash": content_hash
             }
             
-            result = self.client.table("documents").insert(data).execute()
+            result = await self.execute(self.client.table("documents").insert(data))
             doc_id = UUID(result.data[0]["id"])
             logger.info(f"Created document: {title} ({doc_id})")
             return doc_id
@@ -52,10 +87,11 @@ class DatabaseManager:
     async def get_document(self, document_id: UUID) -> Optional[Dict]:
         """Get document by ID"""
         try:
-            result = self.client.table("documents")\
-                .select("*")\
-                .eq("id", str(document_id))\
-                .execute()
+            result = await self.execute(
+                self.client.table("documents")
+                .select("*")
+                .eq("id", str(document_id))
+            )
             
             return result.data[0] if result.data else None
             
@@ -63,6 +99,64 @@ class DatabaseManager:
             logger.error(f"Error getting document: {e}")
             return None
     
+    async def find_document(self, title: str, source: str) -> Optional[Dict]:
+        """Get the most recent document with the given title and source"""
+        try:
+            result = await self.execute(
+                self.client.table("documents")
+                .select("id, title, source, content_hash, metadata")
+                .eq("title", title)
+                .eq("source", source)
+                .order("created_at", desc=True)
+                .limit(1)
+            )
+            
+            return result.data[0] if result.data else None
+            
+        except Exception as e:
+            logger.error(f"Error finding document: {e}")
+            return None
+    
+    async def update_document(
+        self,
+        document_id: UUID,
+        content: str,
+        content_hash: str,
+        metadata: Dict[str, Any] = None
+    ):
+        """Replace a document's content and content hash"""
+        try:
+            data = {
+                "content": content,
+                "content_hash": content_hash
+            }
+            if metadata is not None:
+                data["metadata"] = metadata
+            
+            await self.execute(
+                self.client.table("documents")
+                .update(data)
+                .eq("id", str(document_id))
+            )
+            
+        except Exception as e:
+            logger.error(f"Error updating document: {e}")
+            raise
+    
+    async def delete_document(self, document_id: UUID):
+        """Delete a document; its chunks are removed by cascade"""
+        try:
+            await self.execute(
+                self.client.table("documents")
+                .delete()
+                .eq("id", str(document_id))
+            )
+            logger.info(f"Deleted document: {document_id}")
+            
+        except Exception as e:
+            logger.error(f"Error deleting document: {e}")
+            raise
+    
     # ==================== Chunk Operations ====================
     
     async def create_chunks(
@@ -72,18 +166,24 @@ class DatabaseManager:
     ) -> List[UUID]:
         """Create multiple chunks for a document"""
         try:
+            if settings.direct_pg_enabled:
+                chunk_ids = await pg.copy_chunks(document_id, chunks)
+                logger.info(f"Created {len(chunk_ids)} chunks for document {document_id} (COPY)")
+                return chunk_ids
+            
             chunk_data = [
                 {
                     "document_id": str(document_id),
                     "content": chunk["content"],
                     "chunk_index": chunk["index"],
                     "embedding": chunk["embedding"],
-                    "metadata": chunk.get("metadata", {})
+                    "metadata": chunk.get("metadata", {}),
+                    "content_hash": chunk.get("content_hash")
                 }
                 for chunk in chunks
             ]
             
-            result = self.client.table("document_chunks").insert(chunk_data).execute()
+            result = await self.execute(self.client.table("document_chunks").insert(chunk_data))
             chunk_ids = [UUID(item["id"]) for item in result.data]
             logger.info(f"Created {len(chunk_ids)} chunks for document {document_id}")
             return chunk_ids
@@ -92,25 +192,146 @@ class DatabaseManager:
             logger.error(f"Error creating chunks: {e}")
             raise
     
+    async def get_chunk_hashes(self, document_id: UUID) -> List[Dict]:
+        """Get id, content hash, position and metadata of every chunk of a document"""
+        try:
+            result = await self.execute(
+                self.client.table("document_chunks")
+                .select("id, content_hash, chunk_index, metadata")
+                .eq("document_id", str(document_id))
+            )
+            
+            return result.data
+            
+        except Exception as e:
+            logger.error(f"Error getting chunk hashes: {e}")
+            raise
+    
+    async def update_chunk_positions(
+        self,
+        document_id: UUID,
+        chunks: List[Dict[str, Any]]
+    ):
+        """Move reused chunks to new positions or metadata without touching their embeddings"""
+        try:
+            # Upsert only the listed columns; embeddings stay as stored
+            chunk_data = [
+                {
+                    "id": str(chunk["id"]),
+                    "document_id": str(document_id),
+                    "content": chunk["content"],
+                    "chunk_index": chunk["index"],
+                    "metadata": chunk.get("metadata", {})
+                }
+                for chunk in chunks
+            ]
+            
+            await self.execute(
+                self.client.table("document_chunks").upsert(chunk_data, on_conflict="id")
+            )
+            
+        except Exception as e:
+            logger.error(f"Error updating chunk positions: {e}")
+            raise
+    
+    async def delete_chunks(self, chunk_ids: List[UUID]):
+        """Delete chunks by ID"""
+        try:
+            await self.execute(
+                self.client.table("document_chunks")
+                .delete()
+                .in_("id", [str(chunk_id) for chunk_id in chunk_ids])
+            )
+            logger.info(f"Deleted {len(chunk_ids)} stale chunks")
+            
+        except Exception as e:
+            logger.error(f"Error deleting chunks: {e}")
+            raise
+    
+    async def fetch_all_chunks(
+        self,
+        document_id: Optional[UUID] = None,
+        page_size: int = 1000
+    ) -> List[Dict]:
+        """Page through chunks with their embeddings (optionally for one document)"""
+        try:
+            if settings.direct_pg_enabled:
+                # One binary read; embeddings arrive as float32 arrays
+                return await pg.fetch_chunks(document_id)
+            
+            records = []
+            offset = 0
+            while True:
+                query = self.client.table("document_chunks")\
+                    .select("id, document_id, content, chunk_index, metadata, embedding")
+                if document_id is not None:
+                    query = query.eq("document_id", str(document_id))
+                
+                result = await self.execute(
+                    query.order("id").range(offset, offset + page_size - 1)
+                )
+                records.extend(result.data)
+                
+                if len(result.data) < page_size:
+                    return records
+                offset += page_size
+            
+        except Exception as e:
+            logger.error(f"Error fetching chunks: {e}")
+            raise
+    
     async def search_similar_chunks(
         self,
         query_embedding: List[float],
         top_k: int = 5,
-        threshold: float = 0.7
+        threshold: float = 0.7,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        document_id: Optional[UUID] = None,
+        source: Optional[str] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        with_embeddings: bool = False
     ) -> List[Dict[str, Any]]:
-        """Search for similar chunks using vector similarity"""
+        """Search for similar chunks using vector similarity, optionally filtered"""
         try:
+            if settings.direct_pg_enabled:
+                return await pg.search_similar_chunks(
+                    query_embedding=query_embedding,
+                    top_k=top_k,
+                    threshold=threshold,
+                    probes=probes,
+                    ef_search=ef_search,
+                    document_id=document_id,
+                    source=source,
+                    metadata_filter=metadata_filter,
+                    date_from=date_from,
+                    date_to=date_to,
+                    with_embeddings=with_embeddings
+                )
+            
             # Convert embedding to proper format
             embedding_str = f"[{','.join(map(str, query_embedding))}]"
             
-            result = self.client.rpc(
-                "match_document_chunks",
-                {
-                    "query_embedding": embedding_str,
-                    "match_threshold": threshold,
-                    "match_count": top_k
-                }
-            ).execute()
+            result = await self.execute(
+                self.client.rpc(
+                    "match_document_chunks",
+                    {
+                        "query_embedding": embedding_str,
+                        "match_threshold": threshold,
+                        "match_count": top_k,
+                        "probes": probes,
+                        "ef_search": ef_search,
+                        "filter_document_id": str(document_id) if document_id else None,
+                        "filter_source": source,
+                        "filter_metadata": metadata_filter,
+                        "filter_date_from": date_from,
+                        "filter_date_to": date_to,
+                        "with_embeddings": with_embeddings
+                    }
+                )
+            )
             
             return result.data if result.data else []
             
@@ -118,6 +339,94 @@ class DatabaseManager:
             logger.error(f"Error searching chunks: {e}")
             return []
     
+    async def search_chunks_fulltext(
+        self,
+        query: str,
+        top_k: int = 5,
+        document_id: Optional[UUID] = None,
+        source: Optional[str] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Search chunks by full-text match on their tsvector, optionally filtered"""
+        try:
+            result = await self.execute(
+                self.client.rpc(
+                    "match_document_chunks_fulltext",
+                    {
+                        "query_text": query,
+                        "match_count": top_k,
+                        "filter_document_id": str(document_id) if document_id else None,
+                        "filter_source": source,
+                        "filter_metadata": metadata_filter,
+                        "filter_date_from": date_from,
+                        "filter_date_to": date_to,
+                        "with_embeddings": with_embeddings
+                    }
+                )
+            )
+            
+            return result.data if result.data else []
+            
+        except Exception as e:
+            logger.error(f"Error in full-text chunk search: {e}")
+            return []
+    
+    # ==================== Semantic Cache Operations ====================
+    
+    async def find_cached_response(
+        self,
+        query_embedding: List[float],
+        agent_key: str,
+        chunk_ids: List[str],
+        max_distance: float
+    ) -> Optional[Dict[str, Any]]:
+        """Find a persisted answer for a semantically equivalent query"""
+        try:
+            embedding_str = f"[{','.join(map(str, query_embedding))}]"
+            
+            result = await self.execute(
+                self.client.rpc(
+                    "match_semantic_cache",
+                    {
+                        "query_embedding": embedding_str,
+                        "match_agent_key": agent_key,
+                        "match_chunk_ids": chunk_ids,
+                        "max_distance": max_distance
+                    }
+                )
+            )
+            
+            return result.data[0]["response"] if result.data else None
+            
+        except Exception as e:
+            logger.error(f"Error reading semantic cache: {e}")
+            return None
+    
+    async def store_cached_response(
+        self,
+        query_embedding: List[float],
+        agent_key: str,
+        chunk_ids: List[str],
+        response: Dict[str, Any]
+    ):
+        """Persist an answer to the semantic cache table"""
+        try:
+            data = {
+                "query_embedding": query_embedding,
+                "agent_key": agent_key,
+                "chunk_ids": chunk_ids,
+                "response": response,
+                "tokens_used": response.get("tokens_used", 0)
+            }
+            
+            await self.execute(self.client.table("semantic_cache").insert(data))
+            
+        except Exception as e:
+            logger.error(f"Error writing semantic cache: {e}")
+    
     # ==================== Chat Session Operations ====================
     
     async def create_session(
@@ -132,7 +441,7 @@ class DatabaseManager:
                 "metadata": metadata or {}
             }
             
-            result = self.client.table("chat_sessions").insert(data).execute()
+            result = await self.execute(self.client.table("chat_sessions").insert(data))
             session_id = UUID(result.data[0]["id"])
             logger.info(f"Created session: {session_id}")
             return session_id
@@ -144,10 +453,14 @@ class DatabaseManager:
     async def get_session(self, session_id: UUID) -> Optional[Dict]:
         """Get session by ID"""
         try:
-            result = self.client.table("chat_sessions")\
-                .select("*")\
-                .eq("id", str(session_id))\
-                .execute()
+            if settings.direct_pg_enabled:
+                return await pg.get_session(session_id)
+            
+            result = await self.execute(
+                self.client.table("chat_sessions")
+                .select("*")
+                .eq("id", str(session_id))
+            )
             
             return result.data[0] if result.data else None
             
@@ -155,21 +468,65 @@ class DatabaseManager:
             logger.error(f"Error getting session: {e}")
             return None
     
-    async def list_sessions(self, limit: int = 20) -> List[Dict]:
-        """List recent chat sessions"""
+    async def list_sessions(
+        self,
+        limit: int = 20,
+        before_created_at: Optional[str] = None,
+        before_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        List chat sessions newest first, with their message counts
+        
+        Args:
+            limit: Page size
+            before_created_at: Keyset cursor - created_at of the last session seen
+            before_id: Keyset cursor - id of the last session seen
+        
+        Returns:
+            Sessions including message_count (queued messages included)
+        """
         try:
-            result = self.client.table("chat_sessions")\
-                .select("*")\
-                .order("created_at", desc=True)\
-                .limit(limit)\
-                .execute()
+            if settings.direct_pg_enabled:
+                sessions = await pg.list_sessions(limit, before_created_at, before_id)
+            else:
+                result = await self.execute(
+                    self.client.rpc(
+                        "list_chat_sessions",
+                        {
+                            "page_size": limit,
+                            "before_created_at": before_created_at,
+                            "before_id": before_id
+                        }
+                    )
+                )
+                sessions = result.data or []
             
-            return result.data
+            # Counts are maintained on insert; add messages still in the queue
+            queued: Dict[str, int] = {}
+            for message in self.write_behind.pending("chat_messages"):
+                queued[message["session_id"]] = queued.get(message["session_id"], 0) + 1
+            for session in sessions:
+                session["message_count"] = session.get("message_count", 0) + queued.get(str(session["id"]), 0)
+            
+            return sessions
             
         except Exception as e:
             logger.error(f"Error listing sessions: {e}")
             return []
     
+    async def update_session_metadata(self, session_id: UUID, metadata: Dict[str, Any]):
+        """Replace a session's metadata"""
+        try:
+            await self.execute(
+                self.client.table("chat_sessions")
+                .update({"metadata": metadata})
+                .eq("id", str(session_id))
+            )
+            
+        except Exception as e:
+            logger.error(f"Error updating session metadata: {e}")
+            raise
+    
     # ==================== Message Operations ====================
     
     async def add_message(
@@ -182,6 +539,9 @@ class DatabaseManager:
     ) -> UUID:
         """Add a message to a chat session"""
         try:
+            if settings.direct_pg_enabled:
+                return await pg.add_message(session_id, role, content, agent_type, sources)
+            
             data = {
                 "session_id": str(session_id),
                 "role": role,
@@ -190,7 +550,7 @@ class DatabaseManager:
                 "sources": sources or []
             }
             
-            result = self.client.table("chat_messages").insert(data).execute()
+            result = await self.execute(self.client.table("chat_messages").insert(data))
             message_id = UUID(result.data[0]["id"])
             return message_id
             
@@ -198,26 +558,135 @@ class DatabaseManager:
             logger.error(f"Error adding message: {e}")
             raise
     
+    async def queue_message(
+        self,
+        session_id: UUID,
+        role: str,
+        content: str,
+        agent_type: Optional[str] = None,
+        sources: List[Dict] = None
+    ) -> UUID:
+        """Add a message through the write-behind queue (returns before it is stored)"""
+        if not settings.write_behind_enabled:
+            return await self.add_message(session_id, role, content, agent_type, sources)
+        
+        # ID and timestamp are set now so ordering doesn't depend on flush time
+        message_id = uuid4()
+        await self.write_behind.enqueue("chat_messages", {
+            "id": str(message_id),
+            "session_id": str(session_id),
+            "role": role,
+            "content": content,
+            "agent_type": agent_type,
+            "sources": sources or [],
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        return message_id
+    
+    def _queued_messages(self, session_id: UUID) -> List[Dict]:
+        """Messages of a session still waiting in the write-behind queue"""
+        return [
+            message for message in self.write_behind.pending("chat_messages")
+            if message["session_id"] == str(session_id)
+        ]
+    
+    @staticmethod
+    def _merge_queued(messages: List[Dict], queued: List[Dict]) -> List[Dict]:
+        """Add queued messages not yet stored, in chronological order"""
+        if not queued:
+            return messages
+        
+        stored_ids = {str(message["id"]) for message in messages}
+        messages = messages + [m for m in queued if m["id"] not in stored_ids]
+        messages.sort(key=lambda message: datetime.fromisoformat(message["created_at"]))
+        return messages
+    
     async def get_session_messages(
         self,
         session_id: UUID,
         limit: int = 50
     ) -> List[Dict]:
-        """Get messages for a session"""
+        """Get messages for a session, including ones not yet flushed"""
         try:
-            result = self.client.table("chat_messages")\
-                .select("*")\
-                .eq("session_id", str(session_id))\
-                .order("created_at", desc=False)\
-                .limit(limit)\
-                .execute()
+            # Snapshot queued messages before reading, so none fall in between
+            queued = self._queued_messages(session_id)
             
-            return result.data
+            if settings.direct_pg_enabled:
+                messages = await pg.get_session_messages(session_id, limit)
+            else:
+                result = await self.execute(
+                    self.client.table("chat_messages")
+                    .select("*")
+                    .eq("session_id", str(session_id))
+                    .order("created_at", desc=False)
+                    .limit(limit)
+                )
+                messages = result.data
+            
+            return self._merge_queued(messages, queued)[:limit]
             
         except Exception as e:
             logger.error(f"Error getting messages: {e}")
             return []
     
+    async def get_recent_messages(
+        self,
+        session_id: UUID,
+        limit: int = 10
+    ) -> List[Dict]:
+        """Get the last messages of a session (id, role, content, created_at), oldest first"""
+        try:
+            queued = self._queued_messages(session_id)
+            
+            if settings.direct_pg_enabled:
+                messages = await pg.get_recent_messages(session_id, limit)
+            else:
+                result = await self.execute(
+                    self.client.table("chat_messages")
+                    .select("id, role, content, created_at")
+                    .eq("session_id", str(session_id))
+                    .order("created_at", desc=True)
+                    .limit(limit)
+                )
+                messages = result.data[::-1]
+            
+            return self._merge_queued(messages, queued)[-limit:]
+            
+        except Exception as e:
+            logger.error(f"Error getting recent messages: {e}")
+            return []
+    
+    async def get_messages_between(
+        self,
+        session_id: UUID,
+        after: Optional[str],
+        before: str,
+        limit: int = 20
+    ) -> List[Dict]:
+        """
+        Get the first messages of a session created after one timestamp
+        (if given) and before another (id, role, content, created_at),
+        oldest first
+        """
+        try:
+            if settings.direct_pg_enabled:
+                return await pg.get_messages_between(session_id, after, before, limit)
+            
+            query = (
+                self.client.table("chat_messages")
+                .select("id, role, content, created_at")
+                .eq("session_id", str(session_id))
+                .lt("created_at", before)
+            )
+            if after:
+                query = query.gt("created_at", after)
+            result = await self.execute(query.order("created_at").limit(limit))
+            return result.data
+            
+        except Exception as e:
+            logger.error(f"Error getting messages: {e}")
+            raise
+    
     # ==================== Analytics Operations ====================
     
     async def log_query(
@@ -227,9 +696,11 @@ class DatabaseManager:
         agent_type: str,
         response_time_ms: int,
         tokens_used: int = 0,
-        sources_retrieved: int = 0
+        sources_retrieved: int = 0,
+        tokens_saved: int = 0,
+        trace: Optional[Dict[str, Any]] = None
     ):
-        """Log query analytics"""
+        """Log query analytics (trace: token usage and stage timing columns)"""
         try:
             data = {
                 "session_id": str(session_id),
@@ -237,31 +708,94 @@ class DatabaseManager:
                 "agent_type": agent_type,
                 "response_time_ms": response_time_ms,
                 "tokens_used": tokens_used,
-                "sources_retrieved": sources_retrieved
+                "sources_retrieved": sources_retrieved,
+                "tokens_saved": tokens_saved,
+                **self._trace_columns(trace)
             }
             
-            self.client.table("query_analytics").insert(data).execute()
+            await self.execute(self.client.table("query_analytics").insert(data))
             
         except Exception as e:
             logger.error(f"Error logging query: {e}")
     
-    async def get_analytics_summary(self) -> Dict[str, Any]:
-        """Get analytics summary"""
+    async def queue_query_log(
+        self,
+        session_id: UUID,
+        query: str,
+        agent_type: str,
+        response_time_ms: int,
+        tokens_used: int = 0,
+        sources_retrieved: int = 0,
+        tokens_saved: int = 0,
+        trace: Optional[Dict[str, Any]] = None
+    ):
+        """Log query analytics through the write-behind queue"""
+        if not settings.write_behind_enabled:
+            await self.log_query(
+                session_id, query, agent_type, response_time_ms,
+                tokens_used, sources_retrieved, tokens_saved, trace
+            )
+            return
+        
+        await self.write_behind.enqueue("query_analytics", {
+            "session_id": str(session_id),
+            "query": query,
+            "agent_type": agent_type,
+            "response_time_ms": response_time_ms,
+            "tokens_used": tokens_used,
+            "sources_retrieved": sources_retrieved,
+            "tokens_saved": tokens_saved,
+            **self._trace_columns(trace),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    
+    @staticmethod
+    def _trace_columns(trace: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Trace columns with every key present, so queued rows batch together"""
+        trace = trace or {}
+        return {column: trace.get(column) for column in TRACE_COLUMNS}
+    
+    async def get_analytics_summary(
+        self,
+        granularity: str = "hour",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        agent_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Get query analytics from the per-minute/per-hour rollups
+        
+        Args:
+            granularity: Bucket size, "minute" or "hour"
+            start: Range start (defaults to 24 hours before end)
+            end: Range end (defaults to now)
+            agent_type: Only report this agent type
+        
+        Returns:
+            Totals, per-agent totals and a per-bucket series with query
+            counts, latency percentiles, tokens and sources retrieved
+        """
         try:
-            # Total queries
-            total_result = self.client.table("query_analytics")\
-                .select("*", count="exact")\
-                .execute()
-            
-            # Average response time
-            avg_result = self.client.rpc(
-                "get_avg_response_time"
-            ).execute() if hasattr(self.client, "rpc") else None
-            
-            return {
-                "total_queries": total_result.count if hasattr(total_result, "count") else 0,
-                "avg_response_time": avg_result.data[0] if avg_result else None
-            }
+            end = end or datetime.now(timezone.utc)
+            start = start or end - timedelta(hours=24)
+            
+            if settings.direct_pg_enabled:
+                return await pg.get_query_analytics(
+                    granularity, start.isoformat(), end.isoformat(), agent_type
+                )
+            
+            result = await self.execute(
+                self.client.rpc(
+                    "get_query_analytics",
+                    {
+                        "p_granularity": granularity,
+                        "p_from": start.isoformat(),
+                        "p_to": end.isoformat(),
+                        "p_agent_type": agent_type
+                    }
+                )
+            )
+            return result.data or {}
             
         except Exception as e:
             logger.error(f"Error getting analytics: {e}")
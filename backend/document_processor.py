@@ -2,44 +2,68 @@
 Document Processor for KANZ System
 Handles document chunking and indexing
 """
-from typing import List, Dict, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import asyncio
+import time
+from typing import List, Dict, Any, Optional
 from loguru import logger
-import re
+import numpy as np
+import hashlib
 
+from cache import TTLCache
 from config import settings
-from database import db
 from embeddings import embeddings
+from embedding_batcher import embedding_batcher
+from indexer import indexer
+from lexical import reciprocal_rank_fusion
+from retrieval import retriever
+from text_processing import clean_text, create_text_splitter
 
 
 class DocumentProcessor:
     """Process and index documents for RAG"""
     
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
+        self.text_splitter = create_text_splitter()
+        
+        # Normalized query text -> embedding
+        self.embedding_cache = TTLCache(
+            max_size=settings.query_cache_size,
+            ttl_seconds=settings.query_cache_ttl_seconds,
+            name="query_embeddings"
+        )
+        # (embedding hash, top_k, threshold) -> chunk results
+        self.results_cache = TTLCache(
+            max_size=settings.query_cache_size,
+            ttl_seconds=settings.query_cache_ttl_seconds,
+            name="retrieval_results"
         )
         logger.info("Document processor initialized")
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove multiple newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        # Remove excessive whitespace
-        text = re.sub(r' {2,}', ' ', text)
-        
-        # Remove box drawing characters (from formatted documents)
-        text = re.sub(r'[─│┌┐└┘├┤┬┴┼═║╔╗╚╝╠╣╦╩╬]', '', text)
-        
-        # Normalize quotes
-        text = text.replace('"', '"').replace('"', '"')
-        text = text.replace(''', "'").replace(''', "'")
-        
-        return text.strip()
+        return clean_text(text)
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalize query text for cache lookups"""
+        return " ".join(query.lower().split())
+    
+    @staticmethod
+    def hash_embedding(embedding: List[float]) -> str:
+        """Stable hash of an embedding vector"""
+        return hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+    
+    def invalidate_cache(self):
+        """Drop cached retrieval results after the corpus changes"""
+        self.results_cache.clear()
+        logger.info("Retrieval results cache invalidated")
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get query cache statistics"""
+        return {
+            "embeddings": self.embedding_cache.get_stats(),
+            "results": self.results_cache.get_stats()
+        }
     
     def chunk_text(self, text: str) -> List[str]:
         """Split text into chunks"""
@@ -58,6 +82,9 @@ class DocumentProcessor:
         """
         Process a document: chunk, embed, and index
         
+        Re-submitting identical content is a no-op; edited content only
+        re-embeds the chunks whose hash changed.
+        
         Args:
             title: Document title
             content: Document content
@@ -70,40 +97,25 @@ class DocumentProcessor:
         try:
             logger.info(f"Processing document: {title}")
             
-            # Create document record
-            doc_id = await db.create_document(
-                title=title,
-                content=content,
-                source=source,
-                metadata=metadata or {}
-            )
-            
             # Chunk the content
             chunks = self.chunk_text(content)
             logger.info(f"Created {len(chunks)} chunks")
             
-            # Generate embeddings for all chunks
-            logger.info("Generating embeddings...")
-            chunk_embeddings = embeddings.embed_batch(chunks)
-            
-            # Prepare chunk data
-            chunk_data = [
-                {
-                    "content": chunk,
-                    "index": idx,
-                    "embedding": embedding,
-                    "metadata": {
-                        "title": title,
-                        "source": source,
-                        "chunk_length": len(chunk)
-                    }
-                }
-                for idx, (chunk, embedding) in enumerate(zip(chunks, chunk_embeddings))
-            ]
+            # Index by content hash: unchanged documents (same content and
+            # metadata) are skipped, edited ones only embed changed chunks
+            result = await indexer.index_document(
+                title=title,
+                content=content,
+                source=source,
+                metadata=metadata or {},
+                chunks=chunks,
+                embed_fn=embeddings.aembed_batch
+            )
+            doc_id = result["document_id"]
             
-            # Store chunks in database
-            logger.info("Storing chunks in database...")
-            await db.create_chunks(doc_id, chunk_data)
+            if result["status"] != "unchanged":
+                await retriever.refresh_document(doc_id)
+                self.invalidate_cache()
             
             logger.success(f"Document indexed successfully: {title} ({doc_id})")
             return str(doc_id)
@@ -112,34 +124,96 @@ class DocumentProcessor:
             logger.error(f"Error processing document: {e}")
             raise
     
+    async def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a search query, cached by normalized text
+        
+        Args:
+            query: Search query
+            
+        Returns:
+            Query embedding
+        """
+        normalized = self.normalize_query(query)
+        query_embedding = self.embedding_cache.get(normalized)
+        if query_embedding is None:
+            query_embedding = await embedding_batcher.embed(query)
+            self.embedding_cache.set(normalized, query_embedding)
+        return query_embedding
+    
     async def search_documents(
         self,
         query: str,
         top_k: int = None,
-        threshold: float = 0.7
+        threshold: float = 0.7,
+        query_embedding: List[float] = None,
+        timings: Dict[str, float] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
     ) -> List[Dict[str, Any]]:
         """
         Search for relevant document chunks
         
+        With hybrid search enabled, the vector and full-text legs run
+        concurrently and their rankings are fused with reciprocal rank fusion,
+        so exact terms (article numbers, rates, form codes) are not lost to
+        embedding similarity.
+        
         Args:
             query: Search query
             top_k: Number of results to return
             threshold: Similarity threshold
+            query_embedding: Precomputed query embedding, if available
+            timings: Optional dict receiving per-leg latencies in ms
+            filters: Only search chunks matching source, document_id, type,
+                date_from and/or date_to
+            with_embeddings: Carry each chunk's stored embedding (for
+                context packing)
             
         Returns:
             List of relevant chunks with metadata
         """
         try:
-            # Generate query embedding
-            query_embedding = embeddings.embed_text(query)
+            if query_embedding is None:
+                query_embedding = await self.embed_query(query)
             
-            # Search similar chunks
+            # Search similar chunks (cached by query and search parameters)
             k = top_k or settings.top_k_results
-            results = await db.search_similar_chunks(
-                query_embedding=query_embedding,
-                top_k=k,
-                threshold=threshold
+            hybrid = settings.hybrid_search_enabled
+            results_key = (
+                self.hash_embedding(query_embedding),
+                self.normalize_query(query) if hybrid else None,
+                k,
+                threshold,
+                tuple(sorted(filters.items())) if filters else None,
+                with_embeddings
             )
+            results = self.results_cache.get(results_key)
+            if results is not None:
+                logger.info(f"Found {len(results)} relevant chunks for query (cached)")
+                return list(results)
+            
+            if hybrid:
+                results = await self._hybrid_search(
+                    query, query_embedding, k, threshold, timings, filters, with_embeddings
+                )
+            else:
+                results = await self._timed_leg(
+                    timings,
+                    "vector_search",
+                    retriever.search(
+                        query_embedding=query_embedding,
+                        top_k=k,
+                        threshold=threshold,
+                        filters=filters,
+                        with_embeddings=with_embeddings
+                    )
+                )
+            
+            # Empty results may come from a swallowed search error, so only
+            # cache non-empty ones
+            if results:
+                self.results_cache.set(results_key, list(results))
             
             logger.info(f"Found {len(results)} relevant chunks for query")
             return results
@@ -148,6 +222,76 @@ class DocumentProcessor:
             logger.error(f"Error searching documents: {e}")
             return []
     
+    async def _hybrid_search(
+        self,
+        query: str,
+        query_embedding: List[float],
+        top_k: int,
+        threshold: float,
+        timings: Dict[str, float] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Run vector and full-text search concurrently and fuse with RRF"""
+        n_candidates = top_k * settings.hybrid_candidate_factor
+        
+        vector_results, lexical_results = await asyncio.gather(
+            self._timed_leg(
+                timings,
+                "vector_search",
+                retriever.search(
+                    query_embedding=query_embedding,
+                    top_k=n_candidates,
+                    threshold=threshold,
+                    filters=filters,
+                    with_embeddings=with_embeddings
+                )
+            ),
+            self._timed_leg(
+                timings,
+                "lexical_search",
+                retriever.lexical_search(
+                    query=query, top_k=n_candidates, filters=filters, with_embeddings=with_embeddings
+                )
+            ),
+            return_exceptions=True
+        )
+        
+        # A failing leg degrades to the other one instead of failing the search
+        if isinstance(lexical_results, Exception):
+            logger.warning(f"Lexical search failed, using vector results only: {lexical_results}")
+            lexical_results = []
+        if isinstance(vector_results, Exception):
+            logger.warning(f"Vector search failed, using lexical results only: {vector_results}")
+            vector_results = []
+        
+        # Full-text-only hits have no similarity to hold against the threshold;
+        # keep only those scoring close to the best full-text match
+        if lexical_results:
+            vector_ids = {chunk["id"] for chunk in vector_results}
+            floor = settings.hybrid_lexical_min_ratio * max(
+                chunk["lexical_score"] for chunk in lexical_results
+            )
+            lexical_results = [
+                chunk for chunk in lexical_results
+                if chunk["id"] in vector_ids or chunk["lexical_score"] >= floor
+            ]
+        
+        return reciprocal_rank_fusion(
+            {"vector": vector_results, "lexical": lexical_results},
+            top_k=top_k
+        )
+    
+    @staticmethod
+    async def _timed_leg(timings: Dict[str, float], leg: str, coro):
+        """Await a search leg, recording its latency when timings are collected"""
+        start_time = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            if timings is not None:
+                timings[leg] = round((time.perf_counter() - start_time) * 1000, 2)
+    
     def extract_key_sections(self, text: str, keywords: List[str]) -> List[str]:
         """
         Extract sections containing specific keywords
@@ -0,0 +1,185 @@
+"""
+Embedding Micro-Batcher for KANZ System
+Coalesces concurrent query embeddings into a single model forward pass
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+from config import settings
+from embeddings import EmbeddingManager, embeddings
+from executors import inference_executor, run_in_executor
+
+
+class EmbeddingBatcher:
+    """Gather query texts arriving within a short window and encode them together"""
+    
+    def __init__(
+        self,
+        manager: EmbeddingManager,
+        window_ms: float = 5.0,
+        max_batch_size: int = 64
+    ):
+        self.manager = manager
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        
+        # Counters for tuning throughput against latency
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_encode_ms = 0.0
+    
+    def _ensure_worker(self):
+        """Start the batching worker on the running event loop if needed"""
+        if self._worker is None or self._worker.done():
+            # Keep an existing queue: callers still waiting on it are served
+            # by the new worker
+            if self._queue is None:
+                self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+            logger.info(
+                f"Embedding batcher started (window={self.window * 1000:.1f}ms, "
+                f"max_batch={self.max_batch_size})"
+            )
+    
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embed a single text, sharing a forward pass with concurrent callers
+        
+        Args:
+            text: Input text to embed
+            
+        Returns:
+            List of floats representing the embedding
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+    
+    async def _collect(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        """Wait for the first request, then gather more until the window closes"""
+        loop = asyncio.get_running_loop()
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.window
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+    
+    async def _run(self):
+        """Worker loop: collect a batch, encode it once, resolve each caller"""
+        while True:
+            batch: List[Tuple[str, asyncio.Future, float]] = []
+            try:
+                await self._collect(batch)
+                await self._encode(batch)
+            except asyncio.CancelledError:
+                self._fail(batch, RuntimeError("Embedding batcher stopped"))
+                raise
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)} queries: {e}")
+                self._fail(batch, e)
+    
+    async def _encode(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        """Encode a batch in one forward pass and resolve its callers"""
+        # Callers may have been cancelled while waiting
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+        
+        texts = [text for text, _, _ in batch]
+        dequeued_at = time.perf_counter()
+        
+        vectors = await run_in_executor(
+            inference_executor,
+            self.manager.model.encode,
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        
+        encode_ms = (time.perf_counter() - dequeued_at) * 1000
+        self._record(batch, dequeued_at, encode_ms)
+        
+        for (_, future, _), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector.tolist())
+    
+    @staticmethod
+    def _fail(batch: List[Tuple[str, asyncio.Future, float]], error: BaseException):
+        """Fail every caller in a batch that is still waiting"""
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+    
+    def _record(
+        self,
+        batch: List[Tuple[str, asyncio.Future, float]],
+        dequeued_at: float,
+        encode_ms: float
+    ):
+        """Update batch size and queue wait counters"""
+        self.batches += 1
+        self.items += len(batch)
+        self.max_observed_batch = max(self.max_observed_batch, len(batch))
+        self.total_encode_ms += encode_ms
+        
+        for _, _, enqueued_at in batch:
+            wait_ms = (dequeued_at - enqueued_at) * 1000
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get batching statistics"""
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_observed_batch": self.max_observed_batch,
+            "avg_queue_wait_ms": self.total_wait_ms / self.items if self.items else 0.0,
+            "max_queue_wait_ms": self.max_wait_ms,
+            "avg_encode_ms": self.total_encode_ms / self.batches if self.batches else 0.0,
+            "queue_depth": self._queue.qsize() if self._queue else 0
+        }
+    
+    async def stop(self):
+        """Stop the batching worker"""
+        if self._worker and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        
+        # Nothing will serve requests still queued; fail them instead of
+        # leaving their callers waiting
+        if self._queue is not None:
+            queued = []
+            while not self._queue.empty():
+                queued.append(self._queue.get_nowait())
+            self._fail(queued, RuntimeError("Embedding batcher stopped"))
+        logger.info("Embedding batcher stopped")
+
+
+# Global embedding batcher instance
+embedding_batcher = EmbeddingBatcher(
+    embeddings,
+    window_ms=settings.embedding_batch_window_ms,
+    max_batch_size=settings.embedding_batch_max_size
+)
@@ -0,0 +1,220 @@
+"""
+Persistent Embedding Store for KANZ System
+On-disk float32 matrix of chunk embeddings keyed by (model, chunk text hash)
+"""
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from loguru import logger
+import numpy as np
+
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+
+class EmbeddingStore:
+    """
+    Append-only, memory-mapped embedding cache for one embedding model
+    
+    The API and the ingest CLI may share a store directory, so appends and
+    lookups take an flock on a lock file next to the data: a writer holds it
+    exclusively across both file appends and takes row offsets from the
+    vector file itself, and readers pick up keys other processes appended
+    before looking anything up.
+    """
+    
+    def __init__(self, directory: str, model_name: str):
+        self.model_name = model_name
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+        self.path = Path(directory) / safe_name
+        self.path.mkdir(parents=True, exist_ok=True)
+        
+        self.vectors_file = self.path / "vectors.f32"
+        self.keys_file = self.path / "keys.txt"
+        self.meta_file = self.path / "meta.json"
+        self.lock_file = self.path / ".lock"
+        
+        self.dimension: Optional[int] = None
+        self._index: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._keys_read = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        
+        self._load()
+    
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Hold the in-process lock and an flock on the store directory"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_file, "a+b") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    
+    def _load(self):
+        """Load the hash index and map the vector file"""
+        with self._file_lock(exclusive=True):
+            self._read_meta()
+            if self.dimension is None or not self.keys_file.exists():
+                return
+            
+            keys = self.keys_file.read_text(encoding="utf-8").split()
+            row_bytes = self.dimension * 4
+            stored_rows = self.vectors_file.stat().st_size // row_bytes if self.vectors_file.exists() else 0
+            
+            # Vectors are written before keys, so an interrupted append leaves at
+            # most some unreferenced trailing rows; drop them and any dangling keys
+            rows = min(len(keys), stored_rows)
+            if rows < len(keys):
+                keys = keys[:rows]
+                self.keys_file.write_text("".join(f"{key}\n" for key in keys), encoding="utf-8")
+            if stored_rows > rows:
+                with open(self.vectors_file, "r+b") as f:
+                    f.truncate(rows * row_bytes)
+            
+            self._index = {key: row for row, key in enumerate(keys)}
+            self._keys_read = self.keys_file.stat().st_size
+            self._remap()
+        logger.info(f"Embedding store loaded: {len(self._index)} vectors for {self.model_name}")
+    
+    def _read_meta(self):
+        """Read the dimension written by whichever process stored first"""
+        if self.dimension is None and self.meta_file.exists():
+            meta = json.loads(self.meta_file.read_text(encoding="utf-8"))
+            self.dimension = meta["dimension"]
+    
+    def _refresh(self):
+        """
+        Index keys appended by other processes since the last read
+        
+        Must be called under the file lock, where keys.txt always ends on
+        a complete line.
+        """
+        if not self.keys_file.exists() or self.keys_file.stat().st_size == self._keys_read:
+            return
+        
+        self._read_meta()
+        with open(self.keys_file, "rb") as f:
+            f.seek(self._keys_read)
+            tail = f.read()
+        self._keys_read += len(tail)
+        
+        for key in tail.decode("utf-8").split():
+            self._index.setdefault(key, len(self._index))
+        self._remap()
+    
+    def _remap(self):
+        """Re-create the memory map after the vector file grows"""
+        rows = len(self._index)
+        if rows:
+            self._matrix = np.memmap(
+                self.vectors_file, dtype=np.float32, mode="r", shape=(rows, self.dimension)
+            )
+        else:
+            self._matrix = None
+    
+    def get_many(self, hashes: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up embeddings by chunk text hash
+        
+        Args:
+            hashes: Chunk text hashes
+        
+        Returns:
+            Embedding (float32 array) or None for each hash
+        """
+        with self._file_lock(exclusive=False):
+            self._refresh()
+            results = []
+            for key in hashes:
+                row = self._index.get(key)
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.array(self._matrix[row]))
+            return results
+    
+    def put_many(self, hashes: List[str], vectors: np.ndarray):
+        """
+        Append embeddings for chunk text hashes not yet stored
+        
+        Args:
+            hashes: Chunk text hashes
+            vectors: Matching embeddings, shape (len(hashes), dimension)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(hashes):
+            return
+        
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            if self.dimension is None:
+                self.dimension = int(vectors.shape[1])
+                self.meta_file.write_text(
+                    json.dumps({"model": self.model_name, "dimension": self.dimension}),
+                    encoding="utf-8"
+                )
+            
+            new_keys, new_rows, seen = [], [], set()
+            for key, vector in zip(hashes, vectors):
+                if key not in self._index and key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+            
+            # Row offset from the file itself: it is what the vectors land after
+            with open(self.vectors_file, "ab") as f:
+                offset = f.seek(0, os.SEEK_END) // (self.dimension * 4)
+                f.write(np.stack(new_rows).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_file, "a", encoding="utf-8") as f:
+                f.write("".join(f"{key}\n" for key in new_keys))
+            self._keys_read = self.keys_file.stat().st_size
+            
+            for i, key in enumerate(new_keys):
+                self._index[key] = offset + i
+            self._remap()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit rate and disk usage"""
+        lookups = self.hits + self.misses
+        bytes_on_disk = sum(
+            f.stat().st_size for f in (self.vectors_file, self.keys_file, self.meta_file) if f.exists()
+        )
+        return {
+            "model": self.model_name,
+            "vectors": len(self._index),
+            "dimension": self.dimension,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes_on_disk": bytes_on_disk
+        }
+
+
+def open_embedding_store() -> Optional[EmbeddingStore]:
+    """Open the store for the configured model, or None when disabled"""
+    if not settings.embedding_cache_enabled:
+        return None
+    return EmbeddingStore(settings.embedding_cache_dir, settings.embedding_model)
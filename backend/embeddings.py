@@ -8,6 +8,9 @@ from loguru import logger
 import numpy as np
 
 from config import settings
+from embedding_store import open_embedding_store
+from executors import db_executor, inference_executor, run_in_executor
+from text_processing import hash_text
 
 
 class EmbeddingManager:
@@ -19,6 +22,9 @@ class EmbeddingManager:
         self.model = SentenceTransformer(self.model_name)
         self.dimension = self.model.get_sentence_embedding_dimension()
         logger.info(f"Embedding model loaded. Dimension: {self.dimension}")
+        
+        # Persistent (model, chunk hash) -> embedding cache for embed_batch
+        self.store = open_embedding_store()
     
     def embed_text(self, text: str) -> List[float]:
         """
@@ -49,17 +55,109 @@ class EmbeddingManager:
             List of embeddings
         """
         try:
-            embeddings = self.model.encode(
-                texts,
-                batch_size=batch_size,
-                convert_to_numpy=True,
-                show_progress_bar=True
-            )
-            return embeddings.tolist()
+            if self.store is None:
+                return self._encode_batch(texts, batch_size).tolist()
+            
+            # Only encode texts missing from the persistent store
+            hashes = [hash_text(text) for text in texts]
+            cached = self.store.get_many(hashes)
+            misses = [i for i, vector in enumerate(cached) if vector is None]
+            
+            if misses:
+                encoded = self._encode_batch([texts[i] for i in misses], batch_size)
+                self.store.put_many([hashes[i] for i in misses], encoded)
+                for i, vector in zip(misses, encoded):
+                    cached[i] = vector
+            
+            logger.info(f"Embedded {len(misses)} texts ({len(texts) - len(misses)} from store)")
+            return [vector.tolist() for vector in cached]
+            
         except Exception as e:
             logger.error(f"Error embedding batch: {e}")
             raise
     
+    def _encode_batch(self, texts: List[str], batch_size: int, show_progress_bar: bool = True) -> np.ndarray:
+        """Encode texts with the model as a float32 matrix"""
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=show_progress_bar
+        ).astype(np.float32)
+    
+    async def aembed_text(self, text: str) -> List[float]:
+        """
+        Generate embedding for a single text on the inference executor
+        
+        Args:
+            text: Input text to embed
+            
+        Returns:
+            List of floats representing the embedding
+        """
+        return await run_in_executor(inference_executor, self.embed_text, text)
+    
+    async def aembed_batch(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """
+        Generate embeddings for multiple texts on the inference executor
+        
+        Args:
+            texts: List of texts to embed
+            batch_size: Batch size for processing
+            
+        Returns:
+            List of embeddings
+        """
+        return await run_in_executor(
+            inference_executor, self.embed_batch, texts, batch_size=batch_size
+        )
+    
+    async def aembed_queries(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Encode query-like texts on the inference executor
+        
+        Unlike aembed_batch, nothing is read from or written to the
+        persistent chunk store and no progress bar is shown.
+        
+        Args:
+            texts: Texts to embed (queries, router prototypes)
+            batch_size: Batch size for processing
+            
+        Returns:
+            float32 matrix with one embedding per text
+        """
+        return await run_in_executor(
+            inference_executor, self._encode_batch, texts, batch_size, show_progress_bar=False
+        )
+    
+    async def aembed_stored(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        """
+        Embeddings of already indexed texts, for the query path
+        
+        Reads the vectors stored at ingest (read-only) and quietly encodes
+        any misses on the inference executor without persisting them, so
+        per-query callers do not go through the logged, fsync'd batch path.
+        
+        Args:
+            texts: Texts to embed (e.g. retrieved chunk contents)
+            batch_size: Batch size for encoding misses
+            
+        Returns:
+            float32 embedding for each text
+        """
+        vectors = [None] * len(texts)
+        if self.store is not None:
+            vectors = await run_in_executor(
+                db_executor, self.store.get_many, [hash_text(text) for text in texts]
+            )
+        
+        misses = [i for i, vector in enumerate(vectors) if vector is None]
+        if misses:
+            encoded = await self.aembed_queries([texts[i] for i in misses], batch_size)
+            for i, vector in zip(misses, encoded):
+                vectors[i] = vector
+        return vectors
+    
     def compute_similarity(
         self,
         embedding1: Union[List[float], np.ndarray],
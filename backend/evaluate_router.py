@@ -0,0 +1,139 @@
+"""
+Router Evaluation Script
+Compares accuracy and latency of the local embedding router and the routing LLM
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import List, Tuple
+from loguru import logger
+import numpy as np
+import sys
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent))
+
+from agents import coordinator, AgentType
+from embeddings import embeddings
+from router import embedding_router
+
+
+# Held-out labeled queries (not used as routing prototypes)
+EVAL_QUERIES: List[Tuple[str, str]] = [
+    ("Should we enter through a joint venture or a wholly owned subsidiary?", "STRATEGIC"),
+    ("How does KAEC compare to Riyadh for a regional headquarters?", "STRATEGIC"),
+    ("Which sectors are prioritized under Vision 2030 for foreign firms?", "STRATEGIC"),
+    ("What is our competitive advantage against local cloud providers?", "STRATEGIC"),
+    ("What sequencing of zones do you recommend for the first three years?", "STRATEGIC"),
+    ("Is NEOM a better long-term location than Jeddah for AI infrastructure?", "STRATEGIC"),
+    ("How much can we save with the NEOM tax holiday?", "FINANCIAL"),
+    ("What is the break-even point of the project?", "FINANCIAL"),
+    ("Estimate the total investment required for phase one", "FINANCIAL"),
+    ("How do customs duty exemptions affect our costs?", "FINANCIAL"),
+    ("What discount rate was used in the valuation?", "FINANCIAL"),
+    ("What are the withholding tax implications of repatriating profits?", "FINANCIAL"),
+    ("How do we comply with the Personal Data Protection Law?", "RISK"),
+    ("What are the risks of regional political instability?", "RISK"),
+    ("Which permits could delay construction?", "RISK"),
+    ("How severe is the talent shortage risk and how do we address it?", "RISK"),
+    ("What are the penalties for failing localization targets?", "RISK"),
+    ("What could cause the project to fail?", "RISK"),
+    ("What is this system about?", "GENERAL"),
+    ("Can you give me a short introduction to the Saudi market?", "GENERAL"),
+    ("Where is KAEC located?", "GENERAL"),
+    ("What are the main points of the executive brief?", "GENERAL"),
+    ("Thanks, that was helpful", "GENERAL"),
+    ("What time zone is Saudi Arabia in?", "GENERAL"),
+]
+
+
+def _label(agent_type: AgentType) -> str:
+    """Map an AgentType back to its routing label"""
+    return {
+        AgentType.STRATEGIC: "STRATEGIC",
+        AgentType.FINANCIAL: "FINANCIAL",
+        AgentType.RISK: "RISK",
+    }.get(agent_type, "GENERAL")
+
+
+def _summarize(name: str, predictions: List[str], latencies_ms: List[float], labels: List[str]):
+    """Log accuracy and latency percentiles for one router"""
+    correct = sum(p == l for p, l in zip(predictions, labels))
+    logger.info(
+        f"{name:<14} accuracy={correct / len(labels):.1%} ({correct}/{len(labels)})  "
+        f"p50={np.percentile(latencies_ms, 50):.2f}ms  "
+        f"p95={np.percentile(latencies_ms, 95):.2f}ms  "
+        f"mean={np.mean(latencies_ms):.2f}ms"
+    )
+
+
+async def evaluate(skip_llm: bool = False):
+    """Run both routers over the evaluation set"""
+    labels = [label for _, label in EVAL_QUERIES]
+    queries = [query for query, _ in EVAL_QUERIES]
+    
+    # Embeddings are computed for retrieval anyway, so the local router's
+    # latency excludes them; report the embedding cost separately
+    start = time.perf_counter()
+    query_embeddings = (await embeddings.aembed_queries(queries)).tolist()
+    embed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    
+    # Warm up the centroids before timing
+    await embedding_router.classify(query_embeddings[0])
+    
+    local_predictions, local_latencies, margins = [], [], []
+    for query_embedding in query_embeddings:
+        start = time.perf_counter()
+        label, margin = await embedding_router.classify(query_embedding)
+        local_latencies.append((time.perf_counter() - start) * 1000)
+        local_predictions.append(label)
+        margins.append(margin)
+    
+    logger.info(f"Evaluated {len(queries)} queries (embedding cost {embed_ms:.2f}ms/query)")
+    _summarize("local", local_predictions, local_latencies, labels)
+    
+    confident = [i for i, m in enumerate(margins) if embedding_router.is_confident(m)]
+    if confident:
+        confident_correct = sum(local_predictions[i] == labels[i] for i in confident)
+        logger.info(
+            f"local (margin >= {embedding_router.min_margin}) covers "
+            f"{len(confident)}/{len(queries)} queries at "
+            f"{confident_correct / len(confident):.1%} accuracy"
+        )
+    
+    if skip_llm:
+        return
+    
+    llm_predictions, llm_latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        agent_type = await coordinator.route_query_llm(query)
+        llm_latencies.append((time.perf_counter() - start) * 1000)
+        llm_predictions.append(_label(agent_type))
+    
+    _summarize("llm", llm_predictions, llm_latencies, labels)
+    
+    # Hybrid: local when confident, LLM otherwise
+    hybrid_predictions = [
+        local_predictions[i] if embedding_router.is_confident(margins[i]) else llm_predictions[i]
+        for i in range(len(queries))
+    ]
+    hybrid_latencies = [
+        local_latencies[i] if embedding_router.is_confident(margins[i])
+        else local_latencies[i] + llm_latencies[i]
+        for i in range(len(queries))
+    ]
+    _summarize("local+fallback", hybrid_predictions, hybrid_latencies, labels)
+    
+    for query, label, local, llm in zip(queries, labels, local_predictions, llm_predictions):
+        if local != label or llm != label:
+            logger.debug(f"[{label}] local={local} llm={llm}: {query}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare local and LLM query routers")
+    parser.add_argument("--skip-llm", action="store_true", help="Only evaluate the local router")
+    args = parser.parse_args()
+    
+    asyncio.run(evaluate(skip_llm=args.skip_llm))
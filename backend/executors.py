@@ -0,0 +1,56 @@
+"""
+Executor Pools for KANZ System
+Runs blocking database I/O and model inference off the event loop
+"""
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+from loguru import logger
+
+from config import settings
+
+T = TypeVar("T")
+
+
+# Bounded pool for the synchronous supabase client (PostgREST round-trips)
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.db_executor_workers,
+    thread_name_prefix="kanz-db"
+)
+
+# Dedicated pool for SentenceTransformer.encode; torch already parallelizes
+# a single forward pass, so a small pool avoids oversubscribing the CPU
+inference_executor = ThreadPoolExecutor(
+    max_workers=settings.inference_executor_workers,
+    thread_name_prefix="kanz-inference"
+)
+
+
+async def run_in_executor(
+    executor: Executor,
+    func: Callable[..., T],
+    *args: Any,
+    **kwargs: Any
+) -> T:
+    """
+    Run a blocking callable on the given executor
+    
+    Args:
+        executor: Executor to run the callable on
+        func: Blocking callable
+        *args: Positional arguments for the callable
+        **kwargs: Keyword arguments for the callable
+        
+    Returns:
+        The callable's return value
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """Shut down executor pools, waiting for in-flight work"""
+    db_executor.shutdown(wait=True)
+    inference_executor.shutdown(wait=True)
+    logger.info("Executor pools shut down")
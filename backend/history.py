@@ -0,0 +1,185 @@
+"""
+Chat History for KANZ System
+Loads the recent tail of a session and keeps a running summary of older turns
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
+from langchain_groq import ChatGroq
+from langchain.schema import SystemMessage, HumanMessage
+from loguru import logger
+
+from config import settings
+from database import db
+
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an investment advisory assistant.
+Update the current summary with the new turns. Keep facts, figures, decisions and open questions the user cares about; drop pleasantries.
+Respond with the updated summary only, in at most 200 words."""
+
+# Longest excerpt of a single message sent to the summarizer
+MAX_TURN_CHARS = 2000
+
+# Most unsummarized messages from before the fetched tail folded in at once;
+# a longer backlog catches up over the next turns
+MAX_BACKLOG_MESSAGES = 20
+
+
+class ChatHistory:
+    """
+    Bounded chat history with incremental summarization
+    
+    Only the last few messages are fetched per turn. Turns that no longer
+    fit the prompt budget, and older turns that scrolled out of the fetched
+    tail unsummarized, are folded into a summary stored in the session
+    metadata, in the background after the answer is sent, so prompt size
+    and database payload stay flat as a session grows.
+    """
+    
+    def __init__(self, fetch_limit: int = 10, summary_enabled: bool = True, summary_max_tokens: int = 300):
+        self.fetch_limit = fetch_limit
+        self.summary_enabled = summary_enabled
+        self.llm = ChatGroq(
+            api_key=settings.groq_api_key,
+            model_name=settings.routing_model,
+            temperature=0,
+            max_tokens=summary_max_tokens
+        )
+        self._summarizing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        
+        self.summaries = 0
+        self.summary_failures = 0
+        self.summarized_messages = 0
+    
+    async def load(self, session_id: UUID, session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Load the recent messages and running summary of a session
+        
+        Args:
+            session_id: Chat session ID
+            session: The session row, if the caller already fetched it
+        
+        Returns:
+            Dict with messages (oldest first, excluding those already
+            summarized), summary, the session metadata and backlog_before:
+            the created_at of the oldest message when older, unsummarized
+            messages may precede it (else None)
+        """
+        if session is None:
+            session, messages = await asyncio.gather(
+                db.get_session(session_id),
+                db.get_recent_messages(session_id, self.fetch_limit)
+            )
+        else:
+            messages = await db.get_recent_messages(session_id, self.fetch_limit)
+        metadata = (session or {}).get("metadata") or {}
+        
+        fetched = len(messages)
+        summary_until = metadata.get("summary_until")
+        if summary_until:
+            cutoff = datetime.fromisoformat(summary_until)
+            messages = [m for m in messages if datetime.fromisoformat(m["created_at"]) > cutoff]
+        
+        # A full tail with nothing summarized in it means the session has
+        # more messages than were fetched, none of them summarized yet
+        backlog_before = None
+        if messages and len(messages) == fetched == self.fetch_limit:
+            if (session or {}).get("message_count", fetched) > fetched:
+                backlog_before = messages[0]["created_at"]
+        
+        return {
+            "messages": messages,
+            "summary": metadata.get("history_summary"),
+            "metadata": metadata,
+            "backlog_before": backlog_before
+        }
+    
+    def schedule_summary(
+        self,
+        session_id: Optional[UUID],
+        summary: Optional[str],
+        metadata: Optional[Dict[str, Any]],
+        dropped: List[Dict],
+        backlog_before: Optional[str] = None
+    ):
+        """
+        Fold messages that no longer fit the prompt into the summary, in the background
+        
+        With backlog_before, unsummarized messages older than that (those
+        outside the fetched tail) are fetched and folded in first.
+        """
+        if not self.summary_enabled or session_id is None or not (dropped or backlog_before):
+            return
+        
+        # One summary update per session at a time; later turns catch up
+        key = str(session_id)
+        if key in self._summarizing:
+            return
+        self._summarizing.add(key)
+        
+        task = asyncio.create_task(
+            self._summarize(session_id, summary, metadata or {}, dropped, backlog_before)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._summarizing.discard(key))
+    
+    async def _summarize(
+        self,
+        session_id: UUID,
+        summary: Optional[str],
+        metadata: Dict[str, Any],
+        dropped: List[Dict],
+        backlog_before: Optional[str] = None
+    ):
+        """Ask the LLM for an updated summary and store it on the session"""
+        try:
+            turns = dropped
+            if backlog_before:
+                backlog = await db.get_messages_between(
+                    session_id, metadata.get("summary_until"), backlog_before, MAX_BACKLOG_MESSAGES
+                )
+                # The dropped turns must not skip past unread backlog
+                turns = backlog if len(backlog) == MAX_BACKLOG_MESSAGES else backlog + dropped
+            if not turns:
+                return
+            
+            transcript = "\n".join(
+                f"{message['role']}: {message['content'][:MAX_TURN_CHARS]}"
+                for message in turns
+            )
+            response = await self.llm.ainvoke([
+                SystemMessage(content=SUMMARY_PROMPT),
+                HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}")
+            ])
+            await db.update_session_metadata(session_id, {
+                **metadata,
+                "history_summary": response.content.strip(),
+                "summary_until": turns[-1]["created_at"]
+            })
+            self.summaries += 1
+            self.summarized_messages += len(turns)
+        
+        except Exception as e:
+            self.summary_failures += 1
+            logger.warning(f"Could not update history summary for session {session_id}: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get summarization statistics"""
+        return {
+            "fetch_limit": self.fetch_limit,
+            "summaries": self.summaries,
+            "summarized_messages": self.summarized_messages,
+            "summary_failures": self.summary_failures,
+            "in_progress": len(self._summarizing)
+        }
+
+
+# Global session history instance
+session_history = ChatHistory(
+    fetch_limit=settings.history_fetch_limit,
+    summary_enabled=settings.history_summary_enabled,
+    summary_max_tokens=settings.history_summary_max_tokens
+)
@@ -0,0 +1,183 @@
+"""
+Incremental Document Indexer for KANZ System
+Skips unchanged documents and re-embeds only the chunks whose content changed
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import UUID
+from loguru import logger
+
+from database import db
+from text_processing import hash_text
+
+
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+InsertFn = Callable[[UUID, List[Dict[str, Any]]], Awaitable[Any]]
+
+# Document metadata copied onto chunk metadata for filtered retrieval
+CHUNK_FILTER_FIELDS = ("type", "date")
+
+
+class DocumentIndexer:
+    """Index documents by content hash with chunk-level diffing"""
+    
+    async def index_document(
+        self,
+        title: str,
+        content: str,
+        source: str,
+        metadata: Dict[str, Any],
+        chunks: List[str],
+        embed_fn: EmbedFn,
+        insert_fn: Optional[InsertFn] = None
+    ) -> Dict[str, Any]:
+        """
+        Index a chunked document, reusing whatever is already stored
+        
+        A document whose stored version (same title and source) has the same
+        content hash and metadata is skipped. Otherwise that version is
+        updated in place: unchanged chunks keep their embeddings (their
+        metadata is refreshed), new chunks are embedded and inserted, and
+        stale chunks are deleted. Without a stored version it is created.
+        
+        Args:
+            title: Document title
+            content: Document content
+            source: Source identifier
+            metadata: Additional metadata
+            chunks: Chunk texts in document order
+            embed_fn: Async callable embedding a list of texts
+            insert_fn: Async callable inserting chunk rows (default db.create_chunks)
+        
+        Returns:
+            Dict with document_id, status (unchanged/created/updated) and
+            embedded/reused/deleted chunk counts
+        """
+        insert_fn = insert_fn or db.create_chunks
+        content_hash = hash_text(content)
+        
+        # Only this document's own stored version counts as unchanged; the
+        # same text under another title or source is a separate document
+        previous = await db.find_document(title, source)
+        if (
+            previous is not None
+            and previous.get("content_hash") == content_hash
+            and (previous.get("metadata") or {}) == (metadata or {})
+        ):
+            logger.info(f"Document unchanged, skipping: {title} ({previous['id']})")
+            return {
+                "document_id": str(previous["id"]),
+                "status": "unchanged",
+                "embedded": 0,
+                "reused": 0,
+                "deleted": 0
+            }
+        
+        # Document fields that retrieval can filter on are copied to each chunk
+        filter_fields = {
+            key: metadata[key]
+            for key in CHUNK_FILTER_FIELDS
+            if metadata and metadata.get(key) is not None
+        }
+        
+        rows = [
+            {
+                "content": chunk,
+                "index": idx,
+                "content_hash": hash_text(chunk),
+                "metadata": {
+                    "title": title,
+                    "source": source,
+                    "chunk_length": len(chunk),
+                    **filter_fields
+                }
+            }
+            for idx, chunk in enumerate(chunks)
+        ]
+        
+        if previous is None:
+            doc_id = await db.create_document(
+                title=title,
+                content=content,
+                source=source,
+                metadata=metadata,
+                content_hash=content_hash
+            )
+            
+            try:
+                await self._embed_and_insert(doc_id, rows, embed_fn, insert_fn)
+            except Exception:
+                # Remove the partial document so a retry starts clean
+                await db.delete_document(doc_id)
+                raise
+            
+            return {
+                "document_id": str(doc_id),
+                "status": "created",
+                "embedded": len(rows),
+                "reused": 0,
+                "deleted": 0
+            }
+        
+        doc_id = UUID(previous["id"])
+        
+        # Match new chunks to stored ones by hash (duplicates matched one-to-one)
+        stored_by_hash: Dict[str, List[Dict]] = {}
+        for stored in await db.get_chunk_hashes(doc_id):
+            stored_by_hash.setdefault(stored["content_hash"], []).append(stored)
+        
+        new_rows, moved_rows, reused = [], [], 0
+        for row in rows:
+            candidates = stored_by_hash.get(row["content_hash"])
+            if candidates:
+                stored = candidates.pop()
+                reused += 1
+                # Reused chunks also pick up changed document metadata (title,
+                # type, date) so retrieval filters see the current values
+                if stored["chunk_index"] != row["index"] or stored.get("metadata") != row["metadata"]:
+                    moved_rows.append({**row, "id": stored["id"]})
+            else:
+                new_rows.append(row)
+        
+        stale_ids = [stored["id"] for group in stored_by_hash.values() for stored in group]
+        
+        await self._embed_and_insert(doc_id, new_rows, embed_fn, insert_fn)
+        if moved_rows:
+            await db.update_chunk_positions(doc_id, moved_rows)
+        if stale_ids:
+            await db.delete_chunks(stale_ids)
+        
+        # Update the document hash last so an interrupted update is retried
+        await db.update_document(doc_id, content, content_hash, metadata)
+        
+        logger.info(
+            f"Document updated: {title} ({doc_id}) - {len(new_rows)} embedded, "
+            f"{reused} reused, {len(stale_ids)} deleted"
+        )
+        return {
+            "document_id": str(doc_id),
+            "status": "updated",
+            "embedded": len(new_rows),
+            "reused": reused,
+            "deleted": len(stale_ids)
+        }
+    
+    async def _embed_and_insert(
+        self,
+        doc_id: UUID,
+        rows: List[Dict[str, Any]],
+        embed_fn: EmbedFn,
+        insert_fn: InsertFn
+    ):
+        """Embed chunk rows and insert them"""
+        if not rows:
+            return
+        
+        vectors = await embed_fn([row["content"] for row in rows])
+        for row, vector in zip(rows, vectors):
+            row["embedding"] = vector
+        
+        await insert_fn(doc_id, rows)
+
+
+# Global document indexer instance
+indexer = DocumentIndexer()
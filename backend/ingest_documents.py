@@ -1,91 +1,435 @@
 """
 Document Ingestion Script
-Loads initial Saudi Investment documents into the RAG system
+Streams a directory or glob of documents through clean -> chunk -> embed -> insert,
+re-embedding only chunks whose content hash changed
+
+Usage:
+    python ingest_documents.py                          # bundled ../data reports
+    python ingest_documents.py reports/ "archive/**/*.txt" --workers 4
 """
+import argparse
 import asyncio
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 from loguru import logger
+import numpy as np
 import sys
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent))
 
-from document_processor import doc_processor
+from config import settings
 from database import db
+from embedding_store import EmbeddingStore, open_embedding_store
+from indexer import indexer
+from postgres import pg
+from text_processing import hash_text
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+DEFAULT_STATE_FILE = Path(__file__).parent / ".ingest_state.json"
+
+# Curated metadata for the bundled reports; other files get derived metadata
+KNOWN_DOCUMENTS = {
+    "Saudi_Arabia_Market_Entry_Strategy_McKinsey_Report.txt": {
+        "title": "Saudi Arabia Market Entry Strategy - Full Report",
+        "source": "mckinsey_strategic_analysis",
+        "metadata": {
+            "type": "strategic_report",
+            "date": "2025-08",
+            "author": "McKinsey & Company",
+            "sections": [
+                "executive_summary",
+                "strategic_pillars",
+                "financial_analysis",
+                "risk_assessment",
+                "implementation_roadmap"
+            ]
+        }
+    },
+    "Executive_One_Pager_Saudi_Investment.txt": {
+        "title": "Executive One-Pager - Board Decision Brief",
+        "source": "executive_summary",
+        "metadata": {
+            "type": "executive_brief",
+            "audience": "c_suite",
+            "date": "2025-08"
+        }
+    }
+}
+
+
+# ==================== Worker Process ====================
 
+_worker_model = None
+_worker_splitter = None
 
-async def ingest_documents():
-    """Ingest initial documents into the system"""
+
+def _init_worker(torch_threads: int):
+    """Load the embedding model and text splitter once per worker process"""
+    global _worker_model, _worker_splitter
     
-    logger.info("Starting document ingestion...")
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from text_processing import create_text_splitter
+    
+    # Split the CPU between workers instead of letting each grab every core
+    torch.set_num_threads(torch_threads)
+    _worker_model = SentenceTransformer(settings.embedding_model)
+    _worker_splitter = create_text_splitter()
+
+
+def _chunk_document(path: str) -> Dict[str, Any]:
+    """Read, clean and chunk one file inside a worker process"""
+    from text_processing import clean_text
+    
+    content = Path(path).read_text(encoding="utf-8")
+    chunks = _worker_splitter.split_text(clean_text(content))
+    
+    return {
+        "path": path,
+        "content": content,
+        "chunks": chunks
+    }
+
+
+def _embed_texts(texts: List[str], embed_batch_size: int) -> np.ndarray:
+    """Embed chunk texts inside a worker process"""
+    return _worker_model.encode(
+        texts,
+        batch_size=embed_batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    ).astype(np.float32)
+
+
+# ==================== Discovery & Resume State ====================
+
+def discover_files(paths: List[str], pattern: str) -> List[Path]:
+    """Expand directories, globs and file paths into a sorted file list"""
+    files = set()
+    
+    for entry in paths:
+        path = Path(entry)
+        if path.is_dir():
+            files.update(p for p in path.rglob(pattern) if p.is_file())
+        elif path.is_file():
+            files.add(path)
+        else:
+            matches = [Path(p) for p in glob.glob(entry, recursive=True)]
+            if not matches:
+                logger.warning(f"No files match: {entry}")
+            files.update(p for p in matches if p.is_file())
+    
+    return sorted(p.resolve() for p in files)
+
+
+def _file_signature(path: Path) -> Dict[str, Any]:
+    """Size and mtime used to detect files that changed since the last run"""
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def load_state(state_file: Path) -> Dict[str, Dict[str, Any]]:
+    """Load the resume state (completed files)"""
+    if not state_file.exists():
+        return {}
+    try:
+        return json.loads(state_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable state file {state_file}: {e}")
+        return {}
+
+
+def save_state(state_file: Path, state: Dict[str, Dict[str, Any]]):
+    """Atomically write the resume state"""
+    tmp_file = state_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp_file, state_file)
+
+
+def describe_document(path: Path, default_source: str) -> Dict[str, Any]:
+    """Title, source and metadata for a file"""
+    if path.name in KNOWN_DOCUMENTS:
+        return KNOWN_DOCUMENTS[path.name]
     
-    # Define documents to ingest
-    documents = [
-        {
-            "title": "Saudi Arabia Market Entry Strategy - Full Report",
-            "file_path": "/mnt/user-data/outputs/Saudi_Arabia_Market_Entry_Strategy_McKinsey_Report.txt",
-            "source": "mckinsey_strategic_analysis",
-            "metadata": {
-                "type": "strategic_report",
-                "date": "2025-08",
-                "author": "McKinsey & Company",
-                "sections": [
-                    "executive_summary",
-                    "strategic_pillars",
-                    "financial_analysis",
-                    "risk_assessment",
-                    "implementation_roadmap"
-                ]
-            }
-        },
-        {
-            "title": "Executive One-Pager - Board Decision Brief",
-            "file_path": "/mnt/user-data/outputs/Executive_One_Pager_Saudi_Investment.txt",
-            "source": "executive_summary",
-            "metadata": {
-                "type": "executive_brief",
-                "audience": "c_suite",
-                "date": "2025-08"
-            }
+    return {
+        "title": path.stem.replace("_", " ").strip(),
+        "source": default_source,
+        "metadata": {
+            "type": path.suffix.lstrip(".") or "text",
+            "file_name": path.name
         }
-    ]
-    
-    # Read and ingest each document
-    for doc_info in documents:
-        try:
-            logger.info(f"Processing: {doc_info['title']}")
-            
-            # Read file content
-            file_path = Path(doc_info['file_path'])
-            if not file_path.exists():
-                logger.warning(f"File not found: {file_path}")
-                continue
-            
-            content = file_path.read_text(encoding='utf-8')
-            
-            # Ingest document
-            doc_id = await doc_processor.process_and_index_document(
-                title=doc_info['title'],
-                content=content,
-                source=doc_info['source'],
-                metadata=doc_info['metadata']
+    }
+
+
+# ==================== Insert Stage ====================
+
+def _estimate_row_bytes(content: str, dimension: int) -> int:
+    """Approximate JSON payload size of one chunk row"""
+    # Floats are sent as decimal text: roughly 12 bytes each with separators
+    return len(content.encode("utf-8")) + dimension * 12 + 256
+
+
+def batch_rows(
+    rows: List[Dict[str, Any]],
+    max_rows: int,
+    max_bytes: int
+) -> Iterator[List[Dict[str, Any]]]:
+    """Split chunk rows into inserts capped by row count and payload size"""
+    batch, batch_bytes = [], 0
+    
+    for row in rows:
+        row_bytes = _estimate_row_bytes(row["content"], len(row["embedding"]))
+        if batch and (len(batch) >= max_rows or batch_bytes + row_bytes > max_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(row)
+        batch_bytes += row_bytes
+    
+    if batch:
+        yield batch
+
+
+async def insert_document(
+    prepared: Dict[str, Any],
+    info: Dict[str, Any],
+    args: argparse.Namespace,
+    pool: ProcessPoolExecutor,
+    store: Optional[EmbeddingStore]
+) -> Dict[str, Any]:
+    """Index a chunked document, embedding only new chunks in the process pool"""
+    loop = asyncio.get_running_loop()
+    
+    async def embed_fn(texts: List[str]) -> List[np.ndarray]:
+        if store is None:
+            return list(await loop.run_in_executor(pool, _embed_texts, texts, args.embed_batch_size))
+        
+        # Only send texts missing from the persistent store to the workers
+        hashes = [hash_text(text) for text in texts]
+        vectors = store.get_many(hashes)
+        misses = [i for i, vector in enumerate(vectors) if vector is None]
+        if misses:
+            encoded = await loop.run_in_executor(
+                pool, _embed_texts, [texts[i] for i in misses], args.embed_batch_size
             )
-            
-            logger.success(f"✓ Ingested: {doc_info['title']} (ID: {doc_id})")
-            
-        except Exception as e:
-            logger.error(f"✗ Error ingesting {doc_info['title']}: {e}")
+            store.put_many([hashes[i] for i in misses], encoded)
+            for i, vector in zip(misses, encoded):
+                vectors[i] = vector
+        return vectors
+    
+    async def insert_fn(doc_id, rows: List[Dict[str, Any]]):
+        if settings.direct_pg_enabled:
+            # Binary COPY streams float32 rows; no JSON payload to split
+            await db.create_chunks(doc_id, rows)
+            return
+        
+        rows = [{**row, "embedding": np.asarray(row["embedding"]).tolist()} for row in rows]
+        for batch in batch_rows(rows, args.insert_batch_size, args.max_insert_bytes):
+            await db.create_chunks(doc_id, batch)
+    
+    return await indexer.index_document(
+        title=info["title"],
+        content=prepared["content"],
+        source=info["source"],
+        metadata=info["metadata"],
+        chunks=prepared["chunks"],
+        embed_fn=embed_fn,
+        insert_fn=insert_fn
+    )
+
+
+# ==================== Pipeline ====================
+
+async def run_pipeline(files: List[Path], args: argparse.Namespace) -> Dict[str, Any]:
+    """Stream files through the prepare (process pool) and insert stages"""
+    loop = asyncio.get_running_loop()
+    state_file = Path(args.state_file)
+    state = load_state(state_file) if args.resume else {}
+    store = open_embedding_store()
+    
+    stats = {
+        "documents": 0, "chunks": 0, "bytes": 0, "skipped": 0, "failed": 0,
+        "unchanged": 0, "embedded": 0, "reused": 0, "deleted": 0
+    }
+    
+    pending = []
+    for path in files:
+        signature = _file_signature(path)
+        previous = state.get(str(path))
+        if previous and previous["size"] == signature["size"] and previous["mtime"] == signature["mtime"]:
+            stats["skipped"] += 1
             continue
+        pending.append((path, signature))
+    
+    logger.info(
+        f"Ingesting {len(pending)} files "
+        f"({stats['skipped']} already ingested, {args.workers} workers)"
+    )
+    
+    # Bounded queue between the prepare and insert stages; the semaphore
+    # bounds work in flight in the process pool
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+    in_flight = asyncio.Semaphore(args.queue_size)
+    torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    
+    start_time = time.perf_counter()
+    
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(torch_threads,)
+    ) as pool:
+        
+        async def prepare(path: Path, signature: Dict[str, Any]):
+            async with in_flight:
+                try:
+                    prepared = await loop.run_in_executor(pool, _chunk_document, str(path))
+                except Exception as e:
+                    logger.error(f"✗ Error preparing {path}: {e}")
+                    stats["failed"] += 1
+                    return
+                await queue.put((prepared, signature))
+        
+        async def produce():
+            await asyncio.gather(*(prepare(path, signature) for path, signature in pending))
+            for _ in range(args.insert_concurrency):
+                await queue.put(None)
+        
+        async def consume():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                
+                prepared, signature = item
+                path = Path(prepared["path"])
+                info = describe_document(path, args.source)
+                
+                try:
+                    result = await insert_document(prepared, info, args, pool, store)
+                except Exception as e:
+                    logger.error(f"✗ Error ingesting {path}: {e}")
+                    stats["failed"] += 1
+                    continue
+                
+                # Throughput counts only what was written; unchanged documents
+                # and reused chunks cost no embedding or insert
+                stats["documents"] += 1
+                stats["chunks"] += result["embedded"]
+                if result["status"] == "unchanged":
+                    stats["unchanged"] += 1
+                else:
+                    stats["bytes"] += len(prepared["content"].encode("utf-8"))
+                for key in ("embedded", "reused", "deleted"):
+                    stats[key] += result[key]
+                
+                doc_id = result["document_id"]
+                state[str(path)] = {**signature, "document_id": doc_id}
+                save_state(state_file, state)
+                
+                logger.success(
+                    f"✓ {result['status'].capitalize()}: {info['title']} "
+                    f"({result['embedded']} embedded, {result['reused']} reused, ID: {doc_id})"
+                )
+        
+        await asyncio.gather(
+            produce(),
+            *(consume() for _ in range(args.insert_concurrency))
+        )
+    
+    stats["elapsed_s"] = time.perf_counter() - start_time
+    if store is not None:
+        stats["embedding_store"] = store.get_stats()
+    return stats
+
+
+def report(stats: Dict[str, Any]):
+    """Log the throughput report"""
+    elapsed = stats["elapsed_s"] or 1e-9
+    logger.info(
+        f"Ingested {stats['documents']} documents / {stats['chunks']} chunks written "
+        f"in {stats['elapsed_s']:.1f}s "
+        f"({stats['skipped']} skipped, {stats['failed']} failed)"
+    )
+    logger.info(
+        f"Chunks: {stats['embedded']} embedded, {stats['reused']} reused, "
+        f"{stats['deleted']} deleted ({stats['unchanged']} documents unchanged)"
+    )
+    if "embedding_store" in stats:
+        store_stats = stats["embedding_store"]
+        logger.info(
+            f"Embedding store: {store_stats['hit_rate']:.1%} hit rate "
+            f"({store_stats['hits']} hits, {store_stats['misses']} misses), "
+            f"{store_stats['vectors']} vectors, "
+            f"{store_stats['bytes_on_disk'] / 1024 / 1024:.1f} MiB on disk"
+        )
+    logger.info(
+        f"Throughput: {stats['documents'] / elapsed:.2f} docs/s, "
+        f"{stats['chunks'] / elapsed:.1f} chunks/s, "
+        f"{stats['bytes'] / elapsed / 1024:.1f} KiB/s"
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line arguments"""
+    cpu_count = os.cpu_count() or 1
+    
+    parser = argparse.ArgumentParser(description="Bulk-ingest documents into the KANZ RAG index")
+    parser.add_argument("paths", nargs="*", default=[str(DATA_DIR)],
+                        help="Files, directories or glob patterns (default: bundled data directory)")
+    parser.add_argument("--pattern", default="*.txt",
+                        help="File pattern used when walking directories")
+    parser.add_argument("--source", default="bulk_ingest",
+                        help="Source identifier for files without curated metadata")
+    parser.add_argument("--workers", type=int, default=max(1, cpu_count // 2),
+                        help="Processes used for chunking and embedding")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Maximum prepared documents buffered before insertion")
+    parser.add_argument("--insert-concurrency", type=int, default=2,
+                        help="Concurrent insert workers")
+    parser.add_argument("--insert-batch-size", type=int, default=200,
+                        help="Maximum chunk rows per insert")
+    parser.add_argument("--max-insert-bytes", type=int, default=2_000_000,
+                        help="Approximate maximum payload size per insert")
+    parser.add_argument("--embed-batch-size", type=int, default=32,
+                        help="Batch size for model.encode")
+    parser.add_argument("--state-file", default=str(DEFAULT_STATE_FILE),
+                        help="Resume state file recording completed files")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="Ignore the state file and ingest every file")
+    return parser.parse_args(argv)
+
+
+async def ingest_documents(args: argparse.Namespace):
+    """Ingest documents into the system"""
+    
+    logger.info("Starting document ingestion...")
+    
+    files = discover_files(args.paths, args.pattern)
+    if not files:
+        logger.warning("No files to ingest")
+        return
+    
+    stats = await run_pipeline(files, args)
+    report(stats)
     
     logger.success("Document ingestion complete!")
     
     # Show summary
-    result = db.client.table("documents").select("*", count="exact").execute()
-    chunk_result = db.client.table("document_chunks").select("*", count="exact").execute()
+    result = await db.execute(db.client.table("documents").select("id", count="exact").limit(1))
+    chunk_result = await db.execute(db.client.table("document_chunks").select("id", count="exact").limit(1))
     
     logger.info(f"Total documents: {result.count if hasattr(result, 'count') else 'N/A'}")
     logger.info(f"Total chunks: {chunk_result.count if hasattr(chunk_result, 'count') else 'N/A'}")
+    
+    await pg.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(ingest_documents())
+    asyncio.run(ingest_documents(parse_args()))
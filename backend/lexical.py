@@ -0,0 +1,118 @@
+"""
+Lexical Search for KANZ System
+In-process BM25 inverted index and reciprocal rank fusion
+"""
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+TOKEN_PATTERN = re.compile(r"\w+%?")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; keeps trailing % so '15%' stays an exact term"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of texts"""
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.avg_length = 0.0
+    
+    def build(self, texts: List[str]):
+        """
+        Build the inverted index
+        
+        Args:
+            texts: Texts to index; search results refer to their positions
+        """
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = []
+        
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_idx, tf))
+        
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        allowed: Optional[Set[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Score indexed texts against a query
+        
+        Args:
+            query: Query text
+            top_k: Number of results to return
+            allowed: Only score these text positions (None for all)
+        
+        Returns:
+            List of (text position, BM25 score), best first
+        """
+        n_docs = len(self.doc_lengths)
+        if not n_docs:
+            return []
+        
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_idx, tf in postings:
+                if allowed is not None and doc_idx not in allowed:
+                    continue
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_idx] / self.avg_length
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+def reciprocal_rank_fusion(
+    result_lists: Dict[str, List[Dict[str, Any]]],
+    top_k: int,
+    k: int = 60
+) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked chunk lists with reciprocal rank fusion
+    
+    Args:
+        result_lists: Ranked chunk lists by retrieval leg name
+        top_k: Number of fused results to return
+        k: RRF rank constant
+    
+    Returns:
+        Fused chunks with rrf_score and the rank from each leg that found them
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    
+    for leg, results in result_lists.items():
+        for rank, chunk in enumerate(results, 1):
+            entry = fused.get(chunk["id"])
+            if entry is None:
+                entry = {**chunk, "rrf_score": 0.0}
+                fused[chunk["id"]] = entry
+            else:
+                # Keep the vector similarity when the other leg saw the chunk first
+                for key, value in chunk.items():
+                    entry.setdefault(key, value)
+            entry["rrf_score"] += 1.0 / (k + rank)
+            entry[f"{leg}_rank"] = rank
+    
+    ranked = sorted(fused.values(), key=lambda chunk: chunk["rrf_score"], reverse=True)
+    return ranked[:top_k]
@@ -3,18 +3,31 @@ Main FastAPI Application for KANZ System
 """
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from uuid import UUID, uuid4
 from loguru import logger
+import base64
+import json
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from config import settings
 from database import db
 from document_processor import doc_processor
 from agents import coordinator, AgentType
+from embedding_batcher import embedding_batcher
+from embeddings import embeddings
+from retrieval import retriever
+from router import embedding_router
+from semantic_cache import semantic_cache
+from context_packing import context_packer
+from executors import shutdown_executors
+from history import session_history
+from metrics import loop_monitor, observe_error, observe_query, render_metrics
+from postgres import pg
+from tracing import RequestTrace
 
 # Configure logger
 logger.remove()
@@ -40,11 +53,25 @@ app.add_middleware(
 
 # ==================== Pydantic Models ====================
 
+class SearchFilters(BaseModel):
+    """Restrict retrieval to matching document chunks"""
+    source: Optional[str] = Field(None, description="Document source, e.g. executive_summary")
+    document_id: Optional[UUID] = Field(None, description="Only chunks of this document")
+    type: Optional[str] = Field(None, description="Document type, e.g. strategic_report")
+    date_from: Optional[str] = Field(None, description="Earliest document date (YYYY-MM)")
+    date_to: Optional[str] = Field(None, description="Latest document date (YYYY-MM)")
+    
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        """Filters that are set, or None when unfiltered"""
+        return self.model_dump(exclude_none=True) or None
+
+
 class QueryRequest(BaseModel):
     """Request model for chat queries"""
     query: str = Field(..., description="User query")
     session_id: Optional[str] = Field(None, description="Chat session ID")
     agent_type: Optional[str] = Field(None, description="Specific agent to use")
+    filters: Optional[SearchFilters] = Field(None, description="Retrieval filters")
 
 
 class QueryResponse(BaseModel):
@@ -54,6 +81,16 @@ class QueryResponse(BaseModel):
     sources: List[Dict[str, Any]]
     session_id: str
     response_time_ms: int
+    cache_hit: bool = False
+    tokens_used: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    tokens_estimated: bool = Field(default=False, description="Token counts are local estimates (no usage reported)")
+    tokens_saved: int = Field(default=0, description="Prompt tokens avoided by context packing")
+    timings: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Per-stage latency in ms (session, route, embed, vector_search, llm, persist, total, ...)"
+    )
 
 
 class SessionCreate(BaseModel):
@@ -93,12 +130,23 @@ async def startup_event():
     logger.info(f"Environment: {settings.environment}")
     logger.info(f"LLM Model: {settings.llm_model}")
     logger.info(f"Embedding Model: {settings.embedding_model}")
+    logger.info(f"Retrieval Backend: {retriever.name}")
+    if settings.direct_pg_enabled:
+        await pg.start()
+    await retriever.start()
+    if settings.metrics_enabled:
+        loop_monitor.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down application")
+    await loop_monitor.stop()
+    await embedding_batcher.stop()
+    await db.write_behind.stop()
+    await pg.close()
+    shutdown_executors()
 
 
 # ==================== Health & Info Endpoints ====================
@@ -158,6 +206,17 @@ async def list_agents():
 
 # ==================== Chat Endpoints ====================
 
+def _parse_agent_type(value: Optional[str]) -> Optional[AgentType]:
+    """Requested agent type, or None (auto-routing) when unset or unknown"""
+    if not value:
+        return None
+    try:
+        return AgentType(value)
+    except ValueError:
+        logger.warning(f"Invalid agent type: {value}")
+        return None
+
+
 @app.post("/query", response_model=QueryResponse)
 async def query(request: QueryRequest):
     """
@@ -165,56 +224,68 @@ async def query(request: QueryRequest):
     """
     try:
         logger.info(f"Processing query: {request.query[:100]}...")
+        trace = RequestTrace()
         
-        # Get or create session
-        if request.session_id:
-            session_id = UUID(request.session_id)
-            session = await db.get_session(session_id)
-            if not session:
-                raise HTTPException(status_code=404, detail="Session not found")
-        else:
-            session_id = await db.create_session()
-        
-        # Get chat history
-        history = await db.get_session_messages(session_id)
+        # Get or create session; history for an existing session is loaded
+        # by the coordinator concurrently with routing and retrieval
+        history = None
+        session = None
+        async with trace.stage("session"):
+            if request.session_id:
+                session_id = UUID(request.session_id)
+                session = await db.get_session(session_id)
+                if not session:
+                    raise HTTPException(status_code=404, detail="Session not found")
+            else:
+                session_id = await db.create_session()
+                history = []
         
         # Determine agent type
-        agent_type = None
-        if request.agent_type:
-            try:
-                agent_type = AgentType(request.agent_type)
-            except ValueError:
-                logger.warning(f"Invalid agent type: {request.agent_type}")
+        agent_type = _parse_agent_type(request.agent_type)
         
         # Process query
         response = await coordinator.process_query(
             query=request.query,
             agent_type=agent_type,
-            chat_history=history
-        )
-        
-        # Save messages to database
-        await db.add_message(
+            chat_history=history,
             session_id=session_id,
-            role="user",
-            content=request.query
+            filters=request.filters.to_dict() if request.filters else None,
+            trace=trace,
+            session=session
         )
         
-        await db.add_message(
-            session_id=session_id,
-            role="assistant",
-            content=response["content"],
-            agent_type=response["agent_type"],
-            sources=response["sources"]
-        )
+        # Queue messages; the write-behind queue inserts them in batches
+        async with trace.stage("persist"):
+            await db.queue_message(
+                session_id=session_id,
+                role="user",
+                content=request.query
+            )
+            
+            await db.queue_message(
+                session_id=session_id,
+                role="assistant",
+                content=response["content"],
+                agent_type=response["agent_type"],
+                sources=response["sources"]
+            )
         
-        # Log analytics
-        await db.log_query(
+        # Log analytics; response time covers the whole request
+        response_time_ms = trace.finish()
+        await db.queue_query_log(
             session_id=session_id,
             query=request.query,
             agent_type=response["agent_type"],
-            response_time_ms=response["response_time_ms"],
-            sources_retrieved=len(response["sources"])
+            response_time_ms=response_time_ms,
+            tokens_used=trace.total_tokens,
+            sources_retrieved=len(response["sources"]),
+            tokens_saved=response.get("tokens_saved", 0),
+            trace=trace.to_columns()
+        )
+        observe_query(
+            "query", response["agent_type"], trace,
+            cache_hit=response.get("cache_hit", False),
+            tokens_saved=response.get("tokens_saved", 0)
         )
         
         return QueryResponse(
@@ -222,14 +293,134 @@ async def query(request: QueryRequest):
             agent_type=response["agent_type"],
             sources=response["sources"],
             session_id=str(session_id),
-            response_time_ms=response["response_time_ms"]
+            response_time_ms=response_time_ms,
+            cache_hit=response.get("cache_hit", False),
+            tokens_used=trace.total_tokens,
+            prompt_tokens=trace.prompt_tokens,
+            completion_tokens=trace.completion_tokens,
+            tokens_estimated=trace.tokens_estimated,
+            tokens_saved=response.get("tokens_saved", 0),
+            timings=trace.timings
         )
         
+    except HTTPException as e:
+        # Client errors (unknown session) are not server failures
+        if e.status_code >= 500:
+            observe_error("query", _parse_agent_type(request.agent_type))
+        raise
     except Exception as e:
         logger.error(f"Error processing query: {e}")
+        observe_error("query", _parse_agent_type(request.agent_type))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    Process a user query and stream the answer as Server-Sent Events
+    
+    Emits "session", "meta" (agent and sources), "token" and "done" events;
+    the assembled answer is persisted once the stream finishes.
+    """
+    logger.info(f"Streaming query: {request.query[:100]}...")
+    trace = RequestTrace()
+    
+    # Resolve the session before streaming so errors map to status codes
+    history = None
+    session = None
+    try:
+        async with trace.stage("session"):
+            if request.session_id:
+                session_id = UUID(request.session_id)
+                session = await db.get_session(session_id)
+                if not session:
+                    raise HTTPException(status_code=404, detail="Session not found")
+            else:
+                session_id = await db.create_session()
+                history = []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid session ID format")
+    
+    agent_type = _parse_agent_type(request.agent_type)
+    
+    async def event_stream():
+        yield _sse("session", {"session_id": str(session_id)})
+        
+        try:
+            async for event in coordinator.stream_query(
+                query=request.query,
+                agent_type=agent_type,
+                chat_history=history,
+                session_id=session_id,
+                filters=request.filters.to_dict() if request.filters else None,
+                trace=trace,
+                session=session
+            ):
+                if event["event"] == "done":
+                    response = event["data"]
+                    
+                    # Queue messages; the write-behind queue inserts them in batches
+                    async with trace.stage("persist"):
+                        await db.queue_message(
+                            session_id=session_id,
+                            role="user",
+                            content=request.query
+                        )
+                        
+                        await db.queue_message(
+                            session_id=session_id,
+                            role="assistant",
+                            content=response["content"],
+                            agent_type=response["agent_type"],
+                            sources=response["sources"]
+                        )
+                    
+                    # Log analytics; response time covers the whole request
+                    response_time_ms = trace.finish()
+                    await db.queue_query_log(
+                        session_id=session_id,
+                        query=request.query,
+                        agent_type=response["agent_type"],
+                        response_time_ms=response_time_ms,
+                        tokens_used=trace.total_tokens,
+                        sources_retrieved=len(response["sources"]),
+                        tokens_saved=response["tokens_saved"],
+                        trace=trace.to_columns()
+                    )
+                    observe_query(
+                        "query_stream", response["agent_type"], trace,
+                        cache_hit=response["cache_hit"],
+                        tokens_saved=response["tokens_saved"]
+                    )
+                    
+                    yield _sse("done", {
+                        "session_id": str(session_id),
+                        "agent_type": response["agent_type"],
+                        "response_time_ms": response_time_ms,
+                        "cache_hit": response["cache_hit"],
+                        "tokens_saved": response["tokens_saved"],
+                        **trace.to_dict()
+                    })
+                else:
+                    yield _sse(event["event"], event["data"])
+                    
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            observe_error("query_stream", agent_type)
+            yield _sse("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ==================== Session Management ====================
 
 @app.post("/sessions", response_model=SessionResponse)
@@ -251,25 +442,55 @@ async def create_session(request: SessionCreate):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _encode_cursor(session: Dict[str, Any]) -> str:
+    """Opaque keyset cursor pointing after a session"""
+    raw = json.dumps([session["created_at"], str(session["id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor into (created_at, id)"""
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        datetime.fromisoformat(created_at)
+        return created_at, str(UUID(session_id))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
 @app.get("/sessions")
-async def list_sessions(limit: int = 20):
-    """List recent chat sessions"""
+async def list_sessions(limit: int = 20, cursor: Optional[str] = None):
+    """
+    List chat sessions, newest first
+    
+    Pass the returned next_cursor as cursor to load the next page;
+    it is null on the last page.
+    """
+    limit = max(1, min(limit, 100))
+    before_created_at, before_id = _decode_cursor(cursor) if cursor else (None, None)
+    
     try:
-        sessions = await db.list_sessions(limit=limit)
+        # One extra row tells whether another page exists
+        sessions = await db.list_sessions(
+            limit=limit + 1,
+            before_created_at=before_created_at,
+            before_id=before_id
+        )
+        page = sessions[:limit]
         
-        # Get message counts for each session
-        session_list = []
-        for session in sessions:
-            messages = await db.get_session_messages(UUID(session["id"]))
-            session_list.append({
+        session_list = [
+            {
                 "id": session["id"],
                 "session_name": session["session_name"],
                 "created_at": session["created_at"],
                 "updated_at": session["updated_at"],
-                "message_count": len(messages)
-            })
+                "message_count": session["message_count"]
+            }
+            for session in page
+        ]
+        next_cursor = _encode_cursor(page[-1]) if len(sessions) > limit else None
         
-        return {"sessions": session_list}
+        return {"sessions": session_list, "next_cursor": next_cursor}
         
     except Exception as e:
         logger.error(f"Error listing sessions: {e}")
@@ -313,7 +534,9 @@ async def delete_session(session_id: str):
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Delete from database
-        db.client.table("chat_sessions").delete().eq("id", session_id).execute()
+        await db.execute(
+            db.client.table("chat_sessions").delete().eq("id", session_id)
+        )
         
         return {"message": "Session deleted successfully"}
         
@@ -351,10 +574,11 @@ async def upload_document(doc: DocumentUpload):
 async def list_documents():
     """List all indexed documents"""
     try:
-        result = db.client.table("documents")\
-            .select("id, title, source, created_at")\
-            .order("created_at", desc=True)\
-            .execute()
+        result = await db.execute(
+            db.client.table("documents")
+            .select("id, title, source, created_at")
+            .order("created_at", desc=True)
+        )
         
         return {"documents": result.data}
         
@@ -364,12 +588,28 @@ async def list_documents():
 
 
 @app.post("/documents/search")
-async def search_documents(query: str, top_k: int = 5):
-    """Search for relevant document chunks"""
+async def search_documents(
+    query: str,
+    top_k: int = 5,
+    source: Optional[str] = None,
+    document_id: Optional[UUID] = None,
+    type: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+):
+    """Search for relevant document chunks, optionally filtered by source, document, type or date"""
     try:
+        filters = SearchFilters(
+            source=source,
+            document_id=document_id,
+            type=type,
+            date_from=date_from,
+            date_to=date_to
+        )
         results = await doc_processor.search_documents(
             query=query,
-            top_k=top_k
+            top_k=top_k,
+            filters=filters.to_dict()
         )
         
         return {"results": results}
@@ -379,13 +619,70 @@ async def search_documents(query: str, top_k: int = 5):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/retrieval/reload")
+async def reload_retrieval_index():
+    """Reload the retrieval backend (e.g. after bulk ingestion from the CLI)"""
+    try:
+        await retriever.start()
+        doc_processor.invalidate_cache()
+        return retriever.get_stats()
+        
+    except Exception as e:
+        logger.error(f"Error reloading retrieval index: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ==================== Analytics ====================
 
+ANALYTICS_BUCKET_SECONDS = {"minute": 60, "hour": 3600}
+
+
 @app.get("/analytics")
-async def get_analytics():
-    """Get system analytics"""
+async def get_analytics(
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    agent_type: Optional[str] = None
+):
+    """
+    Get system analytics
+    
+    Query analytics come from the per-minute/per-hour rollups for the
+    requested range (default: last 24 hours), so the cost depends on the
+    number of buckets, not on query volume. Naive timestamps are UTC.
+    """
+    if granularity not in ANALYTICS_BUCKET_SECONDS:
+        raise HTTPException(status_code=400, detail="granularity must be 'minute' or 'hour'")
+    
+    end = end or datetime.now(timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    start = start or end - timedelta(hours=24)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    buckets = (end - start).total_seconds() / ANALYTICS_BUCKET_SECONDS[granularity]
+    if buckets > settings.analytics_max_buckets:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range spans {int(buckets)} {granularity} buckets (max {settings.analytics_max_buckets})"
+        )
+    
     try:
-        analytics = await db.get_analytics_summary()
+        analytics = await db.get_analytics_summary(granularity, start, end, agent_type)
+        analytics["embedding_batcher"] = embedding_batcher.get_stats()
+        analytics["query_cache"] = doc_processor.get_cache_stats()
+        analytics["retrieval"] = retriever.get_stats()
+        if embeddings.store is not None:
+            analytics["embedding_store"] = embeddings.store.get_stats()
+        analytics["semantic_cache"] = semantic_cache.get_stats()
+        analytics["router"] = embedding_router.get_stats()
+        analytics["postgres_pool"] = pg.get_stats()
+        analytics["write_behind"] = db.write_behind.get_stats()
+        analytics["chat_history"] = session_history.get_stats()
+        analytics["context_packing"] = context_packer.get_stats()
         return analytics
         
     except Exception as e:
@@ -393,6 +690,21 @@ async def get_analytics():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: request rate and errors, stage latency histograms
+    per agent type, cache hit rates and event-loop lag
+    
+    Served from in-process counters; scraping never touches the database.
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 # ==================== Error Handlers ====================
 
 @app.exception_handler(HTTPException)
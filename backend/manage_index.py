@@ -0,0 +1,124 @@
+"""
+Vector Index Management Script
+(Re)builds the pgvector ANN index on document_chunks.embedding after bulk
+ingestion, when there is data to train ivfflat centroids or build an HNSW graph
+"""
+import argparse
+import math
+import time
+from pathlib import Path
+from loguru import logger
+import psycopg2
+import sys
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent))
+
+from config import settings
+
+
+INDEX_NAME = "idx_document_chunks_embedding"
+BUILD_NAME = f"{INDEX_NAME}_new"
+
+
+def ivfflat_lists(row_count: int) -> int:
+    """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def ivfflat_probes(lists: int) -> int:
+    """Suggested starting probes for a given number of lists"""
+    return max(1, int(math.sqrt(lists)))
+
+
+def count_rows(cur) -> int:
+    """Count chunks that have an embedding"""
+    cur.execute("SELECT count(*) FROM document_chunks WHERE embedding IS NOT NULL")
+    return cur.fetchone()[0]
+
+
+def show_status(cur):
+    """Log the current index definition and size"""
+    cur.execute(
+        """
+        SELECT indexdef, pg_size_pretty(pg_relation_size(indexname::regclass))
+        FROM pg_indexes
+        WHERE tablename = 'document_chunks' AND indexname = %s
+        """,
+        (INDEX_NAME,)
+    )
+    row = cur.fetchone()
+    logger.info(f"Chunks with embeddings: {count_rows(cur)}")
+    if row:
+        logger.info(f"Index: {row[0]} ({row[1]})")
+    else:
+        logger.info("No vector index; searches use an exact sequential scan")
+
+
+def build_index(cur, args: argparse.Namespace):
+    """Build the new index concurrently, then swap it in for the old one"""
+    rows = count_rows(cur)
+    if rows == 0:
+        logger.warning("No embedded chunks; run ingest_documents.py before building the index")
+        return
+    
+    if args.type == "hnsw":
+        using = (
+            f"hnsw (embedding vector_cosine_ops) "
+            f"WITH (m = {args.m}, ef_construction = {args.ef_construction})"
+        )
+        hint = f"tune HNSW_EF_SEARCH (>= top_k, default {settings.hnsw_ef_search})"
+    else:
+        lists = args.lists or ivfflat_lists(rows)
+        using = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})"
+        hint = f"suggested IVFFLAT_PROBES={ivfflat_probes(lists)}"
+    
+    if args.maintenance_work_mem:
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (args.maintenance_work_mem,))
+    
+    logger.info(f"Building {args.type} index over {rows} chunks: {using}")
+    start = time.perf_counter()
+    
+    # Searches keep using the old index until the new one is ready
+    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {BUILD_NAME}")
+    cur.execute(f"CREATE INDEX CONCURRENTLY {BUILD_NAME} ON document_chunks USING {using}")
+    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+    cur.execute(f"ALTER INDEX {BUILD_NAME} RENAME TO {INDEX_NAME}")
+    cur.execute("ANALYZE document_chunks")
+    
+    logger.info(f"Index built in {time.perf_counter() - start:.1f}s; {hint}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the pgvector index on document chunks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    subparsers.add_parser("status", help="Show the current vector index")
+    
+    build = subparsers.add_parser("build", help="(Re)build the vector index from current data")
+    build.add_argument("--type", choices=["hnsw", "ivfflat"], default="hnsw", help="Index type")
+    build.add_argument("--lists", type=int, default=None,
+                       help="ivfflat lists (default: sized from the row count)")
+    build.add_argument("--m", type=int, default=16, help="HNSW max connections per node")
+    build.add_argument("--ef-construction", type=int, default=64, help="HNSW build candidate list size")
+    build.add_argument("--maintenance-work-mem", default=None,
+                       help="maintenance_work_mem for the build, e.g. 1GB")
+    
+    args = parser.parse_args()
+    
+    conn = psycopg2.connect(settings.database_url)
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            if args.command == "build":
+                build_index(cur, args)
+            show_status(cur)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Prometheus Metrics for KANZ System
+In-process request, stage latency, cache and event-loop metrics for /metrics
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from loguru import logger
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from config import settings
+from tracing import RequestTrace
+
+
+# Latency buckets in seconds: fast in-process stages up to slow LLM calls
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+# Trace stages exported as histograms (others stay in the trace only)
+EXPORTED_STAGES = (
+    "session", "embed", "route", "history", "retrieve", "vector_search",
+    "lexical_search", "cache_lookup", "context_packing", "llm_first_token",
+    "llm", "persist"
+)
+
+registry = CollectorRegistry()
+
+REQUESTS = Counter(
+    "kanz_requests_total",
+    "Query requests by endpoint, agent type and outcome",
+    ["endpoint", "agent_type", "status"],
+    registry=registry
+)
+REQUEST_LATENCY = Histogram(
+    "kanz_request_latency_seconds",
+    "End-to-end query latency",
+    ["endpoint", "agent_type", "cache_hit"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry
+)
+STAGE_LATENCY = Histogram(
+    "kanz_stage_latency_seconds",
+    "Latency of a query pipeline stage",
+    ["stage", "agent_type"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry
+)
+LLM_TOKENS = Counter(
+    "kanz_llm_tokens_total",
+    "LLM tokens by agent type and kind (prompt, completion, saved)",
+    ["agent_type", "kind"],
+    registry=registry
+)
+EVENT_LOOP_LAG = Histogram(
+    "kanz_event_loop_lag_seconds",
+    "Delay of a scheduled event-loop wakeup beyond its interval",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    registry=registry
+)
+EVENT_LOOP_LAG_LAST = Gauge(
+    "kanz_event_loop_lag_last_seconds",
+    "Most recent event-loop lag sample",
+    registry=registry
+)
+
+
+def _label(agent_type: Any) -> str:
+    """
+    Agent type as a label value (enum members and plain strings)
+    
+    Anything that is not a known agent type is reported as "unknown", so
+    request input cannot create new time series.
+    """
+    # Imported lazily like the caches below; agents loads models on import
+    from agents import AgentType
+    
+    label = getattr(agent_type, "value", agent_type)
+    return label if label in AgentType._value2member_map_ else "unknown"
+
+
+def observe_query(
+    endpoint: str,
+    agent_type: Any,
+    trace: RequestTrace,
+    cache_hit: bool = False,
+    tokens_saved: int = 0
+):
+    """Record a completed query from its trace"""
+    label = _label(agent_type)
+    REQUESTS.labels(endpoint, label, "ok").inc()
+    REQUEST_LATENCY.labels(endpoint, label, str(cache_hit).lower()).observe(
+        trace.timings.get("total", trace.elapsed_ms()) / 1000
+    )
+    
+    for stage in EXPORTED_STAGES:
+        if stage in trace.timings:
+            STAGE_LATENCY.labels(stage, label).observe(trace.timings[stage] / 1000)
+    
+    LLM_TOKENS.labels(label, "prompt").inc(trace.prompt_tokens)
+    LLM_TOKENS.labels(label, "completion").inc(trace.completion_tokens)
+    LLM_TOKENS.labels(label, "saved").inc(tokens_saved)
+
+
+def observe_error(endpoint: str, agent_type: Any = None):
+    """Record a failed query"""
+    REQUESTS.labels(endpoint, _label(agent_type), "error").inc()
+
+
+class CacheCollector:
+    """
+    Read cache counters at scrape time
+    
+    The caches already count hits and lookups; exporting them on collect
+    keeps the request path free of extra bookkeeping.
+    """
+    
+    def collect(self):
+        # Imported lazily: these modules load models and clients on import
+        from document_processor import doc_processor
+        from semantic_cache import semantic_cache
+        
+        hits = CounterMetricFamily("kanz_cache_hits", "Cache hits", labels=["cache"])
+        lookups = CounterMetricFamily("kanz_cache_lookups", "Cache lookups", labels=["cache"])
+        hit_rate = GaugeMetricFamily("kanz_cache_hit_ratio", "Cache hit ratio since start", labels=["cache"])
+        
+        stats = doc_processor.get_cache_stats()
+        caches: Dict[str, Dict[str, Any]] = {
+            "query_embedding": {
+                "hits": stats["embeddings"]["hits"],
+                "lookups": stats["embeddings"]["hits"] + stats["embeddings"]["misses"]
+            },
+            "search_results": {
+                "hits": stats["results"]["hits"],
+                "lookups": stats["results"]["hits"] + stats["results"]["misses"]
+            }
+        }
+        semantic = semantic_cache.get_stats()
+        caches["semantic"] = {"hits": semantic["hits"], "lookups": semantic["lookups"]}
+        
+        for name, counts in caches.items():
+            hits.add_metric([name], counts["hits"])
+            lookups.add_metric([name], counts["lookups"])
+            hit_rate.add_metric([name], counts["hits"] / counts["lookups"] if counts["lookups"] else 0.0)
+        
+        yield hits
+        yield lookups
+        yield hit_rate
+
+
+class EventLoopMonitor:
+    """Sample event-loop lag: how late a periodic sleep wakes up"""
+    
+    def __init__(self, interval_ms: float = 500.0):
+        self.interval = interval_ms / 1000.0
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start sampling on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Event-loop lag monitor started ({self.interval * 1000:.0f}ms interval)")
+    
+    async def _run(self):
+        """Sleep for the interval and record how late the wakeup was"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            EVENT_LOOP_LAG.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
+    
+    async def stop(self):
+        """Stop sampling"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def render_metrics() -> tuple:
+    """Current metrics in the Prometheus text format, with its content type"""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+registry.register(CacheCollector())
+
+# Global event-loop monitor instance
+loop_monitor = EventLoopMonitor(interval_ms=settings.event_loop_lag_interval_ms)
@@ -0,0 +1,414 @@
+"""
+Direct Postgres Client for KANZ System
+Pooled psycopg 3 access with binary pgvector transport for the hot paths
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID, uuid4
+from loguru import logger
+import numpy as np
+from pgvector.psycopg import register_vector_async
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from config import settings
+
+
+class PostgresClient:
+    """
+    Connection pool on settings.database_url with pgvector codecs registered
+    
+    Embeddings move as packed float32 buffers in both directions: query
+    vectors are bound as binary parameters, chunk embeddings are written with
+    binary COPY and read back through a binary cursor as NumPy arrays.
+    Per-request queries (sessions, messages, chunk search) run as prepared
+    statements on pooled connections instead of one REST call each.
+    """
+    
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 10.0,
+        prepare: bool = True
+    ):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.prepare = prepare
+        self.pool: Optional[AsyncConnectionPool] = None
+        self._lock = asyncio.Lock()
+        
+        # Connection acquisition metrics
+        self.acquisitions = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+    
+    @staticmethod
+    async def _configure(conn):
+        """Register the vector type on every new connection"""
+        await register_vector_async(conn)
+    
+    async def start(self):
+        """Open the pool (idempotent)"""
+        async with self._lock:
+            if self.pool is not None:
+                return
+            
+            pool = AsyncConnectionPool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                timeout=self.timeout,
+                configure=self._configure,
+                # Hot queries are prepared on first use (prepare=True); others after
+                # psycopg's default 5 executions. Server-side prepared statements
+                # break behind transaction-mode poolers, so they can be disabled.
+                kwargs={"row_factory": dict_row, "prepare_threshold": 5 if self.prepare else None},
+                open=False
+            )
+            await pool.open()
+            self.pool = pool
+            logger.info(f"Postgres pool opened (max {self.max_size} connections)")
+    
+    async def close(self):
+        """Close the pool"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+    
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a pooled connection, opening the pool on first use"""
+        if self.pool is None:
+            await self.start()
+        
+        start_time = time.perf_counter()
+        try:
+            async with self.pool.connection() as conn:
+                self._record_wait((time.perf_counter() - start_time) * 1000)
+                yield conn
+        except PoolTimeout:
+            self.timeouts += 1
+            raise
+    
+    def _record_wait(self, wait_ms: float):
+        """Track how long callers wait for a free connection"""
+        self.acquisitions += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        if wait_ms >= 1.0:
+            self.waits += 1
+    
+    @staticmethod
+    def _jsonable(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Match PostgREST output: UUIDs and timestamps as strings"""
+        return {
+            key: (
+                str(value) if isinstance(value, UUID)
+                else value.isoformat() if isinstance(value, datetime)
+                else value
+            )
+            for key, value in row.items()
+        }
+    
+    async def fetch_one(self, query: str, params: tuple = (), prepare: bool = None) -> Optional[Dict]:
+        """Run a query and return its first row"""
+        async with self.connection() as conn:
+            cur = await conn.execute(query, params, prepare=prepare)
+            row = await cur.fetchone()
+            return self._jsonable(row) if row else None
+    
+    async def fetch_all(self, query: str, params: tuple = (), prepare: bool = None) -> List[Dict]:
+        """Run a query and return all rows"""
+        async with self.connection() as conn:
+            cur = await conn.execute(query, params, prepare=prepare)
+            return [self._jsonable(row) for row in await cur.fetchall()]
+    
+    async def insert_rows(self, table: str, rows: List[Dict[str, Any]]):
+        """Insert rows sharing the same columns in one pipelined batch"""
+        columns = list(rows[0].keys())
+        query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.SQL(", ").join(sql.Placeholder() * len(columns))
+        )
+        params = [
+            tuple(
+                Jsonb(row[column]) if isinstance(row[column], (dict, list)) else row[column]
+                for column in columns
+            )
+            for row in rows
+        ]
+        
+        async with self.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(query, params)
+    
+    # ==================== Hot Queries (prepared) ====================
+    
+    async def get_session(self, session_id: UUID) -> Optional[Dict]:
+        """Get session by ID"""
+        return await self.fetch_one(
+            "SELECT * FROM chat_sessions WHERE id = %s",
+            (UUID(str(session_id)),),
+            prepare=self.prepare
+        )
+    
+    async def list_sessions(
+        self,
+        limit: int = 20,
+        before_created_at: Optional[str] = None,
+        before_id: Optional[str] = None
+    ) -> List[Dict]:
+        """List sessions newest first from a keyset cursor"""
+        return await self.fetch_all(
+            "SELECT * FROM list_chat_sessions(%s, %s::timestamptz, %s::uuid)",
+            (limit, before_created_at, before_id),
+            prepare=self.prepare
+        )
+    
+    async def get_query_analytics(
+        self,
+        granularity: str,
+        start: str,
+        end: str,
+        agent_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Read the analytics report from the rollups"""
+        row = await self.fetch_one(
+            "SELECT get_query_analytics(%s, %s::timestamptz, %s::timestamptz, %s) AS analytics",
+            (granularity, start, end, agent_type),
+            prepare=self.prepare
+        )
+        return row["analytics"] if row else {}
+    
+    async def get_session_messages(self, session_id: UUID, limit: int = 50) -> List[Dict]:
+        """Get messages for a session, oldest first"""
+        return await self.fetch_all(
+            "SELECT * FROM chat_messages WHERE session_id = %s ORDER BY created_at ASC LIMIT %s",
+            (UUID(str(session_id)), limit),
+            prepare=self.prepare
+        )
+    
+    async def get_recent_messages(self, session_id: UUID, limit: int = 10) -> List[Dict]:
+        """Get the last messages of a session, oldest first"""
+        rows = await self.fetch_all(
+            """
+            SELECT id, role, content, created_at FROM chat_messages
+            WHERE session_id = %s ORDER BY created_at DESC LIMIT %s
+            """,
+            (UUID(str(session_id)), limit),
+            prepare=self.prepare
+        )
+        return rows[::-1]
+    
+    async def get_messages_between(
+        self,
+        session_id: UUID,
+        after: Optional[str],
+        before: str,
+        limit: int = 20
+    ) -> List[Dict]:
+        """Get the first messages of a session between two timestamps, oldest first"""
+        if after is None:
+            return await self.fetch_all(
+                """
+                SELECT id, role, content, created_at FROM chat_messages
+                WHERE session_id = %s AND created_at < %s
+                ORDER BY created_at LIMIT %s
+                """,
+                (UUID(str(session_id)), before, limit),
+                prepare=self.prepare
+            )
+        return await self.fetch_all(
+            """
+            SELECT id, role, content, created_at FROM chat_messages
+            WHERE session_id = %s AND created_at > %s AND created_at < %s
+            ORDER BY created_at LIMIT %s
+            """,
+            (UUID(str(session_id)), after, before, limit),
+            prepare=self.prepare
+        )
+    
+    async def add_message(
+        self,
+        session_id: UUID,
+        role: str,
+        content: str,
+        agent_type: Optional[str] = None,
+        sources: List[Dict] = None
+    ) -> UUID:
+        """Insert a chat message and return its ID"""
+        row = await self.fetch_one(
+            """
+            INSERT INTO chat_messages (session_id, role, content, agent_type, sources)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id
+            """,
+            (UUID(str(session_id)), role, content, agent_type, Jsonb(sources or [])),
+            prepare=self.prepare
+        )
+        return UUID(row["id"])
+    
+    @staticmethod
+    def _vector(values: Any) -> np.ndarray:
+        """Embeddings are sent as float32 regardless of their Python form"""
+        return np.asarray(values, dtype=np.float32)
+    
+    async def copy_chunks(
+        self,
+        document_id: UUID,
+        chunks: List[Dict[str, Any]]
+    ) -> List[UUID]:
+        """
+        Bulk insert chunks with binary COPY
+        
+        Args:
+            document_id: Parent document ID
+            chunks: Chunk rows (content, index, embedding, metadata, content_hash)
+        
+        Returns:
+            IDs of the inserted chunks, in input order
+        """
+        chunk_ids = [uuid4() for _ in chunks]
+        document_id = UUID(str(document_id))
+        
+        async with self.connection() as conn:
+            async with conn.cursor() as cur:
+                async with cur.copy(
+                    "COPY document_chunks "
+                    "(id, document_id, content, chunk_index, embedding, metadata, content_hash) "
+                    "FROM STDIN WITH (FORMAT BINARY)"
+                ) as copy:
+                    copy.set_types(["uuid", "uuid", "text", "int4", "vector", "jsonb", "text"])
+                    for chunk_id, chunk in zip(chunk_ids, chunks):
+                        await copy.write_row((
+                            chunk_id,
+                            document_id,
+                            chunk["content"],
+                            chunk["index"],
+                            self._vector(chunk["embedding"]),
+                            Jsonb(chunk.get("metadata", {})),
+                            chunk.get("content_hash")
+                        ))
+        
+        return chunk_ids
+    
+    async def fetch_chunks(self, document_id: Optional[UUID] = None) -> List[Dict]:
+        """Read chunks with their embeddings as float32 arrays (optionally for one document)"""
+        query = (
+            "SELECT id::text AS id, document_id::text AS document_id, "
+            "content, chunk_index, metadata, embedding FROM document_chunks"
+        )
+        params = ()
+        if document_id is not None:
+            query += " WHERE document_id = %s"
+            params = (UUID(str(document_id)),)
+        
+        async with self.connection() as conn:
+            async with conn.cursor(binary=True) as cur:
+                await cur.execute(query + " ORDER BY id", params)
+                return await cur.fetchall()
+    
+    async def search_similar_chunks(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        threshold: float = 0.7,
+        probes: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        document_id: Optional[UUID] = None,
+        source: Optional[str] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Call match_document_chunks with the query vector bound in binary
+        
+        With with_embeddings, chunk embeddings come back as float32 arrays
+        (binary results).
+        """
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                """
+                SELECT id::text AS id, document_id::text AS document_id,
+                    content, similarity, metadata, embedding
+                FROM match_document_chunks(
+                    query_embedding => %b,
+                    match_threshold => %s,
+                    match_count => %s,
+                    probes => %s,
+                    ef_search => %s,
+                    filter_document_id => %s,
+                    filter_source => %s,
+                    filter_metadata => %s,
+                    filter_date_from => %s,
+                    filter_date_to => %s,
+                    with_embeddings => %s
+                )
+                """,
+                (
+                    self._vector(query_embedding),
+                    threshold,
+                    top_k,
+                    probes,
+                    ef_search,
+                    UUID(str(document_id)) if document_id else None,
+                    source,
+                    Jsonb(metadata_filter) if metadata_filter else None,
+                    date_from,
+                    date_to,
+                    with_embeddings
+                ),
+                prepare=self.prepare,
+                binary=True
+            )
+            return await cur.fetchall()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool saturation and connection wait metrics"""
+        stats = {
+            "enabled": self.pool is not None,
+            "pool_max": self.max_size,
+            "acquisitions": self.acquisitions,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait_ms / self.acquisitions, 3) if self.acquisitions else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 3),
+            "prepared_statements": self.prepare
+        }
+        if self.pool is None:
+            return stats
+        
+        pool_stats = self.pool.get_stats()
+        size = pool_stats.get("pool_size", 0)
+        in_use = size - pool_stats.get("pool_available", 0)
+        stats.update({
+            "pool_size": size,
+            "in_use": in_use,
+            "requests_waiting": pool_stats.get("requests_waiting", 0),
+            "utilization": in_use / self.max_size if self.max_size else 0.0
+        })
+        return stats
+
+
+# Global Postgres client instance (pool opens on first use)
+pg = PostgresClient(
+    settings.database_url,
+    min_size=settings.pg_pool_min_size,
+    max_size=settings.pg_pool_max_size,
+    timeout=settings.pg_pool_timeout_seconds,
+    prepare=settings.pg_prepared_statements
+)
@@ -0,0 +1,133 @@
+"""
+Prompt Token Budget for KANZ System
+Fits chat history and retrieved context into a fixed prompt size
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from loguru import logger
+import tiktoken
+
+from config import settings
+
+
+# Groq models use their own tokenizers; cl100k_base is a close approximation
+ENCODING_NAME = "cl100k_base"
+
+# Per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tokenizer once; None if it is unavailable (e.g. offline)"""
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in a text"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most max_tokens tokens"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max(max_tokens - 1, 0) * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+class PromptBudget:
+    """
+    Select history and context that fit a prompt token budget
+    
+    The system prompt and query are always included. Recent history is
+    packed newest first within the history budget (a running summary of
+    older turns counts against it too), then retrieved chunks are added in
+    rank order until the overall budget is used up.
+    """
+    
+    def __init__(self, total_tokens: int = 6000, history_tokens: int = 1500):
+        self.total_tokens = total_tokens
+        self.history_tokens = history_tokens
+    
+    def pack(
+        self,
+        system_prompt: str,
+        query: str,
+        context: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict]] = None,
+        history_summary: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Fit history and context into the budget
+        
+        Args:
+            system_prompt: Agent system prompt
+            query: User query
+            context: Retrieved chunks, best first
+            chat_history: Recent messages, oldest first
+            history_summary: Running summary of earlier turns
+        
+        Returns:
+            Dict with the context, chat_history and history_summary to send,
+            the messages that did not fit (dropped, oldest first) and the
+            estimated prompt_tokens
+        """
+        used = (
+            count_tokens(system_prompt) + count_tokens(query)
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+        )
+        history_budget = min(self.history_tokens, max(self.total_tokens - used, 0))
+        
+        history_used = 0
+        if history_summary:
+            summary_tokens = count_tokens(history_summary) + MESSAGE_OVERHEAD_TOKENS
+            if summary_tokens <= history_budget:
+                history_used = summary_tokens
+            else:
+                history_summary = None
+        
+        # Newest turns first; stop at the first one that does not fit so the
+        # kept history stays contiguous
+        chat_history = chat_history or []
+        kept_from = len(chat_history)
+        for idx in range(len(chat_history) - 1, -1, -1):
+            tokens = count_tokens(chat_history[idx]["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if history_used + tokens > history_budget:
+                break
+            history_used += tokens
+            kept_from = idx
+        used += history_used
+        
+        packed_context = []
+        for chunk in context:
+            tokens = count_tokens(chunk["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > self.total_tokens:
+                continue
+            used += tokens
+            packed_context.append(chunk)
+        
+        return {
+            "context": packed_context,
+            "chat_history": chat_history[kept_from:],
+            "history_summary": history_summary,
+            "dropped": chat_history[:kept_from],
+            "prompt_tokens": used
+        }
+
+
+# Global prompt budget instance
+prompt_budget = PromptBudget(
+    total_tokens=settings.prompt_token_budget,
+    history_tokens=settings.history_token_budget
+)
@@ -0,0 +1,423 @@
+"""
+Retrieval Backends for KANZ System
+Pluggable vector search: pgvector RPC or an in-process NumPy index
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from loguru import logger
+import numpy as np
+
+from config import settings
+from database import db
+from lexical import BM25Index
+
+
+def _parse_embedding(value: Any) -> np.ndarray:
+    """PostgREST returns vectors as '[x,y,...]' strings"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+class RetrievalBackend:
+    """Base class for vector retrieval backends"""
+    
+    name = "base"
+    
+    async def start(self):
+        """Prepare the backend (load indexes, warm connections)"""
+    
+    async def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        threshold: float = 0.7,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Search for the chunks most similar to a query embedding
+        
+        Args:
+            query_embedding: Query embedding
+            top_k: Number of results to return
+            threshold: Minimum cosine similarity
+            filters: Only consider chunks matching these filters (see matches_filters)
+            with_embeddings: Also return each chunk's embedding (float32 array)
+        
+        Returns:
+            Chunks with id, document_id, content, similarity and metadata
+            (and embedding)
+        """
+        raise NotImplementedError
+    
+    async def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Full-text search for chunks containing the query terms
+        
+        Args:
+            query: Query text
+            top_k: Number of results to return
+            filters: Only consider chunks matching these filters (see matches_filters)
+            with_embeddings: Also return each chunk's embedding (float32 array)
+            
+        Returns:
+            Chunks with id, document_id, content, lexical_score and metadata
+            (and embedding)
+        """
+        raise NotImplementedError
+    
+    async def refresh_document(self, document_id: UUID):
+        """Re-sync a document's chunks after they were inserted, moved or deleted"""
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get backend statistics"""
+        return {"backend": self.name}
+
+
+class PgvectorBackend(RetrievalBackend):
+    """Search through the match_document_chunks RPC"""
+    
+    name = "pgvector"
+    
+    def __init__(self, probes: int = None, ef_search: int = None):
+        self.probes = probes
+        self.ef_search = ef_search
+    
+    async def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        threshold: float = 0.7,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        rows = await db.search_similar_chunks(
+            query_embedding=query_embedding,
+            top_k=top_k,
+            threshold=threshold,
+            probes=self.probes,
+            # HNSW returns at most ef_search candidates
+            ef_search=max(self.ef_search, top_k) if self.ef_search else None,
+            with_embeddings=with_embeddings,
+            **self._filter_args(filters)
+        )
+        return self._embeddings(rows, with_embeddings)
+    
+    async def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        rows = await db.search_chunks_fulltext(
+            query=query, top_k=top_k, with_embeddings=with_embeddings, **self._filter_args(filters)
+        )
+        return self._embeddings(rows, with_embeddings)
+    
+    @staticmethod
+    def _embeddings(rows: List[Dict[str, Any]], with_embeddings: bool) -> List[Dict[str, Any]]:
+        """Parse returned chunk embeddings, or drop the (empty) column"""
+        for row in rows:
+            embedding = row.pop("embedding", None)
+            if with_embeddings and embedding is not None:
+                row["embedding"] = _parse_embedding(embedding)
+        return rows
+    
+    @staticmethod
+    def _filter_args(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Map retrieval filters to search RPC arguments"""
+        filters = filters or {}
+        return {
+            "document_id": filters.get("document_id"),
+            "source": filters.get("source"),
+            "metadata_filter": {"type": filters["type"]} if filters.get("type") else None,
+            "date_from": filters.get("date_from"),
+            "date_to": filters.get("date_to")
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "probes": self.probes, "ef_search": self.ef_search}
+
+
+def matches_filters(row: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """
+    Check a chunk row against retrieval filters
+    
+    Supported keys: document_id, source, type (exact match) and
+    date_from / date_to (inclusive, compared as ISO date prefixes like "2025-08").
+    Chunks without a date never match a date filter.
+    """
+    metadata = row.get("metadata") or {}
+    if filters.get("document_id") and str(row["document_id"]) != str(filters["document_id"]):
+        return False
+    for key in ("source", "type"):
+        if filters.get(key) and metadata.get(key) != filters[key]:
+            return False
+    
+    date = metadata.get("date")
+    if filters.get("date_from") and (date is None or date < filters["date_from"]):
+        return False
+    # Compare at date_to's precision so "2025-08-15" falls within date_to "2025-08"
+    date_to = filters.get("date_to")
+    if date_to and (date is None or date[:len(date_to)] > date_to):
+        return False
+    return True
+
+
+# Number of set bits for every byte value, for Hamming distances on packed codes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class LocalIndexBackend(RetrievalBackend):
+    """
+    In-process search over normalized embeddings
+    
+    With quantization "none" this is an exact float32 dot-product search.
+    With "int8" (per-dimension scalar codes) or "binary" (packed sign bits)
+    the first pass scans the compact codes, the full-precision vectors move
+    to a memory-mapped file, and only the top candidates are re-ranked
+    against them.
+    """
+    
+    name = "local"
+    
+    def __init__(
+        self,
+        quantization: str = "none",
+        rerank_factor: int = 10,
+        storage_dir: str = None
+    ):
+        if quantization not in ("none", "int8", "binary"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.storage_dir = Path(storage_dir or settings.embedding_cache_dir) / "local_index"
+        
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.rows: List[Dict[str, Any]] = []
+        self.bm25 = BM25Index()
+        self.loaded = False
+        self.load_time_ms = 0.0
+    
+    def _quantize(self, vectors: np.ndarray) -> tuple:
+        """Encode normalized vectors as int8 or packed sign-bit codes"""
+        if self.quantization == "int8":
+            scales = np.abs(vectors).max(axis=0)
+            scales[scales == 0] = 1.0
+            codes = np.round(vectors / scales * 127).astype(np.int8)
+            return codes, scales.astype(np.float32)
+        
+        return np.packbits(vectors > 0, axis=1), None
+    
+    def _offload(self, vectors: np.ndarray) -> np.ndarray:
+        """Move full-precision vectors to a memory-mapped file"""
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        path = self.storage_dir / f"vectors_{self.quantization}.f32"
+        tmp_path = path.with_suffix(".tmp")
+        
+        vectors.tofile(tmp_path)
+        # Replacing the file leaves in-flight searches on the old mapping
+        os.replace(tmp_path, path)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=vectors.shape)
+    
+    def build(self, rows: List[Dict[str, Any]], vectors: List[np.ndarray]):
+        """
+        Swap in a new index over the given rows
+        
+        Args:
+            rows: Chunk rows (id, document_id, content, metadata)
+            vectors: Matching embeddings
+        """
+        bm25 = BM25Index()
+        bm25.build([row["content"] for row in rows])
+        
+        if not vectors:
+            self.vectors, self.codes, self.scales, self.rows, self.bm25 = (
+                np.empty((0, 0), dtype=np.float32), None, None, rows, bm25
+            )
+            return
+        
+        matrix = np.stack(vectors).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        
+        codes, scales = None, None
+        if self.quantization != "none":
+            codes, scales = self._quantize(matrix)
+            matrix = self._offload(matrix)
+        
+        # Replace all references at once so searches never see a mismatch
+        self.vectors, self.codes, self.scales, self.rows, self.bm25 = (
+            matrix, codes, scales, rows, bm25
+        )
+    
+    def _split_rows(self, records: List[Dict]) -> tuple:
+        """Separate chunk records into row metadata and embedding vectors"""
+        rows, vectors = [], []
+        for record in records:
+            if record.get("embedding") is None:
+                continue
+            vectors.append(_parse_embedding(record["embedding"]))
+            rows.append({
+                "id": record["id"],
+                "document_id": record["document_id"],
+                "content": record["content"],
+                "metadata": record.get("metadata") or {}
+            })
+        return rows, vectors
+    
+    async def start(self):
+        """Load every chunk embedding from document_chunks"""
+        start_time = time.perf_counter()
+        records = await db.fetch_all_chunks()
+        rows, vectors = self._split_rows(records)
+        self.build(rows, vectors)
+        
+        self.loaded = True
+        self.load_time_ms = (time.perf_counter() - start_time) * 1000
+        logger.info(
+            f"Local vector index loaded: {len(rows)} chunks in {self.load_time_ms:.0f}ms "
+            f"(quantization={self.quantization})"
+        )
+    
+    async def refresh_document(self, document_id: UUID):
+        """Replace a document's rows with its current chunks"""
+        if not self.loaded:
+            return
+        
+        records = await db.fetch_all_chunks(document_id=document_id)
+        new_rows, new_vectors = self._split_rows(records)
+        
+        keep = [i for i, row in enumerate(self.rows) if row["document_id"] != str(document_id)]
+        rows = [self.rows[i] for i in keep] + new_rows
+        vectors = [np.array(self.vectors[i]) for i in keep] + new_vectors
+        self.build(rows, vectors)
+        logger.info(f"Local vector index refreshed document {document_id}: {len(self.rows)} chunks")
+    
+    def _approximate_scores(self, codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """First-pass scores from the quantized codes (higher is closer)"""
+        if self.quantization == "int8":
+            # codes * scales / 127 approximates the vectors; fold the scaling into the query
+            return codes.astype(np.float32) @ (query * scales / 127)
+        
+        query_bits = np.packbits(query > 0)
+        hamming = POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1, dtype=np.int32)
+        return -hamming
+    
+    async def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        threshold: float = 0.7,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        vectors, codes, scales, rows = self.vectors, self.codes, self.scales, self.rows
+        
+        # Filtered searches only score the matching rows
+        pool = None
+        if filters:
+            pool = np.flatnonzero([matches_filters(row, filters) for row in rows])
+        n_rows = len(rows) if pool is None else len(pool)
+        if not n_rows:
+            return []
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        k = min(top_k, n_rows)
+        
+        if codes is None:
+            if pool is None:
+                candidates = np.arange(n_rows)
+                scores = vectors @ query
+            else:
+                candidates = pool
+                scores = vectors[candidates] @ query
+        else:
+            # Shortlist with the codes, then re-rank with full precision
+            pool_codes = codes if pool is None else codes[pool]
+            approximate = self._approximate_scores(pool_codes, scales, query)
+            n_candidates = min(n_rows, k * self.rerank_factor)
+            candidates = np.argpartition(-approximate, n_candidates - 1)[:n_candidates]
+            if pool is not None:
+                candidates = pool[candidates]
+            candidates.sort()
+            scores = vectors[candidates] @ query
+        
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        
+        results = []
+        for i in top:
+            if scores[i] <= threshold:
+                continue
+            result = {**rows[candidates[i]], "similarity": float(scores[i])}
+            if with_embeddings:
+                result["embedding"] = np.array(vectors[candidates[i]])
+            results.append(result)
+        return results
+    
+    async def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        rows, bm25, vectors = self.rows, self.bm25, self.vectors
+        allowed = None
+        if filters:
+            allowed = {i for i, row in enumerate(rows) if matches_filters(row, filters)}
+        results = []
+        for idx, score in bm25.search(query, top_k, allowed=allowed):
+            result = {**rows[idx], "lexical_score": score}
+            if with_embeddings:
+                result["embedding"] = np.array(vectors[idx])
+            results.append(result)
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        in_memory = self.codes if self.codes is not None else self.vectors
+        return {
+            "backend": self.name,
+            "quantization": self.quantization,
+            "chunks": len(self.rows),
+            "dimension": int(self.vectors.shape[1]) if self.rows else 0,
+            "memory_bytes": int(in_memory.nbytes) if self.rows else 0,
+            "full_precision_bytes": int(self.vectors.nbytes) if self.rows else 0,
+            "load_time_ms": round(self.load_time_ms, 1)
+        }
+
+
+def create_backend(name: str) -> RetrievalBackend:
+    """Create a retrieval backend by setting name"""
+    if name == PgvectorBackend.name:
+        return PgvectorBackend(
+            probes=settings.ivfflat_probes,
+            ef_search=settings.hnsw_ef_search
+        )
+    if name == LocalIndexBackend.name:
+        return LocalIndexBackend(
+            quantization=settings.index_quantization,
+            rerank_factor=settings.rerank_factor
+        )
+    raise ValueError(f"Unknown retrieval backend: {name} (expected pgvector or local)")
+
+
+# Global retrieval backend instance
+retriever = create_backend(settings.retrieval_backend)
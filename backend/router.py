@@ -0,0 +1,135 @@
+"""
+Local Query Router for KANZ System
+Classifies queries by their embedding against per-agent centroid vectors
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+import numpy as np
+
+from config import settings
+from embeddings import embeddings
+
+
+# Example queries describing each specialist's domain; their normalized
+# embeddings are averaged into one centroid per agent
+ROUTING_PROTOTYPES: Dict[str, List[str]] = {
+    "STRATEGIC": [
+        "What is the best market entry strategy for Saudi Arabia?",
+        "Compare NEOM vs King Abdullah Economic City for tech infrastructure",
+        "How does this investment align with Vision 2030?",
+        "What are the strategic pillars of the expansion plan?",
+        "Who are our main competitors in the Saudi market?",
+        "Which economic zone offers the best competitive positioning?",
+        "What is the recommended phased rollout and implementation roadmap?",
+        "How should we position ourselves against regional players in the UAE?",
+    ],
+    "FINANCIAL": [
+        "What are the tax incentives for investing in NEOM?",
+        "Calculate the expected IRR and payback period for the data center",
+        "What is the NPV of a $200M investment?",
+        "How much CAPEX and OPEX should we budget?",
+        "What rebates and subsidies are available for foreign investors?",
+        "Project the cash flow over the first five years",
+        "What is the corporate income tax rate in special economic zones?",
+        "What return on investment can we expect?",
+    ],
+    "RISK": [
+        "What are the main regulatory risks and how do we mitigate them?",
+        "What data sovereignty and localization rules apply?",
+        "How exposed are we to geopolitical risk in the region?",
+        "What compliance requirements must we meet to get a license?",
+        "What operational and execution risks does the project face?",
+        "Which risks remain after mitigation?",
+        "What happens if the regulations change after we invest?",
+        "What are the Saudization and local content obligations?",
+    ],
+    "GENERAL": [
+        "Give me an overview of Saudi Arabia investment opportunities",
+        "What is KANZ?",
+        "Summarize the report",
+        "What documents do you have?",
+        "Tell me about the Saudi economy",
+        "Hello, what can you help me with?",
+        "What is NEOM?",
+        "Explain the key findings in simple terms",
+    ],
+}
+
+
+class EmbeddingRouter:
+    """Route queries with a nearest-centroid classifier over MiniLM embeddings"""
+    
+    def __init__(
+        self,
+        prototypes: Dict[str, List[str]] = None,
+        min_margin: float = 0.05
+    ):
+        self.prototypes = prototypes or ROUTING_PROTOTYPES
+        self.min_margin = min_margin
+        self.labels: List[str] = list(self.prototypes.keys())
+        self.centroids: Optional[np.ndarray] = None
+        self._lock = asyncio.Lock()
+        
+        self.local_decisions = 0
+        self.fallbacks = 0
+    
+    async def _ensure_centroids(self):
+        """Embed the prototype queries once and build per-label centroids"""
+        if self.centroids is not None:
+            return
+        
+        async with self._lock:
+            if self.centroids is not None:
+                return
+            
+            texts = [text for label in self.labels for text in self.prototypes[label]]
+            vectors = await embeddings.aembed_queries(texts)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            
+            centroids = []
+            offset = 0
+            for label in self.labels:
+                count = len(self.prototypes[label])
+                centroid = vectors[offset:offset + count].mean(axis=0)
+                centroids.append(centroid / np.linalg.norm(centroid))
+                offset += count
+            
+            self.centroids = np.stack(centroids)
+            logger.info(f"Embedding router initialized with {len(self.labels)} centroids")
+    
+    async def classify(self, query_embedding: List[float]) -> Tuple[str, float]:
+        """
+        Classify a query embedding against the routing centroids
+        
+        Args:
+            query_embedding: Embedding of the user query
+            
+        Returns:
+            Tuple of (label, confidence margin between the top two labels)
+        """
+        await self._ensure_centroids()
+        
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        
+        similarities = self.centroids @ vector
+        ranked = np.argsort(similarities)[::-1]
+        margin = float(similarities[ranked[0]] - similarities[ranked[1]])
+        
+        return self.labels[int(ranked[0])], margin
+    
+    def is_confident(self, margin: float) -> bool:
+        """Whether a classification margin is high enough to skip the LLM"""
+        return margin >= self.min_margin
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get routing decision counts"""
+        return {
+            "local_decisions": self.local_decisions,
+            "llm_fallbacks": self.fallbacks
+        }
+
+
+# Global embedding router instance
+embedding_router = EmbeddingRouter(min_margin=settings.router_min_margin)
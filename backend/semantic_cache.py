@@ -0,0 +1,217 @@
+"""
+Semantic Response Cache for KANZ System
+Reuses answers for paraphrased queries that retrieve the same sources
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from config import settings
+from database import db
+
+
+class SemanticCache:
+    """In-process answer cache keyed by query embedding, agent and chunk IDs"""
+    
+    def __init__(
+        self,
+        max_size: int = 512,
+        ttl_seconds: float = 3600.0,
+        max_distance: float = 0.08,
+        persist: bool = False
+    ):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.max_distance = max_distance
+        self.persist = persist
+        
+        # (agent key, chunk IDs) -> OrderedDict[entry id -> (vector, response, expires_at)]
+        self._buckets: Dict[Tuple[str, Tuple[str, ...]], "OrderedDict[int, tuple]"] = {}
+        # Global LRU order of (bucket key, entry id)
+        self._lru: "OrderedDict[Tuple[Tuple[str, Tuple[str, ...]], int], None]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._pending_writes = set()
+        
+        self.lookups = 0
+        self.hits = 0
+        self.persistent_hits = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+    
+    @staticmethod
+    def _bucket_key(agent_key: str, chunk_ids: List[str]) -> Tuple[str, Tuple[str, ...]]:
+        """Bucket entries by agent and the exact set of retrieved sources"""
+        return agent_key, tuple(sorted(str(chunk_id) for chunk_id in chunk_ids))
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """Unit-normalize an embedding for cosine comparisons"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _lookup_local(
+        self,
+        vector: np.ndarray,
+        bucket_key: Tuple[str, Tuple[str, ...]]
+    ) -> Optional[Dict[str, Any]]:
+        """Find the closest unexpired entry in a bucket within max_distance"""
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if not bucket:
+                return None
+            
+            now = time.monotonic()
+            for entry_id in [eid for eid, entry in bucket.items() if entry[2] < now]:
+                self._remove(bucket_key, entry_id)
+            if not bucket:
+                return None
+            
+            entry_ids = list(bucket.keys())
+            matrix = np.stack([bucket[eid][0] for eid in entry_ids])
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            
+            if 1.0 - float(similarities[best]) > self.max_distance:
+                return None
+            
+            self._lru.move_to_end((bucket_key, entry_ids[best]))
+            return bucket[entry_ids[best]][1]
+    
+    def _insert_local(
+        self,
+        vector: np.ndarray,
+        bucket_key: Tuple[str, Tuple[str, ...]],
+        response: Dict[str, Any]
+    ):
+        """Insert an entry, evicting the least recently used one when full"""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            
+            bucket = self._buckets.setdefault(bucket_key, OrderedDict())
+            bucket[entry_id] = (vector, response, time.monotonic() + self.ttl)
+            self._lru[(bucket_key, entry_id)] = None
+            
+            while len(self._lru) > self.max_size:
+                (old_bucket, old_id), _ = self._lru.popitem(last=False)
+                self._remove(old_bucket, old_id, from_lru=False)
+                self.evictions += 1
+    
+    def _remove(
+        self,
+        bucket_key: Tuple[str, Tuple[str, ...]],
+        entry_id: int,
+        from_lru: bool = True
+    ):
+        """Remove an entry; caller must hold the lock"""
+        bucket = self._buckets.get(bucket_key)
+        if bucket is not None:
+            bucket.pop(entry_id, None)
+            if not bucket:
+                del self._buckets[bucket_key]
+        if from_lru:
+            self._lru.pop((bucket_key, entry_id), None)
+    
+    async def lookup(
+        self,
+        query_embedding: List[float],
+        agent_key: str,
+        chunk_ids: List[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached answer for a semantically equivalent query
+        
+        Args:
+            query_embedding: Embedding of the incoming query
+            agent_key: Requested agent type, or "auto" for routed queries
+            chunk_ids: IDs of the chunks retrieved for the query
+            
+        Returns:
+            Cached agent response, or None on miss
+        """
+        self.lookups += 1
+        vector = self._normalize(query_embedding)
+        bucket_key = self._bucket_key(agent_key, chunk_ids)
+        
+        response = self._lookup_local(vector, bucket_key)
+        
+        if response is None and self.persist:
+            response = await db.find_cached_response(
+                query_embedding=query_embedding,
+                agent_key=agent_key,
+                chunk_ids=list(bucket_key[1]),
+                max_distance=self.max_distance
+            )
+            if response is not None:
+                self.persistent_hits += 1
+                self._insert_local(vector, bucket_key, response)
+        
+        if response is None:
+            return None
+        
+        self.hits += 1
+        self.tokens_saved += response.get("tokens_used", 0)
+        return dict(response)
+    
+    def store(
+        self,
+        query_embedding: List[float],
+        agent_key: str,
+        chunk_ids: List[str],
+        response: Dict[str, Any]
+    ):
+        """
+        Store an answer for future semantically equivalent queries
+        
+        Args:
+            query_embedding: Embedding of the query
+            agent_key: Requested agent type, or "auto" for routed queries
+            chunk_ids: IDs of the chunks retrieved for the query
+            response: Agent response to cache
+        """
+        vector = self._normalize(query_embedding)
+        bucket_key = self._bucket_key(agent_key, chunk_ids)
+        # Snapshot: the caller keeps adding timings etc. after this returns,
+        # and the background persist below runs later
+        response = dict(response)
+        self._insert_local(vector, bucket_key, response)
+        
+        if self.persist:
+            # Persist in the background so the caller is not delayed
+            task = asyncio.create_task(db.store_cached_response(
+                query_embedding=query_embedding,
+                agent_key=agent_key,
+                chunk_ids=list(bucket_key[1]),
+                response=response
+            ))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit rate and token savings"""
+        return {
+            "size": len(self._lru),
+            "max_size": self.max_size,
+            "max_distance": self.max_distance,
+            "persist": self.persist,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "evictions": self.evictions,
+            "tokens_saved": self.tokens_saved
+        }
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache(
+    max_size=settings.semantic_cache_size,
+    ttl_seconds=settings.semantic_cache_ttl_seconds,
+    max_distance=settings.semantic_cache_max_distance,
+    persist=settings.semantic_cache_persist
+)
@@ -26,6 +26,26 @@ CREATE TABLE IF NOT EXISTS document_chunks (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Content hashes for incremental re-ingestion (also upgrades existing installs)
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Full-text search vector for hybrid (lexical + vector) retrieval
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+
+-- Copy document type/date onto chunks so retrieval filters stay on one table
+-- (new chunks get them at indexing time; this upgrades existing installs)
+UPDATE document_chunks dc
+SET metadata = COALESCE(dc.metadata, '{}'::jsonb) || jsonb_strip_nulls(jsonb_build_object(
+    'type', d.metadata->'type',
+    'date', d.metadata->'date'
+))
+FROM documents d
+WHERE d.id = dc.document_id
+    AND (d.metadata ? 'type' OR d.metadata ? 'date')
+    AND NOT (COALESCE(dc.metadata, '{}'::jsonb) ? 'type' OR COALESCE(dc.metadata, '{}'::jsonb) ? 'date');
+
 -- Create chat_sessions table
 CREATE TABLE IF NOT EXISTS chat_sessions (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -35,6 +55,9 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     metadata JSONB DEFAULT '{}'::jsonb
 );
 
+-- Message count maintained by trigger so session lists need no per-session query
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+
 -- Create chat_messages table
 CREATE TABLE IF NOT EXISTS chat_messages (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -58,13 +81,92 @@ CREATE TABLE IF NOT EXISTS query_analytics (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Prompt tokens avoided by context packing (merged overlaps, duplicates, budget)
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS tokens_saved INTEGER DEFAULT 0;
+
+-- Per-request trace: LLM token usage and stage latencies (ms); timings holds
+-- every recorded stage
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS completion_tokens INTEGER;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS route_ms REAL;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS embed_ms REAL;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS vector_search_ms REAL;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS llm_ttft_ms REAL;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS llm_ms REAL;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS persist_ms REAL;
+ALTER TABLE query_analytics ADD COLUMN IF NOT EXISTS timings JSONB DEFAULT '{}';
+
+-- Create analytics rollups: per-minute and per-hour buckets by agent type,
+-- maintained by trigger on query_analytics so reports never scan it
+CREATE TABLE IF NOT EXISTS query_analytics_rollup (
+    granularity TEXT NOT NULL, -- 'minute' or 'hour'
+    bucket_start TIMESTAMPTZ NOT NULL,
+    agent_type TEXT NOT NULL DEFAULT '',
+    query_count BIGINT NOT NULL DEFAULT 0,
+    total_response_ms BIGINT NOT NULL DEFAULT 0,
+    max_response_ms INTEGER NOT NULL DEFAULT 0,
+    tokens_used BIGINT NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    tokens_saved BIGINT NOT NULL DEFAULT 0,
+    sources_retrieved BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_start, agent_type)
+);
+
+-- Latency sketch per rollup bucket: counts in log-spaced bins (bin i covers
+-- (1.05^(i-1), 1.05^i] ms), so percentiles of merged buckets are within ~2.5%
+CREATE TABLE IF NOT EXISTS query_latency_sketch (
+    granularity TEXT NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    agent_type TEXT NOT NULL DEFAULT '',
+    bin INTEGER NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (granularity, bucket_start, agent_type, bin)
+);
+
+-- Create semantic answer cache table
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    query_embedding vector(384),
+    agent_key TEXT NOT NULL, -- Requested agent type, or 'auto' for routed queries
+    chunk_ids TEXT[] NOT NULL, -- Sorted IDs of the retrieved chunks
+    response JSONB NOT NULL,
+    tokens_used INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id 
     ON document_chunks(document_id);
 
-CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding 
-    ON document_chunks USING ivfflat (embedding vector_cosine_ops)
-    WITH (lists = 100);
+-- Documents are matched by title and source, not by content hash alone
+DROP INDEX IF EXISTS idx_documents_content_hash;
+
+CREATE INDEX IF NOT EXISTS idx_documents_title_source 
+    ON documents(title, source);
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_content_hash 
+    ON document_chunks(document_id, content_hash);
+
+-- Retrieval filters: containment (@>) on chunk metadata, plus source and date lookups
+CREATE INDEX IF NOT EXISTS idx_document_chunks_metadata 
+    ON document_chunks USING gin (metadata jsonb_path_ops);
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_source 
+    ON document_chunks ((metadata->>'source'));
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_date 
+    ON document_chunks ((metadata->>'date'));
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_content_tsv 
+    ON document_chunks USING gin (content_tsv);
+
+-- The vector index (idx_document_chunks_embedding) is built after ingestion
+-- with `python manage_index.py build`, so ivfflat centroids are trained on
+-- real data; until then searches use an exact scan
+
+CREATE INDEX IF NOT EXISTS idx_semantic_cache_lookup 
+    ON semantic_cache(agent_key, chunk_ids);
 
 CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id 
     ON chat_messages(session_id);
@@ -72,36 +174,264 @@ CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id
 CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at 
     ON chat_messages(created_at DESC);
 
+-- Serves the per-session history tail (ORDER BY created_at DESC LIMIT n)
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created_at 
+    ON chat_messages(session_id, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_created_at_id 
+    ON chat_sessions(created_at DESC, id DESC);
+
 -- Create function for vector similarity search
+DROP FUNCTION IF EXISTS match_document_chunks(vector, float, int);
+DROP FUNCTION IF EXISTS match_document_chunks(vector, float, int, int, int);
+DROP FUNCTION IF EXISTS match_document_chunks(vector, float, int, int, int, uuid, text, jsonb);
+DROP FUNCTION IF EXISTS match_document_chunks(vector, float, int, int, int, uuid, text, jsonb, text, text);
+
 CREATE OR REPLACE FUNCTION match_document_chunks(
     query_embedding vector(384),
     match_threshold float DEFAULT 0.7,
-    match_count int DEFAULT 5
+    match_count int DEFAULT 5,
+    probes int DEFAULT NULL,
+    ef_search int DEFAULT NULL,
+    filter_document_id uuid DEFAULT NULL,
+    filter_source text DEFAULT NULL,
+    filter_metadata jsonb DEFAULT NULL,
+    filter_date_from text DEFAULT NULL,
+    filter_date_to text DEFAULT NULL,
+    with_embeddings boolean DEFAULT false
 )
 RETURNS TABLE (
     id uuid,
     document_id uuid,
     content text,
     similarity float,
-    metadata jsonb
+    metadata jsonb,
+    embedding vector
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    filters text := '';
+    -- Chunk vectors (for context packing) only when asked for
+    embedding_column text := CASE WHEN with_embeddings THEN 'dc.embedding' ELSE 'NULL::vector' END;
+BEGIN
+    -- Search-time accuracy knobs, local to this call's transaction
+    IF probes IS NOT NULL THEN
+        PERFORM set_config('ivfflat.probes', probes::text, true);
+    END IF;
+    IF ef_search IS NOT NULL THEN
+        PERFORM set_config('hnsw.ef_search', ef_search::text, true);
+    END IF;
+    
+    -- With filters, let pgvector >= 0.8 keep scanning the ANN index until
+    -- enough rows pass instead of returning fewer than match_count
+    IF (filter_document_id IS NOT NULL OR filter_source IS NOT NULL
+            OR filter_metadata IS NOT NULL OR filter_date_from IS NOT NULL
+            OR filter_date_to IS NOT NULL)
+        AND (SELECT string_to_array(extversion, '.')::int[] >= '{0,8}'
+             FROM pg_extension WHERE extname = 'vector') THEN
+        PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+        PERFORM set_config('ivfflat.iterative_scan', 'relaxed_order', true);
+    END IF;
+    
+    -- Only the supplied filters go into the statement: EXECUTE plans it
+    -- with the actual values, so the btree/GIN indexes on document_id and
+    -- metadata stay usable (a cached generic plan over "x IS NULL OR col = x"
+    -- predicates could not use them). date_to is compared at its own
+    -- precision, so "2025-08-15" is within date_to "2025-08".
+    IF filter_document_id IS NOT NULL THEN
+        filters := filters || ' AND dc.document_id = $2';
+    END IF;
+    IF filter_source IS NOT NULL THEN
+        filters := filters || ' AND dc.metadata->>''source'' = $3';
+    END IF;
+    IF filter_metadata IS NOT NULL THEN
+        filters := filters || ' AND dc.metadata @> $4';
+    END IF;
+    IF filter_date_from IS NOT NULL THEN
+        filters := filters || ' AND dc.metadata->>''date'' >= $5';
+    END IF;
+    IF filter_date_to IS NOT NULL THEN
+        filters := filters || ' AND left(dc.metadata->>''date'', length($6)) <= $6';
+    END IF;
+    
+    -- Take the index-ordered top-k first and apply the threshold afterwards;
+    -- a distance expression in WHERE would force a scan of every row
+    RETURN QUERY EXECUTE format($query$
+        WITH nearest AS (
+            SELECT
+                dc.id,
+                dc.document_id,
+                dc.content,
+                dc.embedding <=> $1 as distance,
+                dc.metadata,
+                %s as embedding
+            FROM document_chunks dc
+            WHERE dc.embedding IS NOT NULL%s
+            ORDER BY dc.embedding <=> $1
+            LIMIT $7
+        )
+        SELECT
+            nearest.id,
+            nearest.document_id,
+            nearest.content,
+            1 - nearest.distance as similarity,
+            nearest.metadata,
+            nearest.embedding
+        FROM nearest
+        WHERE 1 - nearest.distance > $8
+        ORDER BY nearest.distance
+    $query$, embedding_column, filters)
+    USING query_embedding, filter_document_id, filter_source, filter_metadata,
+        filter_date_from, filter_date_to, match_count, match_threshold;
+END;
+$$;
+
+-- Create function for full-text chunk search
+DROP FUNCTION IF EXISTS match_document_chunks_fulltext(text, int);
+DROP FUNCTION IF EXISTS match_document_chunks_fulltext(text, int, uuid, text, jsonb, text, text);
+
+CREATE OR REPLACE FUNCTION match_document_chunks_fulltext(
+    query_text text,
+    match_count int DEFAULT 5,
+    filter_document_id uuid DEFAULT NULL,
+    filter_source text DEFAULT NULL,
+    filter_metadata jsonb DEFAULT NULL,
+    filter_date_from text DEFAULT NULL,
+    filter_date_to text DEFAULT NULL,
+    with_embeddings boolean DEFAULT false
+)
+RETURNS TABLE (
+    id uuid,
+    document_id uuid,
+    content text,
+    lexical_score float,
+    metadata jsonb,
+    embedding vector
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    ts_query tsquery;
+    lexeme text;
+    filters text := '';
+    embedding_column text := CASE WHEN with_embeddings THEN 'dc.embedding' ELSE 'NULL::vector' END;
+BEGIN
+    -- OR the query's normalized lexemes so partial matches still rank;
+    -- built with the tsquery || operator, never by rewriting query text
+    FOR lexeme IN SELECT unnest(tsvector_to_array(to_tsvector('english', query_text))) LOOP
+        ts_query := coalesce(ts_query || plainto_tsquery('simple', lexeme), plainto_tsquery('simple', lexeme));
+    END LOOP;
+    IF ts_query IS NULL THEN
+        RETURN;
+    END IF;
+    
+    -- Only the supplied filters go into the statement (see match_document_chunks)
+    IF filter_document_id IS NOT NULL THEN
+        filters := filters || ' AND dc.document_id = $2';
+    END IF;
+    IF filter_source IS NOT NULL THEN
+        filters := filters || ' AND dc.metadata->>''source'' = $3';
+    END IF;
+    IF filter_metadata IS NOT NULL THEN
+        filters := filters || ' AND dc.metadata @> $4';
+    END IF;
+    IF filter_date_from IS NOT NULL THEN
+        filters := filters || ' AND dc.metadata->>''date'' >= $5';
+    END IF;
+    IF filter_date_to IS NOT NULL THEN
+        filters := filters || ' AND left(dc.metadata->>''date'', length($6)) <= $6';
+    END IF;
+    
+    RETURN QUERY EXECUTE format($query$
+        SELECT
+            dc.id,
+            dc.document_id,
+            dc.content,
+            ts_rank_cd(dc.content_tsv, $1)::float as lexical_score,
+            dc.metadata,
+            %s
+        FROM document_chunks dc
+        WHERE dc.content_tsv @@ $1%s
+        ORDER BY lexical_score DESC
+        LIMIT $7
+    $query$, embedding_column, filters)
+    USING ts_query, filter_document_id, filter_source, filter_metadata,
+        filter_date_from, filter_date_to, match_count;
+END;
+$$;
+
+-- Create function for semantic cache lookup
+CREATE OR REPLACE FUNCTION match_semantic_cache(
+    query_embedding vector(384),
+    match_agent_key text,
+    match_chunk_ids text[],
+    max_distance float DEFAULT 0.08
+)
+RETURNS TABLE (
+    id uuid,
+    response jsonb,
+    distance float
 )
 LANGUAGE plpgsql
 AS $$
 BEGIN
     RETURN QUERY
     SELECT
-        dc.id,
-        dc.document_id,
-        dc.content,
-        1 - (dc.embedding <=> query_embedding) as similarity,
-        dc.metadata
-    FROM document_chunks dc
-    WHERE 1 - (dc.embedding <=> query_embedding) > match_threshold
-    ORDER BY dc.embedding <=> query_embedding
-    LIMIT match_count;
+        sc.id,
+        sc.response,
+        sc.query_embedding <=> query_embedding as distance
+    FROM semantic_cache sc
+    WHERE sc.agent_key = match_agent_key
+      AND sc.chunk_ids = match_chunk_ids
+      AND sc.query_embedding <=> query_embedding <= max_distance
+    ORDER BY sc.query_embedding <=> query_embedding
+    LIMIT 1;
 END;
 $$;
 
+-- Create function for keyset-paginated session listing (newest first)
+CREATE OR REPLACE FUNCTION list_chat_sessions(
+    page_size int DEFAULT 20,
+    before_created_at timestamptz DEFAULT NULL,
+    before_id uuid DEFAULT NULL
+)
+RETURNS SETOF chat_sessions
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT *
+    FROM chat_sessions s
+    WHERE before_created_at IS NULL
+        OR (s.created_at, s.id) < (before_created_at, before_id)
+    ORDER BY s.created_at DESC, s.id DESC
+    LIMIT page_size;
+$$;
+
+-- Create functions to keep chat_sessions.message_count in sync; statement
+-- level, so a batched insert updates each session once
+CREATE OR REPLACE FUNCTION increment_session_message_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE chat_sessions s
+    SET message_count = s.message_count + added.n
+    FROM (SELECT session_id, count(*) AS n FROM new_messages GROUP BY session_id) added
+    WHERE s.id = added.session_id;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION decrement_session_message_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE chat_sessions s
+    SET message_count = GREATEST(s.message_count - removed.n, 0)
+    FROM (SELECT session_id, count(*) AS n FROM old_messages GROUP BY session_id) removed
+    WHERE s.id = removed.session_id;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
 -- Create function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -111,44 +441,358 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
--- Create triggers
-CREATE TRIGGER update_documents_updated_at BEFORE UPDATE ON documents
+-- Create triggers (OR REPLACE, so the script can be re-run to upgrade an install)
+CREATE OR REPLACE TRIGGER update_documents_updated_at BEFORE UPDATE ON documents
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
-CREATE TRIGGER update_chat_sessions_updated_at BEFORE UPDATE ON chat_sessions
+CREATE OR REPLACE TRIGGER update_chat_sessions_updated_at BEFORE UPDATE ON chat_sessions
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+CREATE OR REPLACE TRIGGER chat_messages_count_insert AFTER INSERT ON chat_messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION increment_session_message_count();
+
+CREATE OR REPLACE TRIGGER chat_messages_count_delete AFTER DELETE ON chat_messages
+    REFERENCING OLD TABLE AS old_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION decrement_session_message_count();
+
+-- Backfill counts for sessions created before the triggers existed
+UPDATE chat_sessions s
+SET message_count = counts.n
+FROM (SELECT session_id, count(*) AS n FROM chat_messages GROUP BY session_id) counts
+WHERE s.id = counts.session_id AND s.message_count <> counts.n;
+
+-- Create latency sketch helpers: response time -> bin, bin -> representative ms
+CREATE OR REPLACE FUNCTION latency_sketch_bin(response_time_ms double precision)
+RETURNS integer
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN response_time_ms IS NULL OR response_time_ms <= 1 THEN 0
+        ELSE ceil(ln(response_time_ms) / ln(1.05))::integer
+    END;
+$$;
+
+CREATE OR REPLACE FUNCTION latency_sketch_value(bin integer)
+RETURNS double precision
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT 2 * power(1.05, bin) / (1.05 + 1);
+$$;
+
+-- Quantile q of a sketch given as parallel bin/count arrays (bins may repeat)
+CREATE OR REPLACE FUNCTION latency_sketch_quantile(
+    bins integer[],
+    counts bigint[],
+    q double precision
+)
+RETURNS double precision
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT round(latency_sketch_value(ranked.bin)::numeric, 2)::double precision
+    FROM (
+        SELECT
+            u.bin,
+            SUM(u.count) OVER (ORDER BY u.bin) AS cumulative,
+            SUM(u.count) OVER () AS total
+        FROM unnest(bins, counts) AS u(bin, count)
+    ) ranked
+    WHERE ranked.cumulative >= q * ranked.total
+    ORDER BY ranked.bin
+    LIMIT 1;
+$$;
+
+-- Create function to fold inserted query_analytics rows into the rollups;
+-- statement level, so a write-behind batch updates each bucket once
+CREATE OR REPLACE FUNCTION rollup_query_analytics()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO query_analytics_rollup AS r (
+        granularity, bucket_start, agent_type, query_count, total_response_ms,
+        max_response_ms, tokens_used, prompt_tokens, completion_tokens,
+        tokens_saved, sources_retrieved
+    )
+    SELECT
+        g.granularity,
+        date_trunc(g.granularity, n.created_at),
+        COALESCE(n.agent_type, ''),
+        count(*),
+        COALESCE(SUM(n.response_time_ms), 0),
+        COALESCE(MAX(n.response_time_ms), 0),
+        COALESCE(SUM(n.tokens_used), 0),
+        COALESCE(SUM(n.prompt_tokens), 0),
+        COALESCE(SUM(n.completion_tokens), 0),
+        COALESCE(SUM(n.tokens_saved), 0),
+        COALESCE(SUM(n.sources_retrieved), 0)
+    FROM new_analytics n
+    CROSS JOIN (VALUES ('minute'), ('hour')) AS g(granularity)
+    GROUP BY 1, 2, 3
+    ON CONFLICT (granularity, bucket_start, agent_type) DO UPDATE SET
+        query_count = r.query_count + EXCLUDED.query_count,
+        total_response_ms = r.total_response_ms + EXCLUDED.total_response_ms,
+        max_response_ms = GREATEST(r.max_response_ms, EXCLUDED.max_response_ms),
+        tokens_used = r.tokens_used + EXCLUDED.tokens_used,
+        prompt_tokens = r.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = r.completion_tokens + EXCLUDED.completion_tokens,
+        tokens_saved = r.tokens_saved + EXCLUDED.tokens_saved,
+        sources_retrieved = r.sources_retrieved + EXCLUDED.sources_retrieved;
+    
+    INSERT INTO query_latency_sketch AS s (granularity, bucket_start, agent_type, bin, count)
+    SELECT
+        g.granularity,
+        date_trunc(g.granularity, n.created_at),
+        COALESCE(n.agent_type, ''),
+        latency_sketch_bin(n.response_time_ms),
+        count(*)
+    FROM new_analytics n
+    CROSS JOIN (VALUES ('minute'), ('hour')) AS g(granularity)
+    WHERE n.response_time_ms IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (granularity, bucket_start, agent_type, bin) DO UPDATE SET
+        count = s.count + EXCLUDED.count;
+    
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE TRIGGER query_analytics_rollup_insert AFTER INSERT ON query_analytics
+    REFERENCING NEW TABLE AS new_analytics
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_query_analytics();
+
+-- Backfill rollups from rows logged before the trigger existed (only into
+-- empty rollup tables, so re-running this script does not double count)
+INSERT INTO query_analytics_rollup (
+    granularity, bucket_start, agent_type, query_count, total_response_ms,
+    max_response_ms, tokens_used, prompt_tokens, completion_tokens,
+    tokens_saved, sources_retrieved
+)
+SELECT
+    g.granularity,
+    date_trunc(g.granularity, n.created_at),
+    COALESCE(n.agent_type, ''),
+    count(*),
+    COALESCE(SUM(n.response_time_ms), 0),
+    COALESCE(MAX(n.response_time_ms), 0),
+    COALESCE(SUM(n.tokens_used), 0),
+    COALESCE(SUM(n.prompt_tokens), 0),
+    COALESCE(SUM(n.completion_tokens), 0),
+    COALESCE(SUM(n.tokens_saved), 0),
+    COALESCE(SUM(n.sources_retrieved), 0)
+FROM query_analytics n
+CROSS JOIN (VALUES ('minute'), ('hour')) AS g(granularity)
+WHERE NOT EXISTS (SELECT 1 FROM query_analytics_rollup)
+GROUP BY 1, 2, 3;
+
+INSERT INTO query_latency_sketch (granularity, bucket_start, agent_type, bin, count)
+SELECT
+    g.granularity,
+    date_trunc(g.granularity, n.created_at),
+    COALESCE(n.agent_type, ''),
+    latency_sketch_bin(n.response_time_ms),
+    count(*)
+FROM query_analytics n
+CROSS JOIN (VALUES ('minute'), ('hour')) AS g(granularity)
+WHERE n.response_time_ms IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM query_latency_sketch)
+GROUP BY 1, 2, 3, 4;
+
+-- Create function to report analytics from the rollups: per-bucket series,
+-- totals per agent type and overall, with p50/p95/p99 from merged sketches.
+-- Cost grows with the number of buckets in the range, not with query volume.
+CREATE OR REPLACE FUNCTION get_query_analytics(
+    p_granularity text DEFAULT 'hour',
+    p_from timestamptz DEFAULT NOW() - INTERVAL '24 hours',
+    p_to timestamptz DEFAULT NOW(),
+    p_agent_type text DEFAULT NULL
+)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+    WITH buckets AS (
+        SELECT *
+        FROM query_analytics_rollup r
+        WHERE r.granularity = p_granularity
+            AND r.bucket_start >= date_trunc(p_granularity, p_from)
+            AND r.bucket_start < p_to
+            AND (p_agent_type IS NULL OR r.agent_type = p_agent_type)
+    ),
+    bins AS (
+        SELECT *
+        FROM query_latency_sketch s
+        WHERE s.granularity = p_granularity
+            AND s.bucket_start >= date_trunc(p_granularity, p_from)
+            AND s.bucket_start < p_to
+            AND (p_agent_type IS NULL OR s.agent_type = p_agent_type)
+    ),
+    series AS (
+        SELECT
+            b.bucket_start,
+            NULLIF(b.agent_type, '') AS agent_type,
+            b.query_count,
+            round(b.total_response_ms::numeric / NULLIF(b.query_count, 0), 2) AS avg_response_ms,
+            p.p50_ms,
+            p.p95_ms,
+            p.p99_ms,
+            b.max_response_ms,
+            b.tokens_used,
+            b.prompt_tokens,
+            b.completion_tokens,
+            b.tokens_saved,
+            b.sources_retrieved
+        FROM buckets b
+        LEFT JOIN (
+            SELECT
+                bucket_start,
+                agent_type,
+                latency_sketch_quantile(array_agg(bin), array_agg(count), 0.50) AS p50_ms,
+                latency_sketch_quantile(array_agg(bin), array_agg(count), 0.95) AS p95_ms,
+                latency_sketch_quantile(array_agg(bin), array_agg(count), 0.99) AS p99_ms
+            FROM bins
+            GROUP BY bucket_start, agent_type
+        ) p USING (bucket_start, agent_type)
+    ),
+    by_agent AS (
+        SELECT
+            NULLIF(t.agent_type, '') AS agent_type,
+            t.query_count,
+            round(t.total_response_ms::numeric / NULLIF(t.query_count, 0), 2) AS avg_response_ms,
+            p.p50_ms,
+            p.p95_ms,
+            p.p99_ms,
+            t.max_response_ms,
+            t.tokens_used,
+            t.prompt_tokens,
+            t.completion_tokens,
+            t.tokens_saved,
+            t.sources_retrieved
+        FROM (
+            SELECT
+                agent_type,
+                SUM(query_count) AS query_count,
+                SUM(total_response_ms) AS total_response_ms,
+                MAX(max_response_ms) AS max_response_ms,
+                SUM(tokens_used) AS tokens_used,
+                SUM(prompt_tokens) AS prompt_tokens,
+                SUM(completion_tokens) AS completion_tokens,
+                SUM(tokens_saved) AS tokens_saved,
+                SUM(sources_retrieved) AS sources_retrieved
+            FROM buckets
+            GROUP BY agent_type
+        ) t
+        LEFT JOIN (
+            SELECT
+                agent_type,
+                latency_sketch_quantile(array_agg(bin), array_agg(count), 0.50) AS p50_ms,
+                latency_sketch_quantile(array_agg(bin), array_agg(count), 0.95) AS p95_ms,
+                latency_sketch_quantile(array_agg(bin), array_agg(count), 0.99) AS p99_ms
+            FROM bins
+            GROUP BY agent_type
+        ) p USING (agent_type)
+    ),
+    totals AS (
+        SELECT
+            COALESCE(SUM(b.query_count), 0) AS query_count,
+            round(SUM(b.total_response_ms)::numeric / NULLIF(SUM(b.query_count), 0), 2) AS avg_response_ms,
+            (SELECT latency_sketch_quantile(array_agg(bin), array_agg(count), 0.50) FROM bins) AS p50_ms,
+            (SELECT latency_sketch_quantile(array_agg(bin), array_agg(count), 0.95) FROM bins) AS p95_ms,
+            (SELECT latency_sketch_quantile(array_agg(bin), array_agg(count), 0.99) FROM bins) AS p99_ms,
+            MAX(b.max_response_ms) AS max_response_ms,
+            COALESCE(SUM(b.tokens_used), 0) AS tokens_used,
+            COALESCE(SUM(b.prompt_tokens), 0) AS prompt_tokens,
+            COALESCE(SUM(b.completion_tokens), 0) AS completion_tokens,
+            COALESCE(SUM(b.tokens_saved), 0) AS tokens_saved,
+            COALESCE(SUM(b.sources_retrieved), 0) AS sources_retrieved
+        FROM buckets b
+    )
+    SELECT jsonb_build_object(
+        'granularity', p_granularity,
+        'from', date_trunc(p_granularity, p_from),
+        'to', p_to,
+        'totals', (SELECT to_jsonb(t) FROM totals t),
+        'by_agent', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(a) ORDER BY a.query_count DESC) FROM by_agent a),
+            '[]'::jsonb
+        ),
+        'series', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(s) ORDER BY s.bucket_start, s.agent_type) FROM series s),
+            '[]'::jsonb
+        )
+    );
+$$;
+
+-- Create function to drop minute rollups past their retention (hourly ones
+-- are kept); call periodically, e.g. from pg_cron
+CREATE OR REPLACE FUNCTION prune_query_analytics_rollup(
+    keep_minutes interval DEFAULT INTERVAL '7 days'
+)
+RETURNS void
+LANGUAGE sql
+AS $$
+    DELETE FROM query_latency_sketch
+    WHERE granularity = 'minute' AND bucket_start < NOW() - keep_minutes;
+    DELETE FROM query_analytics_rollup
+    WHERE granularity = 'minute' AND bucket_start < NOW() - keep_minutes;
+$$;
+
 -- Create RLS (Row Level Security) policies
 ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
 ALTER TABLE document_chunks ENABLE ROW LEVEL SECURITY;
 ALTER TABLE chat_sessions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE chat_messages ENABLE ROW LEVEL SECURITY;
 ALTER TABLE query_analytics ENABLE ROW LEVEL SECURITY;
+ALTER TABLE semantic_cache ENABLE ROW LEVEL SECURITY;
+ALTER TABLE query_analytics_rollup ENABLE ROW LEVEL SECURITY;
+ALTER TABLE query_latency_sketch ENABLE ROW LEVEL SECURITY;
 
--- Allow all operations for authenticated users (adjust as needed)
+-- Allow all operations for authenticated users (adjust as needed); dropped
+-- first because CREATE POLICY has no IF NOT EXISTS
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON documents;
 CREATE POLICY "Allow all for authenticated users" ON documents
     FOR ALL USING (true);
 
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON document_chunks;
 CREATE POLICY "Allow all for authenticated users" ON document_chunks
     FOR ALL USING (true);
 
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON chat_sessions;
 CREATE POLICY "Allow all for authenticated users" ON chat_sessions
     FOR ALL USING (true);
 
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON chat_messages;
 CREATE POLICY "Allow all for authenticated users" ON chat_messages
     FOR ALL USING (true);
 
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON query_analytics;
 CREATE POLICY "Allow all for authenticated users" ON query_analytics
     FOR ALL USING (true);
 
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON semantic_cache;
+CREATE POLICY "Allow all for authenticated users" ON semantic_cache
+    FOR ALL USING (true);
+
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON query_analytics_rollup;
+CREATE POLICY "Allow all for authenticated users" ON query_analytics_rollup
+    FOR ALL USING (true);
+
+DROP POLICY IF EXISTS "Allow all for authenticated users" ON query_latency_sketch;
+CREATE POLICY "Allow all for authenticated users" ON query_latency_sketch
+    FOR ALL USING (true);
+
 -- Insert initial metadata
-INSERT INTO documents (title, source, content, metadata) VALUES 
-(
+INSERT INTO documents (title, source, content, metadata)
+SELECT
     'Saudi Investment Strategy - Setup Instructions',
     'system',
     'This RAG system contains comprehensive analysis of Saudi Arabia investment opportunities.',
     '{"type": "system", "version": "1.0"}'::jsonb
-) ON CONFLICT DO NOTHING;
+WHERE NOT EXISTS (
+    SELECT 1 FROM documents
+    WHERE title = 'Saudi Investment Strategy - Setup Instructions' AND source = 'system'
+);
 
 -- Grant necessary permissions
 GRANT USAGE ON SCHEMA public TO postgres, anon, authenticated, service_role;
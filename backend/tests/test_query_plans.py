@@ -0,0 +1,54 @@
+"""
+Query plan regression test
+Fails when a chunk search stops being served by an index; needs a database
+with the schema from setup_database.sql and at least one embedded chunk
+"""
+import os
+from pathlib import Path
+import sys
+
+import pytest
+
+if not os.environ.get("DATABASE_URL"):
+    pytest.skip("DATABASE_URL is not set", allow_module_level=True)
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from check_query_plans import (
+    build_cases,
+    disable_seqscan,
+    enable_auto_explain,
+    explain,
+    plan_indexes,
+    sample_row,
+)
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def test_chunk_searches_use_an_index(conn):
+    with conn.cursor() as cur:
+        row = sample_row(cur)
+        if row is None:
+            pytest.skip("No embedded chunks to plan with")
+        enable_auto_explain(cur)
+        # A test database is usually small enough for a seq scan to win on
+        # cost, which would hide whether an index can serve the search at all
+        disable_seqscan(cur)
+        
+        failures = []
+        for name, params, allowed in build_cases(*row):
+            used = plan_indexes(explain(conn, cur, params))
+            if not any(index in used for index in allowed):
+                failures.append(f"{name}: expected {' or '.join(allowed)}, plan used {used or 'no index'}")
+    
+    assert not failures, "\n".join(failures)
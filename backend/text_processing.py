@@ -0,0 +1,42 @@
+"""
+Text Processing for KANZ System
+Text cleaning and chunking shared by the API and the ingestion workers
+"""
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+import hashlib
+import re
+
+from config import settings
+
+
+def clean_text(text: str) -> str:
+    """Clean and normalize text"""
+    # Remove multiple newlines
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    
+    # Remove excessive whitespace
+    text = re.sub(r' {2,}', ' ', text)
+    
+    # Remove box drawing characters (from formatted documents)
+    text = re.sub(r'[─│┌┐└┘├┤┬┴┼═║╔╗╚╝╠╣╦╩╬]', '', text)
+    
+    # Normalize quotes
+    text = text.replace('"', '"').replace('"', '"')
+    text = text.replace(''', "'").replace(''', "'")
+    
+    return text.strip()
+
+
+def hash_text(text: str) -> str:
+    """SHA-256 hex digest of a text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Create the text splitter configured by chunk settings"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
@@ -0,0 +1,124 @@
+"""
+Request Tracing for KANZ System
+Per-request stage timings and LLM token usage
+"""
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+
+# Stages stored as their own query_analytics columns (all stages also go to
+# the timings JSONB column)
+STAGE_COLUMNS = {
+    "route_ms": "route",
+    "embed_ms": "embed",
+    "vector_search_ms": "vector_search",
+    "llm_ttft_ms": "llm_first_token",
+    "llm_ms": "llm",
+    "persist_ms": "persist"
+}
+
+TRACE_COLUMNS = ("prompt_tokens", "completion_tokens", *STAGE_COLUMNS, "timings")
+
+
+class RequestTrace:
+    """
+    Trace of one query request
+    
+    Created by the endpoint and passed down through the coordinator and the
+    specialist agent. Stages record their latency in ms under a stage name
+    (timings is the same dict the pipeline stages already write to); the LLM
+    call records the token usage reported by Groq.
+    """
+    
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.tokens_estimated = False
+    
+    def record(self, stage: str, elapsed_ms: float):
+        """Record the latency of a stage"""
+        self.timings[stage] = round(elapsed_ms, 2)
+    
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """Time the enclosed block as a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+    
+    def record_usage(self, token_usage: Optional[Dict[str, Any]]):
+        """
+        Record token usage from Groq response metadata
+        
+        Groq also reports queue, prompt and completion times (seconds); they
+        are kept as llm_queue, llm_prompt and llm_completion stages.
+        """
+        if not token_usage:
+            return
+        
+        self.prompt_tokens += token_usage.get("prompt_tokens", 0) or 0
+        self.completion_tokens += token_usage.get("completion_tokens", 0) or 0
+        self.total_tokens += token_usage.get("total_tokens", 0) or 0
+        
+        for key, stage in (
+            ("queue_time", "llm_queue"),
+            ("prompt_time", "llm_prompt"),
+            ("completion_time", "llm_completion")
+        ):
+            if token_usage.get(key) is not None:
+                self.record(stage, token_usage[key] * 1000)
+    
+    def record_usage_metadata(self, usage_metadata: Optional[Dict[str, Any]]):
+        """Record token usage from a LangChain usage_metadata dict (streamed chunks)"""
+        if not usage_metadata:
+            return
+        self.record_usage({
+            "prompt_tokens": usage_metadata.get("input_tokens", 0),
+            "completion_tokens": usage_metadata.get("output_tokens", 0),
+            "total_tokens": usage_metadata.get("total_tokens", 0)
+        })
+    
+    def estimate_usage(self, prompt_tokens: int, completion_tokens: int):
+        """Fall back to local token counts when the LLM reported no usage"""
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.tokens_estimated = True
+    
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the request started"""
+        return (time.perf_counter() - self.start_time) * 1000
+    
+    def finish(self) -> int:
+        """Record the total request time and return it in whole ms"""
+        self.record("total", self.elapsed_ms())
+        return int(self.timings["total"])
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Token usage and stage timings for API responses"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "tokens_estimated": self.tokens_estimated,
+            "timings": dict(self.timings)
+        }
+    
+    def to_columns(self) -> Dict[str, Any]:
+        """Values for the query_analytics trace columns"""
+        columns = {
+            column: self.timings.get(stage)
+            for column, stage in STAGE_COLUMNS.items()
+        }
+        columns.update({
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "timings": dict(self.timings)
+        })
+        return columns
@@ -0,0 +1,211 @@
+"""
+Write-Behind Queue for KANZ System
+Buffers chat messages and query analytics and flushes them as batched inserts
+"""
+import asyncio
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+
+InsertRowsFn = Callable[[str, List[Dict[str, Any]]], Awaitable[Any]]
+
+
+class WriteBehindQueue:
+    """
+    Accept records immediately and insert them in the background
+    
+    Records are grouped per table into multi-row inserts, flushed when the
+    batch is full or the flush interval has passed since its first record.
+    The queue is bounded: once full, enqueue waits for the flusher
+    (backpressure) instead of growing without limit. Records stay visible
+    through pending() until their insert has finished.
+    
+    A failed insert is retried with exponential backoff; if it still fails,
+    the rows are inserted one by one so only the rows the database rejects
+    are dropped.
+    """
+    
+    def __init__(
+        self,
+        insert_fn: InsertRowsFn,
+        max_queue_size: int = 10000,
+        flush_interval_ms: float = 200.0,
+        max_batch_size: int = 100,
+        max_retries: int = 3,
+        retry_backoff_ms: float = 100.0
+    ):
+        self.insert_fn = insert_fn
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._sequence = itertools.count()
+        
+        # Counters for queue depth, backpressure and flush latency
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.backpressure_waits = 0
+        self.total_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.max_observed_depth = 0
+    
+    def _ensure_worker(self):
+        """Start the flush worker on the running event loop if needed"""
+        if self._worker is None or self._worker.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = asyncio.create_task(self._run())
+            logger.info(
+                f"Write-behind queue started (interval={self.flush_interval * 1000:.0f}ms, "
+                f"batch={self.max_batch_size}, capacity={self.max_queue_size})"
+            )
+    
+    async def enqueue(self, table: str, record: Dict[str, Any]):
+        """
+        Queue a record for insertion, waiting only if the queue is full
+        
+        Args:
+            table: Target table
+            record: Row to insert (column -> value)
+        """
+        self._ensure_worker()
+        if self._queue.full():
+            self.backpressure_waits += 1
+        
+        seq = next(self._sequence)
+        self._pending.setdefault(table, {})[seq] = record
+        try:
+            await self._queue.put((table, seq, record))
+        except BaseException:
+            self._pending[table].pop(seq, None)
+            raise
+        
+        self.enqueued += 1
+        self.max_observed_depth = max(self.max_observed_depth, self._queue.qsize())
+    
+    def pending(self, table: str) -> List[Dict[str, Any]]:
+        """Records for a table that are queued or being inserted, oldest first"""
+        return list(self._pending.get(table, {}).values())
+    
+    async def _collect(self) -> List[Tuple[str, int, Dict[str, Any]]]:
+        """Wait for the first record, then gather more until the interval ends"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.flush_interval
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def _run(self):
+        """Worker loop: collect a batch and insert it table by table"""
+        while True:
+            batch = await self._collect()
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    async def _flush(self, batch: List[Tuple[str, int, Dict[str, Any]]]):
+        """Insert a batch with one multi-row insert per table"""
+        by_table: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+        for table, seq, record in batch:
+            by_table.setdefault(table, []).append((seq, record))
+        
+        start_time = time.perf_counter()
+        for table, items in by_table.items():
+            try:
+                await self._insert(table, items)
+            finally:
+                for seq, _ in items:
+                    self._pending[table].pop(seq, None)
+        
+        flush_ms = (time.perf_counter() - start_time) * 1000
+        self.flushes += 1
+        self.total_flush_ms += flush_ms
+        self.max_flush_ms = max(self.max_flush_ms, flush_ms)
+    
+    async def _insert(self, table: str, items: List[Tuple[int, Dict[str, Any]]]):
+        """Insert rows of one table, retrying and finally falling back to single rows"""
+        records = [record for _, record in items]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.insert_fn(table, records)
+                self.flushed += len(records)
+                return
+            except Exception as e:
+                error = e
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+        
+        if len(records) == 1:
+            self.failed += 1
+            logger.error(f"Write-behind insert of a {table} row failed, dropping it: {error}")
+            return
+        
+        logger.warning(
+            f"Write-behind insert of {len(records)} {table} rows failed ({error}); "
+            f"inserting them one by one"
+        )
+        for seq, record in items:
+            try:
+                await self.insert_fn(table, [record])
+                self.flushed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Write-behind insert of a {table} row failed, dropping it: {e}")
+            finally:
+                self._pending[table].pop(seq, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth, throughput and flush latency statistics"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "capacity": self.max_queue_size,
+            "max_observed_depth": self.max_observed_depth,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "backpressure_waits": self.backpressure_waits,
+            "flushes": self.flushes,
+            "avg_batch_size": (self.flushed + self.failed) / self.flushes if self.flushes else 0.0,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+            "max_flush_ms": self.max_flush_ms
+        }
+    
+    async def stop(self, timeout: float = 10.0):
+        """Flush everything still queued, then stop the worker"""
+        if self._worker and not self._worker.done():
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"Write-behind queue stopped with {self._queue.qsize()} records unflushed"
+                )
+            
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        logger.info("Write-behind queue stopped")
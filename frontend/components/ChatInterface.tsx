@@ -7,13 +7,103 @@ import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
 import toast from 'react-hot-toast';
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+/**
+ * Send a query to /query/stream and render the answer as tokens arrive.
+ * The assistant message is appended on the "meta" event and grown in place
+ * on every "token" event.
+ */
+async function streamMessage(query: string) {
+  const { currentSession, selectedAgent } = useChatStore.getState();
+
+  useChatStore.setState((state: any) => ({
+    messages: [...state.messages, { role: 'user', content: query }],
+    isLoading: true,
+  }));
+
+  const response = await fetch(`${API_URL}/query/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      query,
+      session_id: currentSession?.id,
+      agent_type: selectedAgent || undefined,
+    }),
+  });
+
+  if (!response.ok || !response.body) {
+    useChatStore.setState({ isLoading: false });
+    throw new Error(`Stream request failed: ${response.status}`);
+  }
+
+  const updateAssistant = (update: (message: any) => any) => {
+    useChatStore.setState((state: any) => {
+      const messages = [...state.messages];
+      messages[messages.length - 1] = update(messages[messages.length - 1]);
+      return { messages };
+    });
+  };
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  try {
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop() || '';
+
+      for (const raw of events) {
+        const eventLine = raw.split('\n').find((line) => line.startsWith('event: '));
+        const dataLine = raw.split('\n').find((line) => line.startsWith('data: '));
+        if (!eventLine || !dataLine) continue;
+
+        const event = eventLine.slice('event: '.length);
+        const data = JSON.parse(dataLine.slice('data: '.length));
+
+        if (event === 'session' && !currentSession) {
+          useChatStore.setState((state: any) => ({
+            currentSession: { ...(state.currentSession || {}), id: data.session_id },
+          }));
+        } else if (event === 'meta') {
+          useChatStore.setState((state: any) => ({
+            messages: [
+              ...state.messages,
+              {
+                role: 'assistant',
+                content: '',
+                agent_type: data.agent_type,
+                sources: data.sources,
+              },
+            ],
+            isLoading: false,
+          }));
+        } else if (event === 'token') {
+          updateAssistant((message) => ({
+            ...message,
+            content: message.content + data.content,
+          }));
+        } else if (event === 'error') {
+          throw new Error(data.detail);
+        }
+      }
+    }
+  } finally {
+    useChatStore.setState({ isLoading: false });
+  }
+}
+
 export function ChatInterface() {
   const {
     messages,
     isLoading,
     selectedAgent,
     agents,
-    sendMessage,
   } = useChatStore();
 
   const [input, setInput] = useState('');
@@ -39,7 +129,7 @@ export function ChatInterface() {
     setInput('');
 
     try {
-      await sendMessage(query);
+      await streamMessage(query);
     } catch (error) {
       toast.error('Failed to send message. Please try again.');
     }
@@ -239,7 +329,11 @@ function EmptyState() {
           {suggestions.map((suggestion, idx) => (
             <button
               key={idx}
-              onClick={() => useChatStore.getState().sendMessage(suggestion.query)}
+              onClick={() =>
+                streamMessage(suggestion.query).catch(() =>
+                  toast.error('Failed to send message. Please try again.')
+                )
+              }
               className="card-macos p-4 text-left hover:shadow-macos-lg transition-all duration-200 hover:-translate-y-0.5"
             >
               <div className="flex items-start gap-3">